@@ -0,0 +1,424 @@
+"""
+Модуль компактной матрицы активности клиент × период
+"""
+import numpy as np
+import pandas as pd
+from utils import canonical_client_keys, client_key_array, get_sorted_periods
+from instrumentation import timed_stage
+
+
+class ClientActivityMatrix:
+    """Разреженная булева матрица активности клиентов по периодам в формате CSR.
+
+    Строки — клиенты (целочисленные id), столбцы — периоды в порядке sorted_periods.
+    Хранятся только индексы активных периодов каждого клиента (indptr/indices),
+    индексы внутри строки отсортированы по возрастанию. Строится один раз из пар
+    (период, клиент) и используется всеми расчётами вместо исходного DataFrame.
+
+    Attributes:
+        clients: массив кодов клиентов (id клиента = позиция в массиве); для компактной
+            таблицы — канонические ключи (int64 или объекты), см. ingestion.compact_upload
+        periods: отсортированный список периодов
+        indptr: границы строк CSR (длина n_clients + 1)
+        indices: индексы активных периодов (длина nnz)
+    """
+
+    def __init__(self, clients, periods, indptr, indices):
+        self.clients = clients
+        self.periods = list(periods)
+        self.indptr = indptr
+        self.indices = indices
+        self._csc = None
+        self._sort_rank = None
+
+    @property
+    def n_clients(self):
+        return len(self.clients)
+
+    @property
+    def n_periods(self):
+        return len(self.periods)
+
+    @property
+    def nnz(self):
+        return len(self.indices)
+
+    @property
+    def nbytes(self):
+        """Приблизительный объём памяти структуры в байтах (без учёта строк в clients)."""
+        total = self.clients.nbytes + self.indptr.nbytes + self.indices.nbytes
+        if self._csc is not None:
+            total += self._csc[0].nbytes + self._csc[1].nbytes
+        if self._sort_rank is not None:
+            total += self._sort_rank.nbytes
+        return total
+
+    def _row_ids(self):
+        """id клиента для каждого ненулевого элемента."""
+        return np.repeat(np.arange(self.n_clients), np.diff(self.indptr))
+
+    def to_csc(self):
+        """Возвращает представление CSC (период -> клиенты), вычисляется один раз.
+
+        Returns:
+            tuple: (col_indptr, col_clients) — границы столбцов и id клиентов в них
+        """
+        if self._csc is None:
+            order = np.argsort(self.indices, kind='stable')
+            col_clients = self._row_ids()[order]
+            col_indptr = np.zeros(self.n_periods + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.indices, minlength=self.n_periods), out=col_indptr[1:])
+            self._csc = (col_indptr, col_clients)
+        return self._csc
+
+    def first_period_idx(self):
+        """Индекс первого периода активности (когорты) для каждого клиента."""
+        return self.indices[self.indptr[:-1]]
+
+    def cohort_sizes(self):
+        """Количество клиентов каждой когорты (диагональ когортной матрицы без построения P × P)."""
+        return np.bincount(self.first_period_idx(), minlength=self.n_periods)
+
+    def last_period_idx(self):
+        """Индекс последнего периода активности для каждого клиента."""
+        return self.indices[self.indptr[1:] - 1]
+
+    def first_return_idx(self):
+        """Индекс первого периода возврата после когорты (-1, если клиент не возвращался)."""
+        counts = np.diff(self.indptr)
+        result = np.full(self.n_clients, -1, dtype=np.int64)
+        has_return = counts > 1
+        result[has_return] = self.indices[self.indptr[:-1][has_return] + 1]
+        return result
+
+    def return_streaks(self):
+        """Максимальная серия возвратов подряд для каждого клиента.
+
+        Серия — число идущих подряд периодов с покупками после периода когорты
+        (сам период когорты не учитывается). 0 — клиент не возвращался.
+
+        Returns:
+            np.ndarray: длина максимальной серии для каждого клиента
+        """
+        streaks = np.zeros(self.n_clients, dtype=np.int64)
+        if self.nnz == 0:
+            return streaks
+        is_return = np.ones(self.nnz, dtype=bool)
+        is_return[self.indptr[:-1]] = False
+        prev_indices = np.concatenate(([-2], self.indices[:-1]))
+        prev_is_return = np.concatenate(([False], is_return[:-1]))
+        # Продолжение серии: предыдущий элемент той же строки — тоже возврат в соседний период
+        continues = is_return & prev_is_return & (self.indices == prev_indices + 1)
+        starts = is_return & ~continues
+        if not starts.any():
+            return streaks
+        run_ids = np.cumsum(starts) - 1
+        run_lengths = np.bincount(run_ids[is_return], minlength=int(starts.sum()))
+        np.maximum.at(streaks, self._row_ids()[starts], run_lengths)
+        return streaks
+
+    @timed_stage('activity_matrix.window')
+    def window(self, start_idx, end_idx):
+        """Матрица активности в окне периодов с start_idx по end_idx включительно.
+
+        Клиенты без покупок в окне не входят в результат; когорта клиента — первый
+        период с покупкой внутри окна. Исходные данные не пересчитываются.
+
+        Args:
+            start_idx: индекс первого периода окна
+            end_idx: индекс последнего периода окна
+
+        Returns:
+            ClientActivityMatrix: матрица активности окна
+        """
+        in_window = (self.indices >= start_idx) & (self.indices <= end_idx)
+        counts = np.bincount(self._row_ids()[in_window], minlength=self.n_clients)
+        kept = counts > 0
+        indptr = np.zeros(int(kept.sum()) + 1, dtype=np.int64)
+        np.cumsum(counts[kept], out=indptr[1:])
+        indices = (self.indices[in_window] - start_idx).astype(self.indices.dtype)
+        return ClientActivityMatrix(self.clients[kept], self.periods[start_idx:end_idx + 1], indptr, indices)
+
+    def client_sort_rank(self):
+        """Ранг каждого клиента при сортировке кодов (порядок sorted() по исходным кодам).
+
+        Если коды несравнимы между собой (числа вперемешку со строками), сначала идут
+        числовые коды по значению (целые ключи сравниваются точно, без float), затем
+        остальные как строки. Вычисляется один раз.
+        """
+        if self._sort_rank is None:
+            try:
+                order = np.argsort(self.clients, kind='stable')
+            except TypeError:
+                numeric = pd.to_numeric(pd.Series(self.clients, dtype=object), errors='coerce').to_numpy(dtype=float)
+                values = np.array([c if isinstance(c, int) else n for c, n in zip(self.clients.tolist(), numeric)],
+                                  dtype=object)
+                numbers, texts = np.flatnonzero(~np.isnan(numeric)), np.flatnonzero(np.isnan(numeric))
+                order = np.concatenate([
+                    numbers[np.argsort(values[numbers], kind='stable')],
+                    texts[np.argsort(self.clients[texts].astype(str), kind='stable')],
+                ])
+            rank = np.empty(self.n_clients, dtype=np.int64)
+            rank[order] = np.arange(self.n_clients)
+            self._sort_rank = rank
+        return self._sort_rank
+
+    def churned_mask(self):
+        """Признак оттока для каждого клиента: после периода когорты покупок не было."""
+        return np.diff(self.indptr) == 1
+
+    def churned_clients(self):
+        """Коды клиентов оттока всех когорт, упорядоченные по коду."""
+        churned = np.flatnonzero(self.churned_mask())
+        return self.clients[churned[np.argsort(self.client_sort_rank()[churned])]].tolist()
+
+    @timed_stage('activity_matrix.churn_clients_by_cohort')
+    def churn_clients_by_cohort(self):
+        """Словарь когорта -> упорядоченный список кодов клиентов оттока (как get_churn_clients).
+
+        Все списки выводятся из одного признака churned_mask без пересечения множеств по периодам.
+        """
+        churned = np.flatnonzero(self.churned_mask())
+        cohort_idx = self.first_period_idx()[churned]
+        order = np.lexsort((self.client_sort_rank()[churned], cohort_idx))
+        churned = churned[order]
+        bounds = np.searchsorted(cohort_idx[order], np.arange(self.n_periods + 1))
+        return {
+            period: self.clients[churned[bounds[idx]:bounds[idx + 1]]].tolist()
+            for idx, period in enumerate(self.periods)
+        }
+
+    def client_ids(self, client_values):
+        """id клиента для каждого значения кода клиента (-1 — клиента нет в матрице)."""
+        return _positions(client_values, self.clients)
+
+    def period_ids(self, period_values):
+        """Индекс периода для каждого значения периода (-1 — периода нет в матрице)."""
+        return _positions(period_values, self.periods)
+
+    @timed_stage('activity_matrix.client_cohorts')
+    def client_cohorts(self):
+        """Словарь клиент -> период когорты (совместим с get_client_cohorts)."""
+        first_idx = self.first_period_idx()
+        return {client: self.periods[idx] for client, idx in zip(self.clients.tolist(), first_idx.tolist())}
+
+    @timed_stage('activity_matrix.period_clients')
+    def period_clients(self):
+        """Словарь период -> множество клиентов (совместим с create_period_clients_cache)."""
+        col_indptr, col_clients = self.to_csc()
+        clients = self.clients
+        return {
+            period: set(clients[col_clients[col_indptr[idx]:col_indptr[idx + 1]]].tolist())
+            for idx, period in enumerate(self.periods)
+        }
+
+    def cohort_matrix_values(self):
+        """Когортная матрица в виде массива P × P.
+
+        Ячейка [когорта, период] — число клиентов когорты, активных в периоде;
+        на диагонали — размер когорты (период когорты всегда активен у клиента).
+        """
+        n = self.n_periods
+        cohort_of_entry = np.repeat(self.first_period_idx(), np.diff(self.indptr))
+        counts = np.bincount(cohort_of_entry * n + self.indices, minlength=n * n)
+        return counts.reshape(n, n)
+
+    def accumulation_matrix_values(self):
+        """Матрица накопления возврата в виде массива P × P.
+
+        Ячейка [когорта, период] после диагонали — число клиентов когорты, вернувшихся
+        хотя бы раз в периодах после когорты до указанного включительно (накопительная
+        сумма по первому возврату); на диагонали — размер когорты, до диагонали — 0.
+        """
+        n = self.n_periods
+        cohort_idx = self.first_period_idx()
+        first_return = self.first_return_idx()
+        returned = first_return >= 0
+        first_returns = np.bincount(
+            cohort_idx[returned] * n + first_return[returned], minlength=n * n
+        ).reshape(n, n)
+        matrix = np.cumsum(first_returns, axis=1)
+        cohort_sizes = np.bincount(cohort_idx, minlength=n)
+        matrix[np.arange(n), np.arange(n)] = cohort_sizes
+        return matrix
+
+    @timed_stage('activity_matrix.cohort_matrix')
+    def cohort_matrix(self):
+        """Когортная матрица как DataFrame (аналог build_cohort_matrix)."""
+        return pd.DataFrame(self.cohort_matrix_values(), index=self.periods, columns=self.periods)
+
+    @timed_stage('activity_matrix.accumulation_matrix')
+    def accumulation_matrix(self):
+        """Матрица накопления возврата как DataFrame (аналог build_accumulation_matrix)."""
+        return pd.DataFrame(self.accumulation_matrix_values(), index=self.periods, columns=self.periods)
+
+
+def _positions(values, lookup_values):
+    """Позиция каждого значения в lookup_values (-1 — значение не найдено)."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Категориальный столбец (ingestion.compact_upload): сопоставляются только категории
+        category_positions = pd.Index(lookup_values).get_indexer(values.cat.categories)
+        return np.append(category_positions, -1)[values.cat.codes.to_numpy()]
+    return pd.Index(lookup_values).get_indexer(values)
+
+
+def _slice_labels(values):
+    """Номер среза для каждого значения (по названию str(value).strip(), -1 — пустое) и названия срезов.
+
+    Returns:
+        tuple: (массив номеров срезов, отсортированный список названий)
+    """
+    codes, uniques = pd.factorize(values)
+    labels = pd.Index(uniques).astype(str).str.strip()
+    names = sorted(label for label in set(labels) if label)
+    positions = pd.Index(names).get_indexer(labels)
+    return np.append(positions, -1)[codes], names
+
+
+def _client_ids(values):
+    """Id клиента для каждого значения (-1 — пустой код) и массив кодов клиентов по id.
+
+    Компактная таблица (ingestion.compact_upload) уже хранит канонические ключи, как и
+    числовой столбец, — они только нумеруются. Коды исходной выгрузки (строки и числа
+    вперемешку) сводятся к ключам utils.canonical_client_keys по уникальным значениям,
+    чтобы '196107' и 196107.0 были одним клиентом.
+
+    Returns:
+        tuple: (массив id клиентов, массив кодов клиентов)
+    """
+    codes, uniques = pd.factorize(values)
+    if isinstance(values.dtype, pd.CategoricalDtype) or values.dtype.kind in 'iuf':
+        return codes, np.asarray(uniques)
+    keys = canonical_client_keys(np.asarray(uniques, dtype=object))
+    keys[keys == ''] = None
+    key_codes, key_uniques = pd.factorize(keys)
+    return np.append(key_codes, -1)[codes], client_key_array(key_uniques)
+
+
+def canonical_client_frame(df, year_month_col, client_col):
+    """Пары (период, клиент) с каноническими ключами клиентов для расчётов на множествах.
+
+    Компактная таблица и числовой столбец кодов возвращаются как есть; коды исходной
+    выгрузки сводятся к ключам _client_ids ('196107' и 196107.0 — один клиент), строки
+    с пустым кодом отбрасываются.
+
+    Returns:
+        pd.DataFrame: df или новая таблица со столбцами year_month_col, client_col
+    """
+    clients = df[client_col]
+    if isinstance(clients.dtype, pd.CategoricalDtype) or clients.dtype.kind in 'iuf':
+        return df
+    ids, keys = _client_ids(clients)
+    known = ids >= 0
+    return pd.DataFrame(
+        {year_month_col: df[year_month_col].to_numpy()[known], client_col: keys[ids[known]]},
+        index=df.index[known]
+    )
+
+
+@timed_stage()
+def client_cohort_codes(df, year_month_col, client_col, sorted_periods):
+    """Когорты клиентов в компактной форме: индекс первого периода по порядку sorted_periods.
+
+    Периоды переводятся в индексы sorted_periods, минимум по клиенту берётся одним
+    groupby; периоды вне sorted_periods не учитываются, клиенты без таких периодов
+    в результат не попадают. Коды исходной выгрузки сводятся к каноническим ключам
+    (canonical_client_frame).
+
+    Args:
+        df: DataFrame с данными
+        year_month_col: название столбца с периодом
+        client_col: название столбца с кодом клиента
+        sorted_periods: отсортированный список периодов
+
+    Returns:
+        tuple: (массив кодов клиентов в порядке groupby, массив индексов периода когорты)
+    """
+    pairs = canonical_client_frame(df[[year_month_col, client_col]].dropna(), year_month_col, client_col)
+    period_idx = _positions(pairs[year_month_col], sorted_periods)
+    known = period_idx >= 0
+    clients = pairs[client_col][known]
+    first_idx = pd.Series(period_idx[known], index=clients.index).groupby(clients, observed=True).min()
+    return np.asarray(first_idx.index), first_idx.to_numpy()
+
+
+@timed_stage()
+def build_activity_matrix(df, year_month_col, client_col, sorted_periods=None):
+    """Строит разреженную матрицу активности клиент × период из df[[year_month_col, client_col]].
+
+    Строки с пустым периодом или кодом клиента не учитываются (как и в matrix_builder).
+
+    Args:
+        df: DataFrame с данными
+        year_month_col: название столбца с периодом
+        client_col: название столбца с кодом клиента
+        sorted_periods: отсортированный список периодов (если None, вычисляется)
+
+    Returns:
+        ClientActivityMatrix: матрица активности
+    """
+    if sorted_periods is None:
+        sorted_periods = get_sorted_periods(df, year_month_col)
+    pairs = df[[year_month_col, client_col]].dropna()
+    period_codes = _positions(pairs[year_month_col], sorted_periods)
+    all_client_codes, clients = _client_ids(pairs[client_col])
+    known = (period_codes >= 0) & (all_client_codes >= 0)
+    client_codes = all_client_codes[known]
+    present = np.bincount(client_codes, minlength=len(clients)) > 0
+    if not present.all():
+        # Клиенты только с периодами вне sorted_periods в матрицу не входят
+        client_codes = (np.cumsum(present) - 1)[client_codes]
+        clients = clients[present]
+
+    n_periods = len(sorted_periods)
+    keys = np.unique(client_codes.astype(np.int64) * n_periods + period_codes[known])
+    row_ids = keys // n_periods if n_periods else keys
+    indices = (keys % n_periods).astype(np.int32) if n_periods else keys.astype(np.int32)
+    indptr = np.zeros(len(clients) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row_ids, minlength=len(clients)), out=indptr[1:])
+    return ClientActivityMatrix(clients, sorted_periods, indptr, indices)
+
+
+@timed_stage()
+def build_sliced_activity_matrices(df, year_month_col, client_col, slice_col, sorted_periods=None):
+    """Строит матрицы активности для каждого значения столбца среза (продукта) за один проход.
+
+    Значения среза сравниваются как строки без пробелов по краям (как ingestion.get_products);
+    строки с пустым значением среза входят только в общую матрицу, но не в срезы. Периоды
+    у всех срезов общие (sorted_periods), когорта клиента определяется внутри среза.
+
+    Args:
+        df: DataFrame с данными
+        year_month_col: название столбца с периодом
+        client_col: название столбца с кодом клиента
+        slice_col: название столбца среза (продукта)
+        sorted_periods: отсортированный список периодов (если None, вычисляется)
+
+    Returns:
+        dict: название среза -> ClientActivityMatrix (в порядке названий)
+    """
+    if sorted_periods is None:
+        sorted_periods = get_sorted_periods(df, year_month_col)
+    rows = df[[slice_col, year_month_col, client_col]].dropna(subset=[year_month_col, client_col])
+    slice_codes, names = _slice_labels(rows[slice_col])
+    period_codes = _positions(rows[year_month_col], sorted_periods)
+    all_client_codes, clients = _client_ids(rows[client_col])
+    known = (period_codes >= 0) & (slice_codes >= 0) & (all_client_codes >= 0)
+    client_codes = all_client_codes[known]
+
+    # Уникальные тройки (срез, клиент, период), упорядоченные по срезу, затем по клиенту и периоду
+    n_periods = max(len(sorted_periods), 1)
+    n_cells = max(len(clients), 1) * n_periods
+    keys = np.unique(
+        slice_codes[known].astype(np.int64) * n_cells + client_codes.astype(np.int64) * n_periods + period_codes[known]
+    )
+    bounds = np.searchsorted(keys // n_cells, np.arange(len(names) + 1))
+    matrices = {}
+    for slice_idx, name in enumerate(names):
+        slice_keys = keys[bounds[slice_idx]:bounds[slice_idx + 1]] % n_cells
+        slice_clients, row_ids = np.unique(slice_keys // n_periods, return_inverse=True)
+        indptr = np.zeros(len(slice_clients) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(row_ids, minlength=len(slice_clients)), out=indptr[1:])
+        indices = (slice_keys % n_periods).astype(np.int32)
+        matrices[name] = ClientActivityMatrix(clients[slice_clients], sorted_periods, indptr, indices)
+    return matrices
@@ -1,19 +1,17 @@
+import functools
 import re
 import streamlit as st
 import pandas as pd
 import numpy as np
-import io
 import os
+import uuid
+import weakref
 from datetime import datetime
 from openpyxl.styles import PatternFill, Font, Alignment
 from openpyxl.utils import get_column_letter
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')  # Используем неинтерактивный бэкенд
-import seaborn as sns
 # Импорты из новых модулей
-from config import PAGE_CONFIG, TEMPLATE_IMAGE_PATHS, CATEGORIES_TEMPLATE_IMAGE_PATHS
-from utils import parse_period, parse_year_month, create_copy_button, detect_columns
+from config import PAGE_CONFIG, TEMPLATE_IMAGE_PATHS, CATEGORIES_TEMPLATE_IMAGE_PATHS, HEATMAP_DEFAULT_PERIODS
+from utils import parse_period, parse_year_month, create_client_codes_output, detect_columns, get_sorted_periods, format_client_code_for_copy, format_client_codes
 try:
     from utils import normalize_client_code, normalize_period_for_compare
 except ImportError:
@@ -50,58 +48,951 @@ except ImportError:
     def get_period_after_label(sorted_periods):
         """Запасной вариант, если в utils нет функции (старая версия на Cloud)."""
         return 'месяца'
-from data_processing import (
-    get_cohort_clients, get_accumulation_clients, get_client_cohorts,
-    get_churn_clients, get_inflow_clients, build_churn_table,
-    create_period_clients_cache
+from data_processing import build_churn_table, build_summary_table, summary_percent_rows
+from matrix_builder import build_accumulation_percent_matrix, build_inflow_matrix
+from activity_matrix import build_activity_matrix, build_sliced_activity_matrices
+from ui_components import color_gradient, apply_matrix_color_gradient, format_summary_table, format_churn_table
+from excel_exporter import create_full_report_excel
+from heatmap_renderer import HEATMAP_VIEWS, render_heatmap
+from category_analysis import CategoryPresence, build_category_summary_table
+from category_index import build_category_index
+from instrumentation import setup_logging, reset_records, get_records, stage_timer, timed_stage, summarize_records
+from memory_governor import governor
+from ingestion import (
+    read_excel_upload, get_product_column, get_products, get_value_columns, compact_upload, memory_usage_mb,
+    content_digest
 )
-from matrix_builder import (
-    build_cohort_matrix, build_accumulation_matrix,
-    build_accumulation_percent_matrix, build_inflow_matrix
-)
-from ui_components import color_gradient, apply_matrix_color_gradient
-import inspect
-from excel_exporter import (
-    apply_excel_color_formatting, apply_excel_cohort_formatting,
-    apply_excel_percent_formatting, apply_excel_inflow_formatting
+from client_lists_export import (
+    VIEW_ACCUMULATION, VIEW_CHURN, VIEW_INFLOW, VIEW_RETENTION, client_list_ids, remove_export_file,
+    sweep_stale_exports, write_client_lists_csv
 )
+from value_matrices import build_value_matrices, VALUE_TOTAL, VALUE_PER_CLIENT, VALUE_LTV
+from artifact_graph import ArtifactGraph, LazyResults
 
-def _excel_format_kwargs(fn, data_start_row):
-    """Ключевые аргументы для функций форматирования Excel (data_start_row поддерживается не во всех версиях)."""
-    kwargs = {}
-    if "data_start_row" in inspect.signature(fn).parameters:
-        kwargs["data_start_row"] = data_start_row
-    return kwargs
+# Панели страницы — фрагменты Streamlit: виджет внутри фрагмента перезапускает только его функцию,
+# а не весь скрипт. st.fragment есть в Streamlit 1.37+, в 1.33–1.36 — st.experimental_fragment;
+# в более старых версиях панели выполняются как обычные функции при каждом запуске скрипта.
+panel_fragment = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None) or (lambda func: func)
 
+# Виды матриц: подпись переключателя -> (ключ вида, описание)
+MATRIX_VIEWS = {
+    "Динамика уникальных клиентов когорт": (
+        "cohort",
+        "Диагональ показывает количество уникальных клиентов в каждом периоде. Пересечения показывают количество клиентов, которые были активны в обоих периодах."
+    ),
+    "Динамика накопления возврата": (
+        "accumulation",
+        "Показывает накопление уникальных клиентов когорты по периодам. Каждая ячейка содержит количество уникальных клиентов когорты, которые вернулись в любой период от начала когорты до текущего включительно."
+    ),
+    "Динамика накопления возврата в %": (
+        "accumulation_percent",
+        "Показывает долю накопления уникальных клиентов когорты от общего количества клиентов в когорте. Значения выражены в процентах."
+    ),
+    "Приток возврата в %": (
+        "inflow",
+        "Показывает прирост уникальных клиентов когорты между периодами. Диагональ = 0%, первый период после диагонали = процент возврата, остальные = разница между накопительными процентами соседних периодов."
+    ),
+    "Отток клиентов из категории": (
+        "churn",
+        "Показывает клиентов, которые не вернулись в категорию ни разу после периода когорты."
+    ),
+}
 
-def _churn_int(val, default=0):
-    """Число из ячейки таблицы оттока (значение '-' для последней когорты → default)."""
-    if val == '-' or pd.isna(val):
-        return default
-    try:
-        return int(float(val))
-    except (TypeError, ValueError):
-        return default
 
+def get_artifact_store():
+    """Хранилище тяжёлых данных текущей сессии (учитывается в общем бюджете памяти сервера)."""
+    if st.session_state.get('artifact_store') is None:
+        st.session_state.session_uid = uuid.uuid4().hex
+        st.session_state.artifact_store = governor.create_store(st.session_state.session_uid)
+        # Новая сессия: файлы выгрузок, оставшиеся после падения процесса, больше никому не нужны
+        sweep_stale_exports()
+    return st.session_state.artifact_store
 
-def _churn_float(val, default=0.0):
-    """Процент/float из ячейки таблицы оттока (значение '-' → default)."""
-    if val == '-' or pd.isna(val):
-        return default
-    try:
-        return float(val)
-    except (TypeError, ValueError):
-        return default
+
+def _cohort_info(activity_matrix):
+    """Период начала и конца выгрузки, максимум и минимум клиентов по диагонали когортной матрицы."""
+    sorted_periods = activity_matrix.periods
+    diagonal_values = dict(zip(sorted_periods, activity_matrix.cohort_sizes().tolist()))
+    max_clients = max(diagonal_values.values())
+    min_clients = min(diagonal_values.values())
+    return {
+        'num_periods': len(sorted_periods),
+        'first_period': sorted_periods[0],
+        'last_period': sorted_periods[-1],
+        'max_clients': max_clients,
+        'max_period': [period for period, val in diagonal_values.items() if val == max_clients][0],
+        'min_clients': min_clients,
+        'min_period': [period for period, val in diagonal_values.items() if val == min_clients][0],
+    }
+
+
+def _category_presence(activity_matrix, category_index):
+    """Присутствие клиентов оттока в категориях (None, если в файле категорий нет группы или кода клиента)."""
+    if category_index is None or category_index.group_col is None or category_index.client_code_col is None:
+        return None
+    return CategoryPresence(activity_matrix, category_index)
+
+
+def _category_summary(category_presence, churn_table, sorted_periods):
+    """Сводка присутствия клиентов оттока в других категориях по когортам."""
+    if category_presence is None:
+        return None
+    return build_category_summary_table(category_presence, churn_table, get_period_after_label(sorted_periods))
+
+
+def get_artifact_graph():
+    """Граф данных сессии: узлы объявляются один раз, значения хранятся в get_artifact_store().
+
+    Источники задаются в основном потоке страницы: dataset — компактная выгрузка (ключ —
+    SHA-256 файла), columns — столбцы периода, клиента и продукта, category_file — файл
+    категорий (ключ — SHA-256 содержимого), report_options — настройки Excel отчёта.
+    """
+    if st.session_state.get('artifact_graph') is not None:
+        return st.session_state.artifact_graph
+    graph = ArtifactGraph(get_artifact_store())
+    add = graph.add_node
+    # Матрица активности клиент × период — из неё выводятся все матрицы и кэши
+    add('periods', lambda df, columns: get_sorted_periods(df, columns[0]), ('dataset', 'columns'))
+    add('index', lambda df, columns, periods: build_activity_matrix(df, columns[0], columns[1], periods),
+        ('dataset', 'columns', 'periods'))
+    add('cohort_matrix', lambda index: index.cohort_matrix(), ('index',))
+    add('cohort_info', _cohort_info, ('index',))
+    add('accumulation', lambda index: index.accumulation_matrix(), ('index',))
+    add('percent', build_accumulation_percent_matrix, ('accumulation', 'cohort_matrix'))
+    add('inflow', build_inflow_matrix, ('percent',))
+    # Таблица оттока строится по матрицам; исходная выгрузка ей не нужна
+    add('churn', lambda columns, *tables: build_churn_table(None, columns[0], columns[1], *tables),
+        ('columns', 'periods', 'cohort_matrix', 'accumulation', 'percent'))
+    add('churn_clients_by_cohort', lambda index: index.churn_clients_by_cohort(), ('index',))
+    add('all_churn_codes', lambda index: format_client_codes(index.churned_clients()).tolist(), ('index',))
+    add('product_matrices', lambda df, columns, periods: build_sliced_activity_matrices(
+        df, columns[0], columns[1], columns[2], periods
+    ), ('dataset', 'columns', 'periods'))
+    # Файл категорий
+    add('category_index', lambda file: None if file is None else build_category_index(file), ('category_file',))
+    add('category_presence', _category_presence, ('index', 'category_index'))
+    add('category_summary', _category_summary, ('category_presence', 'churn', 'periods'))
+    # Словари по срезам (продукт, окно периодов, показатель): новые срезы добавляются через graph.update,
+    # при новой версии входов словарь начинается заново
+    add('view_results', lambda *inputs: {}, ('dataset', 'columns', 'periods'))
+    add('value_matrices', lambda *inputs: {}, ('dataset', 'columns', 'periods'))
+    add('summary_tables', lambda *inputs: {}, ('dataset', 'columns', 'periods', 'category_file'))
+    # Excel отчёт читает остальные узлы через граф; его входы покрывают все источники
+    add('report', lambda churn, category_file, options: build_full_report_excel(options),
+        ('churn', 'category_file', 'report_options'))
+    st.session_state.artifact_graph = graph
+    return graph
+
+
+def discard_client_lists_export():
+    """Удаляет временный файл со всеми списками клиентов (при загрузке нового файла)."""
+    export_info = st.session_state.get('client_lists_export')
+    if export_info is not None:
+        export_info['cleanup']()
+    st.session_state.client_lists_export = None
+
+
+def update_stage_records():
+    """Объединяет записи об этапах текущего запуска с сохранёнными в session state.
+
+    Этапы, выполненные в этом запуске заново, заменяют старые записи; остальные
+    (например, расчёт матриц при загрузке файла) сохраняются.
+    """
+    records = get_records()
+    rerun_roots = {record['root'] for record in records}
+    kept = [record for record in st.session_state.get('stage_records', []) if record['root'] not in rerun_roots]
+    st.session_state.stage_records = kept + records
+    return st.session_state.stage_records
+
+
+def get_products_label():
+    """Подпись «Продукт построения когорт» из первого столбца первого документа."""
+    return ", ".join(st.session_state.get('products') or [])
+
+
+def get_activity_matrix():
+    """Матрица активности первого файла (пересчитывается, если была вытеснена)."""
+    return get_artifact_graph().get('index')
+
+
+def get_churn_clients_by_cohort():
+    """Словарь когорта -> коды клиентов оттока (по признаку оттока матрицы активности)."""
+    return get_artifact_graph().get('churn_clients_by_cohort')
+
+
+def get_view_results(product=None, bounds=None):
+    """Матрица активности, матрицы и таблица оттока для продукта и окна периодов (кэшируются по срезу).
+
+    Когорты пересчитываются внутри среза по готовым матрицам активности, без повторного
+    разбора исходных данных; каждая таблица вычисляется при первом обращении к ней.
+
+    Args:
+        product: название продукта (None — все продукты)
+        bounds: (индекс первого, индекс последнего периода) окна; None — все периоды
+    """
+    graph = get_artifact_graph()
+    views = graph.get('view_results')
+    results = views.get((product, bounds))
+    if results is None:
+        year_month_col, client_col, _ = graph.get('columns')
+        window_matrix = graph.get('index') if product is None else graph.get('product_matrices')[product]
+        if bounds is not None:
+            window_matrix = window_matrix.window(*bounds)
+        results = LazyResults({
+            'activity_matrix': lambda: window_matrix,
+            'cohort_matrix': window_matrix.cohort_matrix,
+            'accumulation_matrix': window_matrix.accumulation_matrix,
+            'accumulation_percent_matrix': lambda: build_accumulation_percent_matrix(
+                results['accumulation_matrix'], results['cohort_matrix']
+            ),
+            'inflow_matrix': lambda: build_inflow_matrix(results['accumulation_percent_matrix']),
+            'churn_table': lambda: build_churn_table(
+                None, year_month_col, client_col, window_matrix.periods,
+                results['cohort_matrix'], results['accumulation_matrix'], results['accumulation_percent_matrix']
+            ),
+            'all_churn_codes': lambda: format_client_codes(window_matrix.churned_clients()).tolist(),
+        }, on_update=lambda: graph.update('view_results', views))
+        views[(product, bounds)] = results
+        graph.update('view_results', views)
+    return results
+
+
+# Ключ результатов (как у get_view_results) -> узел графа
+FULL_RESULT_NODES = {
+    'periods': 'periods',
+    'activity_matrix': 'index',
+    'cohort_matrix': 'cohort_matrix',
+    'accumulation_matrix': 'accumulation',
+    'accumulation_percent_matrix': 'percent',
+    'inflow_matrix': 'inflow',
+    'churn_table': 'churn',
+    'all_churn_codes': 'all_churn_codes',
+}
+
+
+def get_full_results():
+    """Матрица активности, матрицы и таблица оттока по всем данным; узел графа вычисляется при первом обращении к ключу."""
+    graph = get_artifact_graph()
+    return LazyResults(
+        {key: functools.partial(graph.get, node) for key, node in FULL_RESULT_NODES.items()}, memoize=False
+    )
+
+
+def get_view_matrices(product=None, bounds=None):
+    """Матрицы 1–4 и таблица оттока вида: по срезу или по всем данным.
+
+    Результаты ленивые: вычисляется только то, к чему обращается вызывающий код.
+    """
+    if product is not None or bounds is not None:
+        return get_view_results(product, bounds)
+    return get_full_results()
+
+
+def get_value_matrices(value_col, product=None, bounds=None):
+    """Взвешенные матрицы показателя для продукта и окна периодов (кэшируются по показателю и срезу)."""
+    graph = get_artifact_graph()
+    value_views = graph.get('value_matrices')
+    tables = value_views.get((value_col, product, bounds))
+    if tables is None:
+        df = graph.get('dataset')
+        year_month_col, client_col, product_col = graph.get('columns')
+        if product is None and bounds is None:
+            window_matrix = graph.get('index')
+        else:
+            window_matrix = get_view_results(product, bounds)['activity_matrix']
+        if product is not None:
+            df = df[df[product_col].astype(str).str.strip() == product]
+        tables = build_value_matrices(df, year_month_col, client_col, value_col, window_matrix)
+        value_views[(value_col, product, bounds)] = tables
+        graph.update('value_matrices', value_views)
+    return tables
+
+
+def set_category_file(uploaded_file):
+    """Задаёт файл категорий источником графа (None — файл убран); индекс строится при первом запросе."""
+    key = None if uploaded_file is None else content_digest(uploaded_file)
+    get_artifact_graph().set_source('category_file', uploaded_file, key=key)
 
 
-def _format_client_code_for_copy(val):
-    """Форматирует код клиента для копирования: без десятичной части (347520 вместо 347520.0)."""
-    if val is None or (isinstance(val, float) and pd.isna(val)):
-        return ""
+def get_category_presence():
+    """Присутствие клиентов оттока в категориях (общее для сводки, таблиц когорт и отчёта)."""
+    return get_artifact_graph().get('category_presence')
+
+
+def get_report_options():
+    """Настройки Excel отчёта: (листы по продуктам, тепловые карты матриц 1–4)."""
+    return (
+        bool(st.session_state.get('report_product_slices')) and len(st.session_state.get('products') or []) > 1,
+        bool(st.session_state.get('report_heatmaps')),
+    )
+
+
+@timed_stage()
+def build_full_report_excel(options):
+    """Создаёт полный Excel отчёт со всеми таблицами по данным графа сессии.
+
+    Args:
+        options: настройки отчёта (get_report_options)
+    """
+    product_slices_enabled, heatmaps_enabled = options
+    graph = get_artifact_graph()
+    sorted_periods = graph.get('periods')
+    has_category_file = graph.get('category_file') is not None
+
+    # Таблицы присутствия клиентов оттока в других категориях — по каждой когорте;
+    # если файл категорий не удалось разобрать, отчёт собирается без них
     try:
-        return str(int(float(val)))
-    except (ValueError, TypeError):
-        return str(val).strip()
+        category_presence = graph.get('category_presence')
+        category_summary_table = graph.get('category_summary')
+    except Exception:
+        category_presence = category_summary_table = None
+    category_period_tables = category_presence.period_tables() if category_presence is not None else None
+
+    # Листы по продуктам — если включены и в выгрузке больше одного продукта
+    product_slices = None
+    if product_slices_enabled:
+        product_slices = [(product, get_view_results(product)) for product in st.session_state.get('products') or []]
+
+    # Взвешенные матрицы по каждому числовому показателю выгрузки
+    value_matrices = [(value_col, get_value_matrices(value_col)) for value_col in st.session_state.get('value_cols') or []]
+
+    full_results = get_full_results()
+
+    # Тепловые карты матриц 1–4 рядом с таблицами (картинки из кэша heatmap_renderer, если уже показывались)
+    heatmap_images = None
+    if heatmaps_enabled:
+        heatmap_images = [render_heatmap(full_results[f'{key}_matrix'], key) for key in HEATMAP_VIEWS]
+    return create_full_report_excel(
+        full_results['cohort_matrix'],
+        full_results['accumulation_matrix'],
+        full_results['accumulation_percent_matrix'],
+        full_results['inflow_matrix'],
+        full_results['churn_table'],
+        sorted_periods,
+        products_label=get_products_label(),
+        category_summary_table=category_summary_table,
+        category_period_tables=category_period_tables,
+        include_category_metrics=has_category_file,
+        period_after_label=get_period_after_label(sorted_periods),
+        product_slices=product_slices,
+        value_matrices=value_matrices,
+        heatmap_images=heatmap_images
+    )
+
+
+@panel_fragment
+def render_matrix_panel(view_key, product=None, bounds=None, heatmap=False):
+    """Таблица выбранного вида матрицы; данные берутся из хранилища сессии (get_view_matrices).
+
+    Args:
+        view_key: ключ вида матрицы (MATRIX_VIEWS)
+        product: продукт среза (None — все продукты)
+        bounds: окно периодов (None — все периоды)
+        heatmap: показать матрицы 1–4 тепловой картой вместо стилизованной таблицы
+    """
+    # Из ленивых результатов вычисляется только матрица выбранного вида
+    results = get_view_matrices(product, bounds)
+    display_matrix = None
+
+    # Тепловая карта: одна картинка вместо стилей для каждой ячейки большой матрицы
+    if heatmap and view_key in HEATMAP_VIEWS:
+        matrix = results[f'{view_key}_matrix']
+        try:
+            st.image(render_heatmap(matrix, view_key))
+            st.download_button(
+                label="📥 Скачать тепловую карту (SVG)",
+                data=render_heatmap(matrix, view_key, image_format='svg'),
+                file_name=f"тепловая_карта_{view_key}.svg",
+                mime="image/svg+xml",
+                key=f"download_heatmap_{view_key}"
+            )
+            return
+        except ImportError:
+            st.warning("Для тепловой карты нужен пакет matplotlib — матрица показана таблицей.")
+
+    # Подготовка данных в зависимости от выбранного типа
+    if view_key == "cohort":
+        # Применяем цветовое форматирование; нулевые значения скрываем
+        matrix_int = results['cohort_matrix'].astype(int)
+        display_matrix = apply_matrix_color_gradient(matrix_int.astype(float), horizontal_dynamics=True, hide_before_diagonal=True, hide_zeros=True)
+        display_matrix = display_matrix.format(precision=0, thousands=',', decimal='.')
+
+    elif view_key == "accumulation":
+        matrix_int_accum = results['accumulation_matrix'].astype(int)
+        display_matrix = apply_matrix_color_gradient(matrix_int_accum.astype(float), hide_zeros=True)
+        display_matrix = display_matrix.format(precision=0, thousands=',', decimal='.')
+
+    elif view_key == "accumulation_percent":
+        display_matrix = apply_matrix_color_gradient(results['accumulation_percent_matrix'], hide_zeros=True, horizontal_dynamics=True, hide_before_diagonal=True)
+
+        # Форматирование процентов
+        def format_percent_cell(val):
+            if pd.isna(val) or val == '':
+                return ''
+            try:
+                val_float = float(val)
+                if val_float == 0:
+                    return ''
+                return f"{val_float:.1f}%"
+            except (ValueError, TypeError):
+                if isinstance(val, str) and '%' in val:
+                    return val
+                return ''
+
+        display_matrix = display_matrix.format(formatter=format_percent_cell)
+
+    elif view_key == "inflow":
+        display_matrix = apply_matrix_color_gradient(results['inflow_matrix'], hide_zeros=True, horizontal_dynamics=True, hide_before_diagonal=True)
+
+        # Форматирование процентов для притока
+        def format_inflow_percent_cell(val):
+            if pd.isna(val) or val == '':
+                return ''
+            try:
+                val_float = float(val)
+                if val_float == 0:
+                    return ''
+                return f"{val_float:.1f}%"
+            except (ValueError, TypeError):
+                if isinstance(val, str) and '%' in val:
+                    return val
+                return ''
+
+        # Добавляем 0.0% на диагонали
+        for row_name in display_matrix.data.index:
+            if row_name in display_matrix.data.columns:
+                display_matrix.data.loc[row_name, row_name] = '0.0%'
+
+        format_dict_inflow = {col: format_inflow_percent_cell for col in display_matrix.data.columns}
+        display_matrix = display_matrix.format(format_dict_inflow)
+
+    elif view_key == "churn":
+        # Используем сохраненную таблицу оттока
+        churn_table = results['churn_table']
+        if churn_table is not None:
+
+            # Форматируем таблицу для отображения (когорта — первый столбец)
+            churn_display = format_churn_table(churn_table)
+
+            # Применяем стили для центрирования значений во всех столбцах
+            def center_format(val):
+                return 'text-align: center'
+
+            # Создаем стилизованную таблицу с центрированием
+            styled_churn = churn_display.style.applymap(center_format)
+
+            # Используем styled_churn как display_matrix для единообразия
+            display_matrix = styled_churn
+        else:
+            st.error("Таблица оттока не загружена. Пожалуйста, загрузите данные заново.")
+            display_matrix = None
+
+    # Отображение таблицы (широкая) с поддержкой полноэкранного режима
+    if display_matrix is not None:
+        # Для таблицы оттока скрываем индекс
+        if view_key == "churn":
+            st.dataframe(
+                display_matrix,
+                use_container_width=True,
+                hide_index=True
+            )
+            # Добавляем CSS для центрирования значений в таблице оттока
+            st.markdown("""
+            <style>
+            div[data-testid="stDataFrame"] table td {
+                text-align: center !important;
+            }
+            div[data-testid="stDataFrame"] table th {
+                text-align: center !important;
+            }
+            </style>
+            """, unsafe_allow_html=True)
+        else:
+            st.dataframe(
+                display_matrix,
+                use_container_width=True
+            )
+    else:
+        st.info("Выберите тип отображения для просмотра данных.")
+
+
+@panel_fragment
+def render_client_codes_panel(view_key, product=None, bounds=None):
+    """Панель «Коды клиентов» выбранного вида: смена когорты или периода перезапускает только её.
+
+    Args:
+        view_key: ключ вида матрицы (MATRIX_VIEWS)
+        product: продукт среза (None — все продукты)
+        bounds: окно периодов (None — все периоды)
+    """
+    st.markdown('<div style="background: white; padding: 10px; border-radius: 8px; margin-bottom: 10px; border: 2px solid #ccc; box-shadow: 0 2px 4px rgba(0,0,0,0.1);"><h4 style="color: #333; margin: 0;">👥 Коды клиентов</h4></div>', unsafe_allow_html=True)
+
+    # Коды клиентов выбранной ячейки — из матрицы активности среза (как в client_lists_export)
+    sliced = product is not None or bounds is not None
+    results = get_view_results(product, bounds) if sliced else get_full_results()
+    activity_matrix = results['activity_matrix']
+    view_periods = activity_matrix.periods
+
+    if view_key == "cohort":
+        selected_cohort = st.selectbox(
+            "Когорта:",
+            options=view_periods,
+            index=0,
+            help="Выберите период, когда клиенты впервые появились",
+            key="cohort_select_unified_1"
+        )
+
+        selected_period = st.selectbox(
+            "Период:",
+            options=view_periods,
+            index=min(1, len(view_periods) - 1) if len(view_periods) > 1 else 0,
+            help="Выберите период, для которого нужно показать клиентов",
+            key="period_select_unified_1"
+        )
+
+        if selected_cohort and selected_period:
+            common_clients = client_list_ids(activity_matrix, VIEW_RETENTION, selected_cohort, selected_period)
+
+            if len(common_clients):
+                st.write(f"**Найдено: {len(common_clients)}**")
+                clients_codes = format_client_codes(activity_matrix.clients[common_clients]).tolist()
+                create_client_codes_output(
+                    clients_codes,
+                    f"📋 Копировать ({len(common_clients)})",
+                    "copy_clients_unified_1",
+                    blob_store=get_artifact_store()
+                )
+            else:
+                st.info(f"❌ Нет данных")
+
+    elif view_key == "accumulation":
+        selected_cohort = st.selectbox(
+            "Когорта:",
+            options=view_periods,
+            index=0,
+            help="Выберите период когорты",
+            key="cohort_select_unified_2"
+        )
+
+        selected_period = st.selectbox(
+            "Период:",
+            options=view_periods,
+            index=min(1, len(view_periods) - 1) if len(view_periods) > 1 else 0,
+            help="Выберите период, до которого показывать накопленных клиентов",
+            key="period_select_unified_2"
+        )
+
+        if selected_cohort and selected_period:
+            accumulation_clients = client_list_ids(activity_matrix, VIEW_ACCUMULATION, selected_cohort, selected_period)
+
+            if len(accumulation_clients):
+                st.write(f"**Найдено: {len(accumulation_clients)}**")
+                clients_codes = format_client_codes(activity_matrix.clients[accumulation_clients]).tolist()
+                create_client_codes_output(
+                    clients_codes,
+                    f"📋 Копировать ({len(accumulation_clients)})",
+                    "copy_clients_unified_2",
+                    blob_store=get_artifact_store()
+                )
+            else:
+                st.info(f"❌ Нет данных")
+
+    elif view_key == "accumulation_percent":
+        selected_cohort = st.selectbox(
+            "Когорта:",
+            options=view_periods,
+            index=0,
+            help="Выберите период когорты",
+            key="cohort_select_unified_3"
+        )
+
+        selected_period = st.selectbox(
+            "Период:",
+            options=view_periods,
+            index=min(1, len(view_periods) - 1) if len(view_periods) > 1 else 0,
+            help="Выберите период, до которого показывать накопленных клиентов",
+            key="period_select_unified_3"
+        )
+
+        if selected_cohort and selected_period:
+            accumulation_clients = client_list_ids(activity_matrix, VIEW_ACCUMULATION, selected_cohort, selected_period)
+
+            if len(accumulation_clients):
+                st.write(f"**Найдено: {len(accumulation_clients)}**")
+                clients_codes = format_client_codes(activity_matrix.clients[accumulation_clients]).tolist()
+                create_client_codes_output(
+                    clients_codes,
+                    f"📋 Копировать ({len(accumulation_clients)})",
+                    "copy_clients_unified_3",
+                    blob_store=get_artifact_store()
+                )
+            else:
+                st.info(f"❌ Нет данных")
+
+    elif view_key == "inflow":
+        selected_cohort = st.selectbox(
+            "Когорта:",
+            options=view_periods,
+            index=0,
+            help="Выберите период когорты",
+            key="cohort_select_unified_4"
+        )
+
+        selected_period = st.selectbox(
+            "Период:",
+            options=view_periods,
+            index=min(1, len(view_periods) - 1) if len(view_periods) > 1 else 0,
+            help="Выберите период, для которого показать новых вернувшихся клиентов",
+            key="period_select_unified_4"
+        )
+
+        if selected_cohort and selected_period:
+            inflow_clients = client_list_ids(activity_matrix, VIEW_INFLOW, selected_cohort, selected_period)
+
+            if len(inflow_clients):
+                st.write(f"**Найдено: {len(inflow_clients)}**")
+                clients_codes = format_client_codes(activity_matrix.clients[inflow_clients]).tolist()
+                create_client_codes_output(
+                    clients_codes,
+                    f"📋 Копировать ({len(inflow_clients)})",
+                    "copy_clients_unified_4",
+                    blob_store=get_artifact_store()
+                )
+            else:
+                st.info(f"❌ Нет данных")
+
+    elif view_key == "churn":
+        # Для оттока только выбор когорты, без периода
+        selected_cohort = st.selectbox(
+            "Когорта:",
+            options=view_periods,
+            index=0,
+            help="Выберите когорту для скачивания списка клиентов оттока из категории",
+            key="cohort_select_unified_5"
+        )
+
+        if selected_cohort:
+            churn_clients = client_list_ids(activity_matrix, VIEW_CHURN, selected_cohort)
+
+            if len(churn_clients):
+                st.write(f"**Найдено: {len(churn_clients)}**")
+                clients_codes = format_client_codes(activity_matrix.clients[churn_clients]).tolist()
+                create_client_codes_output(
+                    clients_codes,
+                    f"📋 Копировать ({len(churn_clients)})",
+                    "copy_clients_unified_5",
+                    blob_store=get_artifact_store()
+                )
+            else:
+                st.info(f"❌ Нет данных")
+
+            # Кнопка для скачивания всех когорт (всегда видна); список рассчитывается один раз на данные
+            all_churn_codes = results['all_churn_codes']
+            if all_churn_codes:
+                create_client_codes_output(
+                    all_churn_codes,
+                    f"📋 Копировать коды клиентов оттока всех когорт ({len(all_churn_codes)})",
+                    "copy_all_churn_clients",
+                    file_name="коды_клиентов_оттока_всех_когорт.txt",
+                    blob_store=get_artifact_store()
+                )
+
+    # Все списки клиентов одним файлом: вид, когорта, период, код клиента
+    st.markdown("---")
+    st.caption("Все списки клиентов по всем когортам и периодам одним файлом (CSV, сжатый gzip)")
+    export_info = st.session_state.get('client_lists_export')
+    prepared = export_info is not None and os.path.exists(export_info['path'])
+    # Файл отдаётся только в запуске после нажатия кнопки (как полный отчёт): остальные
+    # перезапуски панели (смена когорты или периода) его не перечитывают
+    if st.button(
+        "📦 Получить файл со всеми списками" if prepared else "📦 Подготовить файл со всеми списками",
+        key="prepare_client_lists_export",
+        use_container_width=True
+    ):
+        if not prepared:
+            with st.spinner("Формирование файла со всеми списками..."):
+                export_path, export_rows = write_client_lists_csv(get_activity_matrix())
+            # Файл живёт не дольше сессии: удаляется вместе с её хранилищем данных
+            cleanup = weakref.finalize(get_artifact_store(), remove_export_file, export_path)
+            export_info = {'path': export_path, 'rows': export_rows, 'cleanup': cleanup}
+            st.session_state.client_lists_export = export_info
+        export_rows = f"{export_info['rows']:,}".replace(',', ' ')
+        export_mb = os.path.getsize(export_info['path']) / (1024 * 1024)
+        with open(export_info['path'], 'rb') as export_file:
+            st.download_button(
+                label=f"📥 Скачать все списки ({export_rows} строк, {export_mb:.1f} МБ)",
+                data=export_file,
+                file_name=f"списки_клиентов_{st.session_state.sorted_periods[0]}_{st.session_state.sorted_periods[-1]}.csv.gz",
+                mime="application/gzip",
+                use_container_width=True,
+                key="download_client_lists_export"
+            )
+
+
+@panel_fragment
+def render_value_panel(value_cols, product=None, bounds=None):
+    """Блок «Когорты по показателю»: выбор показателя и вида перезапускает только этот блок."""
+    st.markdown("---")
+    st.subheader("💰 Когорты по показателю")
+    col_value_select, col_value_view = st.columns([1, 3])
+    with col_value_select:
+        value_col = st.selectbox(
+            "Показатель:",
+            options=value_cols,
+            help="Числовой столбец выгрузки, суммируемый по когорте и периоду",
+            key="value_col_selector"
+        )
+    with col_value_view:
+        value_view = st.radio(
+            "",
+            options=[VALUE_TOTAL, VALUE_PER_CLIENT, VALUE_LTV],
+            horizontal=True,
+            key="value_view_selector"
+        )
+    value_descriptions = {
+        VALUE_TOTAL: "Сумма показателя клиентов когорты в каждом периоде.",
+        VALUE_PER_CLIENT: "Сумма показателя когорты в периоде, делённая на количество клиентов когорты, активных в этом периоде.",
+        VALUE_LTV: "Накопленная с периода когорты сумма показателя, делённая на количество клиентов когорты.",
+    }
+    st.markdown(f'<div class="description-block">{value_descriptions[value_view]}</div>', unsafe_allow_html=True)
+    value_matrix = get_value_matrices(value_col, product, bounds)[value_view]
+    display_value_matrix = apply_matrix_color_gradient(
+        value_matrix, hide_zeros=True, horizontal_dynamics=True, hide_before_diagonal=True
+    )
+    st.dataframe(
+        display_value_matrix.format(precision=2, thousands=' ', decimal=','),
+        use_container_width=True
+    )
+
+
+@panel_fragment
+def render_category_cohort_panel():
+    """Присутствие клиентов оттока выбранной когорты в других категориях (выбор когорты перезапускает только панель)."""
+    sorted_periods = st.session_state.sorted_periods
+    full_churn_table = get_full_results()['churn_table']
+    st.markdown("### 📊 Присутствие клиентов оттока когорты в других категориях товаров")
+
+    col_cohort_select, col_table = st.columns([1, 4])
+
+    with col_cohort_select:
+        selected_cohort = st.selectbox(
+            "Выберите когорту:",
+            options=sorted_periods,
+            index=0,
+            help="Выберите когорту для анализа присутствия её клиентов оттока в других категориях",
+            key="category_cohort_select"
+        )
+
+        # Клиенты оттока выбранной когорты (из первого файла, упорядочены по коду)
+        cohort_churn_clients = get_churn_clients_by_cohort().get(selected_cohort, [])
+
+        # Получаем размер когорты и отток из churn_table
+        churn_by_cohort = full_churn_table.set_index('Когорта').fillna(0)
+        cohort_size = int(churn_by_cohort['Кол-во клиентов когорты'].get(selected_cohort, 0))
+        churn_count = int(churn_by_cohort['Отток кол-во'].get(selected_cohort, 0))
+
+        # Клиенты оттока, присутствующие в других категориях ПОСЛЕ периода когорты (столбец периода — из второго файла)
+        category_presence = get_category_presence()
+        present_in_categories_after_cohort = category_presence.present_clients(selected_cohort)
+        present_count_after_cohort = len(present_in_categories_after_cohort)
+        present_percent_after_cohort = (present_count_after_cohort / cohort_size * 100) if cohort_size > 0 else 0
+
+        # Отток из сети = Отток из категории - Клиентов когорты присутствуют в других категориях после месяца когорты
+        network_churn = churn_count - present_count_after_cohort
+        network_churn = max(0, network_churn)  # Не может быть отрицательным
+        network_churn_percent = (network_churn / cohort_size * 100) if cohort_size > 0 else 0
+
+        # Клиенты оттока из сети — не присутствуют в других категориях после месяца когорты
+        network_churn_clients_list = [
+            client for client in cohort_churn_clients if client not in present_in_categories_after_cohort
+        ]
+
+        _pa_label = st.session_state.get('period_after_label', 'месяца')
+        metrics_html = f"""
+        <div style="line-height: 2;">
+        <p style="color: #333; font-size: 1rem; margin: 8px 0;">
+            <strong style="color: #1f77b4;">Клиентов когорты присутствуют в других категориях после {_pa_label} когорты:</strong> 
+            <span style="color: #2c3e50; font-weight: 600;">{present_count_after_cohort} ({present_percent_after_cohort:.1f}%)</span>
+        </p>
+        <p style="color: #333; font-size: 1rem; margin: 8px 0;">
+            <strong style="color: #1f77b4;">Отток из сети:</strong> 
+            <span style="color: #e74c3c; font-weight: 600;">{network_churn} ({network_churn_percent:.1f}%)</span>
+        </p>
+        </div>
+        """
+        st.markdown(metrics_html, unsafe_allow_html=True)
+
+        # Кнопка копирования кодов клиентов оттока из сети для выбранной когорты
+        if network_churn_clients_list:
+            network_churn_clients_codes = [format_client_code_for_copy(client) for client in network_churn_clients_list]
+            create_client_codes_output(
+                network_churn_clients_codes,
+                f"📋 Копировать коды клиентов оттока из сети ({len(network_churn_clients_list)})",
+                f"copy_network_churn_{selected_cohort}",
+                blob_store=get_artifact_store()
+            )
+        else:
+            st.info("ℹ️ Отток из сети равен 0 или все клиенты оттока присутствуют в других категориях")
+
+    with col_table:
+        # Таблица: категории по строкам, периоды ПОСЛЕ выбранной когорты по столбцам, с итогами
+        category_period_table_with_totals = category_presence.period_table(selected_cohort)
+
+        # Отображаем основную таблицу с итогами
+        st.dataframe(
+            category_period_table_with_totals,
+            use_container_width=True
+        )
+
+        # Добавляем стили для центрирования, выделения итоговых значений жирным, пастельным цветом и закрепления
+        st.markdown("""
+        <style>
+        div[data-testid="stDataFrame"] table td {
+            text-align: center !important;
+        }
+        div[data-testid="stDataFrame"] table th {
+            text-align: center !important;
+        }
+        /* Закрепляем первую строку (итоговая строка "Итого клиентов") сверху */
+        div[data-testid="stDataFrame"] table tbody tr:first-child td,
+        div[data-testid="stDataFrame"] table tbody tr:first-child th {
+            font-weight: bold !important;
+            background-color: #E3F2FD !important;
+            position: sticky !important;
+            top: 0 !important;
+            z-index: 10 !important;
+        }
+        /* Закрепляем первый столбец данных (итоговый столбец "Итого") слева */
+        div[data-testid="stDataFrame"] table tbody tr td:nth-child(2),
+        div[data-testid="stDataFrame"] table thead tr th:nth-child(2) {
+            font-weight: bold !important;
+            background-color: #E3F2FD !important;
+            position: sticky !important;
+            left: 0 !important;
+            z-index: 5 !important;
+        }
+        /* Закрепляем ячейку пересечения итоговых строки и столбца (и сверху, и слева) */
+        div[data-testid="stDataFrame"] table tbody tr:first-child td:nth-child(2) {
+            background-color: #BBDEFB !important;
+            font-weight: bold !important;
+            position: sticky !important;
+            top: 0 !important;
+            left: 0 !important;
+            z-index: 15 !important;
+        }
+        /* Закрепляем заголовок итогового столбца */
+        div[data-testid="stDataFrame"] table thead tr th:nth-child(2) {
+            position: sticky !important;
+            left: 0 !important;
+            z-index: 6 !important;
+        }
+        </style>
+        <script>
+        // Дополнительный скрипт для гарантированного выделения жирным, цветом и закрепления
+        setTimeout(function() {
+            const tables = document.querySelectorAll('div[data-testid="stDataFrame"] table');
+            tables.forEach(table => {
+                // Первая строка (итоговая) - закрепляем сверху
+                const firstRow = table.querySelector('tbody tr:first-child');
+                if (firstRow) {
+                    firstRow.querySelectorAll('td, th').forEach(cell => {
+                        cell.style.fontWeight = 'bold';
+                        cell.style.position = 'sticky';
+                        cell.style.top = '0';
+                        cell.style.zIndex = '10';
+                        if (!cell.style.backgroundColor || cell.style.backgroundColor === '') {
+                            cell.style.backgroundColor = '#E3F2FD';
+                        }
+                    });
+                }
+                // Первый столбец данных (итоговый) - закрепляем слева
+                table.querySelectorAll('tbody tr').forEach(row => {
+                    const firstDataCell = row.querySelector('td:nth-child(2)');
+                    if (firstDataCell) {
+                        firstDataCell.style.fontWeight = 'bold';
+                        firstDataCell.style.position = 'sticky';
+                        firstDataCell.style.left = '0';
+                        firstDataCell.style.zIndex = '5';
+                        if (!firstDataCell.style.backgroundColor || firstDataCell.style.backgroundColor === '') {
+                            firstDataCell.style.backgroundColor = '#E3F2FD';
+                        }
+                    }
+                });
+                const firstHeader = table.querySelector('thead th:nth-child(2)');
+                if (firstHeader) {
+                    firstHeader.style.fontWeight = 'bold';
+                    firstHeader.style.backgroundColor = '#E3F2FD';
+                    firstHeader.style.position = 'sticky';
+                    firstHeader.style.left = '0';
+                    firstHeader.style.zIndex = '6';
+                }
+                // Ячейка пересечения - закрепляем и сверху, и слева
+                const intersectionCell = table.querySelector('tbody tr:first-child td:nth-child(2)');
+                if (intersectionCell) {
+                    intersectionCell.style.backgroundColor = '#BBDEFB';
+                    intersectionCell.style.position = 'sticky';
+                    intersectionCell.style.top = '0';
+                    intersectionCell.style.left = '0';
+                    intersectionCell.style.zIndex = '15';
+                }
+            });
+        }, 100);
+        </script>
+        """, unsafe_allow_html=True)
+
+
+@panel_fragment
+def render_summary_panel(product=None, bounds=None):
+    """Сводная таблица по всем когортам выбранного среза (кэшируется, см. summary_tables)."""
+    sliced = product is not None or bounds is not None
+    if sliced:
+        window_results = get_view_results(product, bounds)
+        churn_table = window_results['churn_table']
+        view_periods = window_results['activity_matrix'].periods
+    else:
+        full_results = get_full_results()
+        churn_table = full_results['churn_table']
+        view_periods = full_results['periods']
+    st.markdown("---")
+    st.subheader("📊 Сводная таблица по всем когортам")
+    st.caption("Чем ближе когорта к последнему периоду в выгрузке, тем менее сопоставимы метрики: накопленный возврат ещё не успевает сформироваться, а доля оттока завышена из‑за короткого горизонта наблюдения.")
+    if churn_table is not None:
+        # Метрики по категориям рассчитаны по всем периодам — в окне периодов не показываются;
+        # словарь таблиц по срезам начинается заново при смене данных или файла категорий
+        graph = get_artifact_graph()
+        has_categories_file = not sliced and graph.get('category_file') is not None
+        summary_tables = graph.get('summary_tables')
+        summary_df = summary_tables.get((product, bounds))
+        if summary_df is None:
+            summary_df = build_summary_table(
+                churn_table, view_periods,
+                category_summary_table=graph.get('category_summary') if has_categories_file else None,
+                include_category_metrics=has_categories_file,
+                period_after_label=st.session_state.get('period_after_label', 'месяца')
+            )
+            summary_tables[(product, bounds)] = summary_df
+            graph.update('summary_tables', summary_tables)
+
+        # Отображаем таблицу
+        st.dataframe(
+            format_summary_table(summary_df, summary_percent_rows(summary_df)),
+            use_container_width=True
+        )
+
+        # Добавляем стили для центрирования
+        st.markdown("""
+        <style>
+        div[data-testid="stDataFrame"] table td {
+            text-align: center !important;
+        }
+        div[data-testid="stDataFrame"] table th {
+            text-align: center !important;
+        }
+        </style>
+        """, unsafe_allow_html=True)
+    else:
+        st.info("Загрузите данные для отображения сводной таблицы")
+
 
 
 # Настройка страницы
@@ -127,19 +1018,11 @@ div[data-testid="stDataFrame"] td {
 </style>
 """, unsafe_allow_html=True)
 
-# Инициализация session state для хранения загруженных данных
-if 'uploaded_data' not in st.session_state:
-    st.session_state.uploaded_data = None
-
-# Инициализируем флаг загрузки второго файла
-if 'categories_file_uploaded' not in st.session_state:
-    st.session_state.categories_file_uploaded = False
-if 'df' not in st.session_state:
-    st.session_state.df = None
-if 'cohort_matrix' not in st.session_state:
-    st.session_state.cohort_matrix = None
-if 'cohort_info' not in st.session_state:
-    st.session_state.cohort_info = None
+# Замеры этапов: логирование и новый список записей на каждый запуск скрипта
+setup_logging()
+reset_records()
+
+# Инициализация session state (данные и расчёты хранятся в графе сессии, get_artifact_graph)
 if 'sorted_periods' not in st.session_state:
     st.session_state.sorted_periods = None
 if 'year_month_col' not in st.session_state:
@@ -219,26 +1102,48 @@ with col_template_instructions:
 
 if uploaded_file is not None:
     try:
-        # Загрузка Excel файла
-        if uploaded_file.name.endswith('.xlsx'):
-            df = pd.read_excel(uploaded_file, engine='openpyxl')
-        else:
-            df = pd.read_excel(uploaded_file, engine='xlrd')
+        # Новый ли это файл — по SHA-256 содержимого (ключ версии источника dataset графа)
+        graph = get_artifact_graph()
+        dataset_key = content_digest(uploaded_file)
+        is_new_file = graph.key('dataset') != dataset_key
         
-        # Сохранение данных в session state
-        # Проверяем, новый ли это файл
-        is_new_file = (
-            st.session_state.uploaded_data is None or 
-            st.session_state.uploaded_data.name != uploaded_file.name
-        )
-        
-        st.session_state.uploaded_data = uploaded_file
-        st.session_state.df = df
+        # Загрузка Excel файла — только для нового файла; в графе хранится компактная
+        # таблица уникальных строк продукт × период × клиент, исходный DataFrame не сохраняется
+        if is_new_file or graph.get('dataset') is None:
+            df_raw = read_excel_upload(uploaded_file)
+            raw_year_month_col, raw_client_col = detect_columns(df_raw)
+            if raw_year_month_col is not None and raw_client_col is not None:
+                product_col = get_product_column(df_raw, raw_year_month_col, raw_client_col)
+                st.session_state.product_col = product_col
+                st.session_state.products = get_products(df_raw, product_col)
+                value_cols = get_value_columns(df_raw, exclude=(product_col, raw_year_month_col, raw_client_col))
+                st.session_state.value_cols = value_cols
+                df = compact_upload(df_raw, raw_year_month_col, raw_client_col, product_col, value_cols)
+                st.session_state.upload_stats = {
+                    'rows': len(df_raw),
+                    'compact_rows': len(df),
+                    'raw_mb': memory_usage_mb(df_raw),
+                    'compact_mb': memory_usage_mb(df),
+                }
+            else:
+                # Столбцы не найдены — сообщение об ошибке показывается ниже
+                df = df_raw
+                st.session_state.product_col = None
+                st.session_state.products = []
+                st.session_state.value_cols = []
+                st.session_state.upload_stats = None
+            del df_raw
+            # Новая версия dataset удаляет все рассчитанные по старой версии узлы графа
+            graph.set_source('dataset', df, key=dataset_key)
+        else:
+            df = graph.get('dataset')
         
         # Очищаем старую информацию только при загрузке нового файла
         if is_new_file:
-            st.session_state.cohort_info = None
-            st.session_state.cohort_matrix = None
+            discard_client_lists_export()
+            st.session_state.pop('period_window', None)
+            st.session_state.pop('product_slice', None)
+            st.session_state.pop('value_col_selector', None)
             st.session_state.sorted_periods = None
             st.session_state.year_month_col = None
             st.session_state.client_col = None
@@ -259,731 +1164,40 @@ if uploaded_file is not None:
             st.error("❌ Не найден столбец с кодом клиента. Убедитесь, что в файле есть столбец с названием, содержащим 'Код' и 'клиент'.")
             st.stop()
         
-        # Сохраняем выбранные столбцы в session state
+        # Сохраняем выбранные столбцы в session state и источником графа
         st.session_state.year_month_col = year_month_col
         st.session_state.client_col = client_col
+        graph.set_source('columns', (year_month_col, client_col, st.session_state.get('product_col')))
+        # Файл категорий (виджет ниже на странице) — источник графа уже сейчас, чтобы Excel отчёт
+        # у кнопки скачивания учитывал его в том же запуске
+        set_category_file(st.session_state.get('upload_categories_file'))
         
         # Построение матрицы
         if year_month_col and client_col:
             try:
-                # Проверяем, есть ли уже вычисленные данные
-                need_recompute = (
-                    st.session_state.cohort_matrix is None or
-                    st.session_state.sorted_periods is None or
-                    st.session_state.year_month_col != year_month_col or
-                    st.session_state.client_col != client_col
-                )
-                
                 # Создаём контейнер для всего контента
                 content_placeholder = st.empty()
                 
-                if need_recompute:
+                # При загрузке строится только матрица активности и сводка по периодам; матрицы видов,
+                # таблица оттока и отчёт вычисляются графом при первом обращении панелей к ним
+                if not graph.is_current('cohort_info'):
                     # Единый спиннер для всех расчётов - показываем только его
                     with content_placeholder.container():
-                        with st.spinner("Расчёт и анализ данных..."):
-                            # Построение когортной матрицы
-                            cohort_matrix, sorted_periods = build_cohort_matrix(
-                                df, 
-                                year_month_col, 
-                                client_col, 
-                                value_type='clients'
-                            )
-                            st.session_state.cohort_matrix = cohort_matrix
-                            st.session_state.sorted_periods = sorted_periods
-                            st.session_state.period_after_label = get_period_after_label(sorted_periods)
-
-                            # Кэшируем множества клиентов по периодам для быстрого доступа в функциях получения клиентов
-                            # Оптимизация: используем groupby вместо циклов с фильтрацией
-                            period_clients_cache = {}
-                            df_filtered = df[[year_month_col, client_col]].dropna()
-                            for period, group in df_filtered.groupby(year_month_col):
-                                period_clients_cache[period] = set(group[client_col].unique())
-                            # Добавляем пустые множества для периодов без клиентов
-                            for period in sorted_periods:
-                                if period not in period_clients_cache:
-                                    period_clients_cache[period] = set()
-                            st.session_state.period_clients_cache = period_clients_cache
-                            
-                            # Кэшируем когорты клиентов (первый период появления каждого клиента)
-                            client_cohorts_cache = get_client_cohorts(df, year_month_col, client_col, sorted_periods)
-                            st.session_state.client_cohorts_cache = client_cohorts_cache
-                            
-                            # Вычисляем статистику по диагонали (количество клиентов в каждом периоде)
-                            diagonal_values = {period: cohort_matrix.loc[period, period] for period in sorted_periods}
-                            
-                            # Находим максимум и минимум
-                            max_clients = max(diagonal_values.values())
-                            min_clients = min(diagonal_values.values())
-                            max_period = [period for period, val in diagonal_values.items() if val == max_clients][0]
-                            min_period = [period for period, val in diagonal_values.items() if val == min_clients][0]
-                            
-                            # Первый и последний период
-                            first_period = sorted_periods[0]
-                            last_period = sorted_periods[-1]
-                            
-                            # Сохраняем информацию в session state для отображения в правой колонке
-                            st.session_state.cohort_info = {
-                                'num_periods': len(sorted_periods),
-                                'first_period': first_period,
-                                'last_period': last_period,
-                                'max_clients': max_clients,
-                                'max_period': max_period,
-                                'min_clients': min_clients,
-                                'min_period': min_period
-                            }
-                            
-                            # Построение всех остальных матриц внутри спиннера
-                            st.session_state.accumulation_matrix = build_accumulation_matrix(df, year_month_col, client_col, sorted_periods)
-                            st.session_state.accumulation_percent_matrix = build_accumulation_percent_matrix(st.session_state.accumulation_matrix, cohort_matrix)
-                            st.session_state.inflow_matrix = build_inflow_matrix(st.session_state.accumulation_percent_matrix)
-                            
-                            # Кэшируем когорты клиентов (первый период появления каждого клиента)
-                            client_cohorts_cache = get_client_cohorts(df, year_month_col, client_col, sorted_periods)
-                            st.session_state.client_cohorts_cache = client_cohorts_cache
-                            
-                            st.session_state.churn_table = build_churn_table(df, year_month_col, client_col, sorted_periods, cohort_matrix, st.session_state.accumulation_matrix, st.session_state.accumulation_percent_matrix, client_cohorts_cache, period_clients_cache)
-                            
-                            # Кэшируем множества клиентов по периодам для быстрого доступа в функциях получения клиентов
-                            # Оптимизация: используем groupby вместо циклов с фильтрацией
-                            period_clients_cache = {}
-                            df_filtered = df[[year_month_col, client_col]].dropna()
-                            for period, group in df_filtered.groupby(year_month_col):
-                                period_clients_cache[period] = set(group[client_col].unique())
-                            # Добавляем пустые множества для периодов без клиентов
-                            for period in sorted_periods:
-                                if period not in period_clients_cache:
-                                    period_clients_cache[period] = set()
-                            st.session_state.period_clients_cache = period_clients_cache
+                        with st.spinner("Расчёт и анализ данных..."), stage_timer('compute_cohort_analysis', rows=len(df)):
+                            graph.get('cohort_info')
                     
                     # После завершения всех расчётов очищаем placeholder и отображаем весь контент
                     content_placeholder.empty()
-                else:
-                    # Используем сохраненные данные
-                    cohort_matrix = st.session_state.cohort_matrix
-                    sorted_periods = st.session_state.sorted_periods
-                    # Проверяем наличие остальных матриц
-                    if st.session_state.get('accumulation_matrix') is None:
-                        st.session_state.accumulation_matrix = build_accumulation_matrix(df, year_month_col, client_col, sorted_periods)
-                    if st.session_state.get('accumulation_percent_matrix') is None:
-                        st.session_state.accumulation_percent_matrix = build_accumulation_percent_matrix(st.session_state.accumulation_matrix, cohort_matrix)
-                    if st.session_state.get('inflow_matrix') is None:
-                        st.session_state.inflow_matrix = build_inflow_matrix(st.session_state.accumulation_percent_matrix)
-                    if st.session_state.get('churn_table') is None:
-                        client_cohorts_cache = st.session_state.get('client_cohorts_cache')
-                        if client_cohorts_cache is None:
-                            client_cohorts_cache = get_client_cohorts(df, year_month_col, client_col, sorted_periods)
-                            st.session_state.client_cohorts_cache = client_cohorts_cache
-                        period_clients_cache = st.session_state.get('period_clients_cache')
-                        st.session_state.churn_table = build_churn_table(df, year_month_col, client_col, sorted_periods, cohort_matrix, st.session_state.accumulation_matrix, st.session_state.accumulation_percent_matrix, client_cohorts_cache, period_clients_cache)
-                    
-                    # Создаем кэш множеств клиентов, если его еще нет
-                    if st.session_state.get('period_clients_cache') is None:
-                        # Оптимизация: используем groupby вместо циклов с фильтрацией
-                        period_clients_cache = {}
-                        df_filtered = df[[year_month_col, client_col]].dropna()
-                        for period, group in df_filtered.groupby(year_month_col):
-                            period_clients_cache[period] = set(group[client_col].unique())
-                        # Добавляем пустые множества для периодов без клиентов
-                        for period in sorted_periods:
-                            if period not in period_clients_cache:
-                                period_clients_cache[period] = set()
-                        st.session_state.period_clients_cache = period_clients_cache
-                    
-                    # Создаем кэш когорт клиентов, если его еще нет
-                    if st.session_state.get('client_cohorts_cache') is None:
-                        client_cohorts_cache = get_client_cohorts(df, year_month_col, client_col, sorted_periods)
-                        st.session_state.client_cohorts_cache = client_cohorts_cache
-                    if st.session_state.get('period_after_label') is None:
-                        st.session_state.period_after_label = get_period_after_label(sorted_periods)
                 
-                # Получаем информацию из session state
-                info = st.session_state.cohort_info
+                sorted_periods = graph.get('periods')
+                st.session_state.sorted_periods = sorted_periods
+                st.session_state.period_after_label = get_period_after_label(sorted_periods)
+                
+                # Сводка по периодам для блока над матрицами
+                info = graph.get('cohort_info')
                 
                 # Отображаем кнопки скачивания под блоком загрузки (горизонтально)
                 if info:
-                        # Создаем функцию для генерации полного отчёта
-                        def create_full_report_excel():
-                            """Создает полный Excel отчёт со всеми таблицами"""
-                            buffer = io.BytesIO()
-                            
-                            # Импорты для форматирования Excel
-                            from openpyxl.styles import Font
-                            from openpyxl.utils import get_column_letter
-                            
-                            # Получаем данные из session state
-                            cohort_matrix = st.session_state.cohort_matrix
-                            sorted_periods = st.session_state.sorted_periods
-                            df = st.session_state.df
-                            year_month_col = st.session_state.year_month_col
-                            client_col = st.session_state.client_col
-                            # Подпись «Продукт построения когорт» из первого столбца первого документа
-                            product_col = df.columns[0] if df is not None and len(df.columns) > 0 else None
-                            if product_col is not None:
-                                _up = sorted(df[product_col].dropna().astype(str).str.strip().unique())
-                                _up = [p for p in _up if p]
-                                products_label = ", ".join(_up) if _up else ""
-                            else:
-                                products_label = ""
-                            # Смещение строки данных при наличии заголовка «Продукт построения когорт»
-                            data_start_row = 4 if products_label else 2
-                            table_startrow = 2 if products_label else 0
-                            # Если второй файл загружен, но данные ещё не обработаны, обрабатываем их на лету
-                            uploaded_file_categories = st.session_state.get('upload_categories_file')
-                            if uploaded_file_categories is not None and ('df_categories' not in st.session_state or st.session_state.df_categories is None):
-                                try:
-                                    # Загружаем и обрабатываем файл на лету
-                                    if uploaded_file_categories.name.endswith('.xlsx'):
-                                        df_categories_temp = pd.read_excel(uploaded_file_categories, engine='openpyxl')
-                                    else:
-                                        df_categories_temp = pd.read_excel(uploaded_file_categories, engine='xlrd')
-                                    
-                                    # Определяем столбцы (упрощённая версия)
-                                    group_col_temp = None
-                                    year_month_col_temp = None
-                                    client_code_col_temp = None
-                                    
-                                    for col in df_categories_temp.columns:
-                                        col_lower = str(col).lower().strip()
-                                        if 'группа' in col_lower and group_col_temp is None:
-                                            group_col_temp = col
-                                        if (('год' in col_lower and ('месяц' in col_lower or 'неделя' in col_lower)) or ('год-месяц' in col_lower) or ('год-неделя' in col_lower)) and year_month_col_temp is None:
-                                            year_month_col_temp = col
-                                        if 'код' in col_lower and 'клиент' in col_lower and client_code_col_temp is None:
-                                            client_code_col_temp = col
-                                    
-                                    if group_col_temp and client_code_col_temp:
-                                        categories_temp = sorted([str(cat) for cat in df_categories_temp[group_col_temp].dropna().unique() if str(cat).strip() != ''])
-                                        
-                                        # Сохраняем базовые данные
-                                        st.session_state.df_categories = df_categories_temp
-                                        st.session_state.categories_list = categories_temp
-                                        st.session_state.group_col_name = group_col_temp
-                                        st.session_state.year_month_col_name = year_month_col_temp
-                                        st.session_state.client_code_col_name = client_code_col_temp
-                                        
-                                        # Полная обработка данных для создания category_summary_table
-                                        if 'churn_table' in st.session_state and st.session_state.churn_table is not None:
-                                            # Получаем необходимые данные
-                                            period_clients_cache = st.session_state.get('period_clients_cache', None)
-                                            client_cohorts_cache = st.session_state.get('client_cohorts_cache', None)
-                                            churn_table = st.session_state.churn_table
-                                            
-                                            # Рассчитываем метрики для всех когорт
-                                            total_present_after_cohort_by_cohort = {}
-                                            total_present_after_cohort_percent_by_cohort = {}
-                                            network_churn_by_cohort = {}
-                                            network_churn_percent_by_cohort = {}
-                                            
-                                            for cohort_period in sorted_periods:
-                                                # Получаем клиентов оттока для этой когорты
-                                                churn_clients_set_cohort = set(get_churn_clients(df, year_month_col, client_col, sorted_periods, cohort_period, period_clients_cache, client_cohorts_cache))
-                                                churn_clients_set_cohort = {normalize_client_code(c) for c in churn_clients_set_cohort if normalize_client_code(c)}
-                                                
-                                                cohort_row = churn_table[churn_table['Когорта'] == cohort_period]
-                                                churn_count_cohort = _churn_int(cohort_row.iloc[0]['Отток кол-во']) if not cohort_row.empty else 0
-                                                cohort_size_cohort = int(cohort_row.iloc[0]['Кол-во клиентов когорты']) if not cohort_row.empty else 0
-                                                
-                                                cohort_index_cohort = sorted_periods.index(cohort_period) if cohort_period in sorted_periods else 0
-                                                periods_from_cohort_cohort = sorted_periods[cohort_index_cohort:]
-                                                periods_after_cohort_cohort = periods_from_cohort_cohort[1:] if len(periods_from_cohort_cohort) > 1 else []
-                                                
-                                                all_category_clients_after_cohort = set()
-                                                if year_month_col_temp is not None and len(periods_after_cohort_cohort) > 0:
-                                                    periods_after_set_temp = {normalize_period_for_compare(p) for p in periods_after_cohort_cohort}
-                                                    for category in categories_temp:
-                                                        category_data = df_categories_temp[df_categories_temp[group_col_temp] == category]
-                                                        period_norm_temp = category_data[year_month_col_temp].apply(normalize_period_for_compare)
-                                                        category_data_filtered = category_data[period_norm_temp.isin(periods_after_set_temp)]
-                                                        category_clients = {normalize_client_code(c) for c in category_data_filtered[client_code_col_temp].dropna()}
-                                                        category_clients = {c for c in category_clients if c}
-                                                        all_category_clients_after_cohort.update(category_clients)
-                                                elif year_month_col_temp is None:
-                                                    for category in categories_temp:
-                                                        category_data = df_categories_temp[df_categories_temp[group_col_temp] == category]
-                                                        category_clients = {normalize_client_code(c) for c in category_data[client_code_col_temp].dropna()}
-                                                        category_clients = {c for c in category_clients if c}
-                                                        all_category_clients_after_cohort.update(category_clients)
-                                                
-                                                present_in_categories_after_cohort = churn_clients_set_cohort & all_category_clients_after_cohort
-                                                total_present_after_cohort_by_cohort[cohort_period] = len(present_in_categories_after_cohort)
-                                                
-                                                # % присутствия после месяца когорты
-                                                present_after_cohort_percent = (len(present_in_categories_after_cohort) / cohort_size_cohort * 100) if cohort_size_cohort > 0 else 0
-                                                total_present_after_cohort_percent_by_cohort[cohort_period] = present_after_cohort_percent
-                                                
-                                                # Отток из сети
-                                                network_churn_cohort = churn_count_cohort - len(present_in_categories_after_cohort)
-                                                network_churn_by_cohort[cohort_period] = max(0, network_churn_cohort)
-                                                
-                                                # % оттока из сети
-                                                network_churn_percent_cohort = (network_churn_by_cohort[cohort_period] / cohort_size_cohort * 100) if cohort_size_cohort > 0 else 0
-                                                network_churn_percent_by_cohort[cohort_period] = network_churn_percent_cohort
-                                            
-                                            # Ключи метрик с учётом типа периода (недели/месяцы)
-                                            _pa = st.session_state.get('period_after_label', 'месяца')
-                                            _key_итого = f"Итого присутствуют в других категориях после {_pa} когорты"
-                                            _key_доля = f"Доля присутствуют в других категориях после {_pa} когорты"
-                                            summary_table_excel = pd.DataFrame({
-                                                'Отток из сети': network_churn_by_cohort,
-                                                'Доля оттока из сети от когорты': network_churn_percent_by_cohort,
-                                                _key_итого: total_present_after_cohort_by_cohort,
-                                                _key_доля: total_present_after_cohort_percent_by_cohort
-                                            })
-                                            summary_table_excel = summary_table_excel.T
-                                            
-                                            # Сохраняем category_summary_table
-                                            st.session_state.category_summary_table = summary_table_excel
-                                            st.session_state.category_cohort_table = None
-                                except Exception as e:
-                                    # Если не удалось обработать на лету, просто пропускаем таблицу 6
-                                    pass
-                        
-                            with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                                workbook = writer.book
-                                
-                                # Получаем все матрицы
-                                accumulation_matrix = build_accumulation_matrix(df, year_month_col, client_col, sorted_periods)
-                                accumulation_percent_matrix = build_accumulation_percent_matrix(accumulation_matrix, cohort_matrix)
-                                inflow_matrix = build_inflow_matrix(accumulation_percent_matrix)
-                                
-                                # Таблица 1: Динамика уникальных клиентов когорт
-                                cohort_matrix_copy = cohort_matrix.copy()
-                                cohort_matrix_copy.index.name = 'Когорта / Период'
-                                cohort_matrix_copy.to_excel(writer, sheet_name="1. Динамика уникальных клиентов", startrow=table_startrow, index=True)
-                                worksheet1 = writer.sheets["1. Динамика уникальных клиентов"]
-                                if products_label:
-                                    worksheet1.cell(row=1, column=1, value=f"Продукт построения когорт: {products_label}")
-                                    worksheet1.merge_cells(f"A1:{get_column_letter(1 + len(cohort_matrix.columns))}1")
-                                    worksheet1.cell(row=1, column=1).font = Font(bold=True, size=11)
-                                apply_excel_cohort_formatting(worksheet1, cohort_matrix.astype(float), sorted_periods, **_excel_format_kwargs(apply_excel_cohort_formatting, data_start_row))
-                                
-                                # Таблица 2: Динамика накопления возврата
-                                accumulation_matrix_copy = accumulation_matrix.copy()
-                                accumulation_matrix_copy.index.name = 'Когорта / Период'
-                                accumulation_matrix_copy.to_excel(writer, sheet_name="2. Динамика накопления", startrow=table_startrow, index=True)
-                                worksheet2 = writer.sheets["2. Динамика накопления"]
-                                if products_label:
-                                    worksheet2.cell(row=1, column=1, value=f"Продукт построения когорт: {products_label}")
-                                    worksheet2.merge_cells(f"A1:{get_column_letter(1 + len(accumulation_matrix.columns))}1")
-                                    worksheet2.cell(row=1, column=1).font = Font(bold=True, size=11)
-                                apply_excel_color_formatting(worksheet2, accumulation_matrix.astype(float), hide_zeros=True, **_excel_format_kwargs(apply_excel_color_formatting, data_start_row))
-                                # Форматируем значения как целые числа (только для непустых ячеек)
-                                for row_idx in range(data_start_row, data_start_row + len(accumulation_matrix.index)):
-                                    for col_idx in range(2, len(accumulation_matrix.columns) + 2):
-                                        cell = worksheet2.cell(row=row_idx, column=col_idx)
-                                        if cell.value is not None and not isinstance(cell.value, str) and cell.value != "":
-                                            cell.number_format = '0'  # Формат целого числа
-                                
-                                # Таблица 3: Динамика накопления возврата в %
-                                accumulation_percent_matrix_copy = accumulation_percent_matrix.copy()
-                                accumulation_percent_matrix_copy.index.name = 'Когорта / Период'
-                                accumulation_percent_matrix_copy.to_excel(writer, sheet_name="3. Динамика накопления %", startrow=table_startrow, index=True)
-                                worksheet3 = writer.sheets["3. Динамика накопления %"]
-                                if products_label:
-                                    worksheet3.cell(row=1, column=1, value=f"Продукт построения когорт: {products_label}")
-                                    worksheet3.merge_cells(f"A1:{get_column_letter(1 + len(accumulation_percent_matrix.columns))}1")
-                                    worksheet3.cell(row=1, column=1).font = Font(bold=True, size=11)
-                                apply_excel_percent_formatting(worksheet3, accumulation_percent_matrix, sorted_periods, **_excel_format_kwargs(apply_excel_percent_formatting, data_start_row))
-                                
-                                # Таблица 4: Приток возврата в %
-                                inflow_matrix_copy = inflow_matrix.copy()
-                                inflow_matrix_copy.index.name = 'Когорта / Период'
-                                inflow_matrix_copy.to_excel(writer, sheet_name="4. Приток возврата %", startrow=table_startrow, index=True)
-                                worksheet4 = writer.sheets["4. Приток возврата %"]
-                                if products_label:
-                                    worksheet4.cell(row=1, column=1, value=f"Продукт построения когорт: {products_label}")
-                                    worksheet4.merge_cells(f"A1:{get_column_letter(1 + len(inflow_matrix.columns))}1")
-                                    worksheet4.cell(row=1, column=1).font = Font(bold=True, size=11)
-                                apply_excel_inflow_formatting(worksheet4, inflow_matrix, sorted_periods, **_excel_format_kwargs(apply_excel_inflow_formatting, data_start_row))
-                                
-                                # Таблица 5: Отток клиентов из категории
-                                churn_table_full = build_churn_table(df, year_month_col, client_col, sorted_periods, cohort_matrix, accumulation_matrix, accumulation_percent_matrix, None, None)
-                                churn_table_copy = churn_table_full.copy()
-                                # Не конвертируем проценты в строки - сохраняем как числа для возможности расчетов
-                                churn_table_copy.to_excel(writer, sheet_name="5. Отток клиентов из категории", startrow=0, index=False)
-                                worksheet5 = writer.sheets["5. Отток клиентов из категории"]
-                                # Форматируем значения: числа как целые, проценты как проценты
-                                from openpyxl.styles import Alignment as ExcelAlignment
-                                for row_idx in range(2, len(churn_table_copy) + 2):
-                                    for col_idx in range(1, len(churn_table_copy.columns) + 1):
-                                        cell = worksheet5.cell(row=row_idx, column=col_idx)
-                                        cell.alignment = ExcelAlignment(horizontal="center", vertical="center")
-                                        col_name = churn_table_copy.columns[col_idx - 1]
-                                        if col_name in ['Кол-во клиентов когорты', 'Накопительное кол-во возврата', 'Отток кол-во']:
-                                            # Колонки с числами
-                                            if cell.value is not None and not isinstance(cell.value, str):
-                                                cell.number_format = '0'  # Формат целого числа
-                                        elif col_name in ['Накопительный % возврата', 'Отток %']:
-                                            # Колонки с процентами - сохраняем как число (уже в процентах, конвертируем в долю)
-                                            if cell.value is not None and not isinstance(cell.value, str):
-                                                # Значение уже в процентах (например, 45.7), конвертируем в долю (0.457)
-                                                cell.value = float(cell.value) / 100.0
-                                                cell.number_format = '0.0%'  # Процентный формат Excel
-                                
-                                # Таблица 7: Присутствие клиентов оттока когорты в других категориях товаров
-                                # Проверяем наличие загруженного второго файла напрямую через session_state
-                                # Это позволяет определить загружен ли файл, даже если он ещё не обработан
-                                has_categories_file = st.session_state.get('upload_categories_file') is not None
-                                
-                                # Проверяем наличие всех необходимых данных для таблицы 7
-                                # Если файл загружен, пытаемся использовать обработанные данные
-                                has_categories_data = (
-                                    has_categories_file and
-                                    'df_categories' in st.session_state and st.session_state.df_categories is not None and
-                                    'categories_list' in st.session_state and st.session_state.categories_list is not None and
-                                    'group_col_name' in st.session_state and st.session_state.group_col_name is not None and
-                                    'year_month_col_name' in st.session_state and 'client_code_col_name' in st.session_state
-                                )
-                                
-                                if has_categories_data:
-                                    
-                                    df_categories = st.session_state.df_categories
-                                    categories = st.session_state.categories_list
-                                    group_col = st.session_state.group_col_name
-                                    year_month_col_cat = st.session_state.get('year_month_col_name', None)
-                                    client_code_col = st.session_state.get('client_code_col_name', None)
-                                    
-                                    # Проверяем, что есть категории для обработки
-                                    if not categories or len(categories) == 0:
-                                        # Пропускаем создание таблицы 6, если нет категорий
-                                        pass
-                                    else:
-                                        start_row_cohorts = 0
-                                        worksheet_cohorts = None
-                                        
-                                        # Добавляем данные с листа 6 (если есть)
-                                        if 'category_summary_table' in st.session_state and st.session_state.category_summary_table is not None:
-                                            summary_table_excel = st.session_state.category_summary_table.copy()
-                                            summary_table_excel.index.name = 'Метрика / Когорта'
-                                            summary_table_excel.to_excel(writer, sheet_name="6. Присутствие когорты в других категориях", startrow=start_row_cohorts, index=True)
-                                            worksheet_cohorts = writer.sheets["6. Присутствие когорты в других категориях"]
-                                            
-                                            # Форматируем верхнюю таблицу
-                                            for row_idx in range(start_row_cohorts + 2, start_row_cohorts + len(summary_table_excel.index) + 2):
-                                                for col_idx in range(2, len(summary_table_excel.columns) + 2):
-                                                    cell = worksheet_cohorts.cell(row=row_idx, column=col_idx)
-                                                    cell.alignment = ExcelAlignment(horizontal="center", vertical="center")
-                                                    row_name = summary_table_excel.index[row_idx - start_row_cohorts - 2]
-                                                    
-                                                    if cell.value is not None and not isinstance(cell.value, str):
-                                                        if row_name == 'Доля оттока из сети от когорты':
-                                                            cell.value = float(cell.value) / 100.0
-                                                            cell.number_format = '0.0%'
-                                                        else:
-                                                            cell.number_format = '0'
-                                            
-                                            # Форматируем заголовок строки
-                                            for row_idx in range(start_row_cohorts + 2, start_row_cohorts + len(summary_table_excel.index) + 2):
-                                                cell = worksheet_cohorts.cell(row=row_idx, column=1)
-                                                cell.alignment = ExcelAlignment(horizontal="left", vertical="center")
-                                            
-                                            start_row_cohorts = start_row_cohorts + len(summary_table_excel.index) + 3
-                                        
-                                        if 'category_cohort_table' in st.session_state and st.session_state.category_cohort_table is not None:
-                                            category_table_excel = st.session_state.category_cohort_table.copy()
-                                            category_table_excel.index.name = 'Категория / Когорта'
-                                            
-                                            if worksheet_cohorts is None:
-                                                category_table_excel.to_excel(writer, sheet_name="6. Присутствие когорты в других категориях", startrow=start_row_cohorts, index=True)
-                                                worksheet_cohorts = writer.sheets["6. Присутствие когорты в других категориях"]
-                                            else:
-                                                category_table_excel.to_excel(writer, sheet_name="6. Присутствие когорты в других категориях", startrow=start_row_cohorts, index=True)
-                                            
-                                            # Форматируем таблицу с категориями
-                                            for row_idx in range(start_row_cohorts + 2, start_row_cohorts + len(category_table_excel.index) + 2):
-                                                for col_idx in range(2, len(category_table_excel.columns) + 2):
-                                                    cell = worksheet_cohorts.cell(row=row_idx, column=col_idx)
-                                                    cell.alignment = ExcelAlignment(horizontal="center", vertical="center")
-                                                    if cell.value is not None and not isinstance(cell.value, str):
-                                                        cell.number_format = '0'
-                                            
-                                            # Форматируем заголовок строки
-                                            for row_idx in range(start_row_cohorts + 2, start_row_cohorts + len(category_table_excel.index) + 2):
-                                                cell = worksheet_cohorts.cell(row=row_idx, column=1)
-                                                cell.alignment = ExcelAlignment(horizontal="left", vertical="center")
-                                            
-                                            start_row_cohorts = start_row_cohorts + len(category_table_excel.index) + 3
-                                        
-                                        # Для каждой когорты создаем таблицу
-                                        for cohort_idx, selected_cohort in enumerate(sorted_periods):
-                                            # Определяем периоды начиная с выбранной когорты
-                                            cohort_index = sorted_periods.index(selected_cohort) if selected_cohort in sorted_periods else 0
-                                            periods_from_cohort = sorted_periods[cohort_index:]
-                                            # Периоды ПОСЛЕ когорты (исключая период когорты) - для столбцов таблицы
-                                            periods_after_cohort = periods_from_cohort[1:] if len(periods_from_cohort) > 1 else []
-                                            
-                                            # Пропускаем когорту, если нет периодов после неё
-                                            if len(periods_after_cohort) == 0:
-                                                continue
-                                            
-                                            # Получаем клиентов оттока для выбранной когорты
-                                            period_clients_cache = st.session_state.get('period_clients_cache', None)
-                                            client_cohorts_cache = st.session_state.get('client_cohorts_cache', None)
-                                            churn_clients_set = set(get_churn_clients(df, year_month_col, client_col, sorted_periods, selected_cohort, period_clients_cache, client_cohorts_cache))
-                                            churn_clients_set = {normalize_client_code(c) for c in churn_clients_set if normalize_client_code(c)}
-                                            
-                                            # Создаем таблицу: категории по строкам, периоды ПОСЛЕ когорты по столбцам
-                                            category_period_table = pd.DataFrame(index=categories, columns=periods_after_cohort)
-                                            
-                                            # Словари для итогов
-                                            period_unique_clients = {period: set() for period in periods_after_cohort}
-                                            category_unique_clients = {category: set() for category in categories}
-                                            
-                                            if year_month_col_cat is not None:
-                                                cat_period_norm = df_categories[year_month_col_cat].apply(normalize_period_for_compare)
-                                                for period in periods_after_cohort:
-                                                    period_norm = normalize_period_for_compare(period)
-                                                    period_data = df_categories[cat_period_norm == period_norm]
-                                                    
-                                                    for category in categories:
-                                                        category_period_data = period_data[
-                                                            (period_data[group_col] == category) & 
-                                                            (period_data[client_code_col].notna())
-                                                        ]
-                                                        category_period_clients = {
-                                                            normalize_client_code(c) for c in category_period_data[client_code_col].dropna()
-                                                        }
-                                                        category_period_clients = {c for c in category_period_clients if c}
-                                                        intersection = churn_clients_set & category_period_clients
-                                                        category_period_table.loc[category, period] = len(intersection)
-                                                        
-                                                        period_unique_clients[period].update(intersection)
-                                                        category_unique_clients[category].update(intersection)
-                                            else:
-                                                category_clients_dict = {}
-                                                for category in categories:
-                                                    category_data = df_categories[df_categories[group_col] == category]
-                                                    client_codes = {normalize_client_code(c) for c in category_data[client_code_col].dropna()}
-                                                    client_codes = {c for c in client_codes if c}
-                                                    category_clients_dict[category] = client_codes
-                                                
-                                                for period in periods_after_cohort:
-                                                    for category in categories:
-                                                        category_clients_set = category_clients_dict.get(category, set())
-                                                        intersection = churn_clients_set & category_clients_set
-                                                        category_period_table.loc[category, period] = len(intersection)
-                                                        
-                                                        period_unique_clients[period].update(intersection)
-                                                        category_unique_clients[category].update(intersection)
-                                            
-                                            # Заполняем NaN нулями
-                                            category_period_table = category_period_table.fillna(0).astype(int)
-                                            
-                                            # Создаем итоговую строку и столбец
-                                            totals_row = pd.Series(
-                                                {period: len(period_unique_clients[period]) for period in periods_after_cohort},
-                                                name='Итого клиентов'
-                                            )
-                                            
-                                            totals_col = pd.Series(
-                                                {category: len(category_unique_clients[category]) for category in categories},
-                                                name='Итого'
-                                            )
-                                            
-                                            # Добавляем итоги в таблицу
-                                            category_period_table_with_totals = category_period_table.copy()
-                                            category_period_table_with_totals.loc['Итого клиентов'] = totals_row
-                                            category_period_table_with_totals['Итого'] = totals_col
-                                            
-                                            # Вычисляем значение для ячейки пересечения
-                                            all_category_clients = set()
-                                            if year_month_col_cat is not None:
-                                                periods_after_set = {normalize_period_for_compare(p) for p in periods_after_cohort}
-                                                for category in categories:
-                                                    category_data = df_categories[df_categories[group_col] == category]
-                                                    period_norm = category_data[year_month_col_cat].apply(normalize_period_for_compare)
-                                                    category_data_filtered = category_data[period_norm.isin(periods_after_set)]
-                                                    category_clients = {normalize_client_code(c) for c in category_data_filtered[client_code_col].dropna()}
-                                                    category_clients = {c for c in category_clients if c}
-                                                    all_category_clients.update(category_clients)
-                                            else:
-                                                for category in categories:
-                                                    category_data = df_categories[df_categories[group_col] == category]
-                                                    category_clients = set(category_data[client_code_col].dropna().astype(str).unique())
-                                                    all_category_clients.update(category_clients)
-                                            
-                                            present_in_categories = churn_clients_set & all_category_clients
-                                            category_period_table_with_totals.loc['Итого клиентов', 'Итого'] = len(present_in_categories)
-                                            
-                                            # Переупорядочиваем строки и столбцы
-                                            new_index = ['Итого клиентов'] + [cat for cat in categories]
-                                            category_period_table_with_totals = category_period_table_with_totals.reindex(new_index)
-                                            new_columns = ['Итого'] + list(periods_after_cohort)
-                                            category_period_table_with_totals = category_period_table_with_totals[new_columns]
-                                            
-                                            # Добавляем заголовок когорты
-                                            if worksheet_cohorts is None:
-                                                # Создаем новый лист
-                                                category_period_table_with_totals.to_excel(
-                                                    writer, 
-                                                    sheet_name="6. Присутствие когорты в других категориях", 
-                                                    startrow=start_row_cohorts, 
-                                                    index=True
-                                                )
-                                                worksheet_cohorts = writer.sheets["6. Присутствие когорты в других категориях"]
-                                                # Добавляем заголовок когорты
-                                                last_col_letter = get_column_letter(len(new_columns) + 1)
-                                                worksheet_cohorts.cell(row=start_row_cohorts + 1, column=1, value=f"Когорта: {selected_cohort}")
-                                                worksheet_cohorts.merge_cells(f'A{start_row_cohorts + 1}:{last_col_letter}{start_row_cohorts + 1}')
-                                                header_cell = worksheet_cohorts.cell(row=start_row_cohorts + 1, column=1)
-                                                header_cell.font = Font(bold=True, size=12)
-                                                header_cell.alignment = ExcelAlignment(horizontal="center", vertical="center")
-                                                start_row_cohorts += 2
-                                            else:
-                                                # Добавляем заголовок когорты
-                                                last_col_letter = get_column_letter(len(new_columns) + 1)
-                                                worksheet_cohorts.cell(row=start_row_cohorts + 1, column=1, value=f"Когорта: {selected_cohort}")
-                                                worksheet_cohorts.merge_cells(f'A{start_row_cohorts + 1}:{last_col_letter}{start_row_cohorts + 1}')
-                                                header_cell = worksheet_cohorts.cell(row=start_row_cohorts + 1, column=1)
-                                                header_cell.font = Font(bold=True, size=12)
-                                                header_cell.alignment = ExcelAlignment(horizontal="center", vertical="center")
-                                                start_row_cohorts += 2
-                                                
-                                                # Записываем таблицу на тот же лист
-                                                category_period_table_with_totals.to_excel(
-                                                    writer, 
-                                                    sheet_name="6. Присутствие когорты в других категориях", 
-                                                    startrow=start_row_cohorts, 
-                                                    index=True
-                                                )
-                                            
-                                            # Форматируем таблицу
-                                            for row_idx in range(start_row_cohorts + 2, start_row_cohorts + len(category_period_table_with_totals.index) + 2):
-                                                for col_idx in range(2, len(category_period_table_with_totals.columns) + 2):
-                                                    cell = worksheet_cohorts.cell(row=row_idx, column=col_idx)
-                                                    cell.alignment = ExcelAlignment(horizontal="center", vertical="center")
-                                                    if cell.value is not None and not isinstance(cell.value, str):
-                                                        cell.number_format = '0'
-                                            
-                                            # Форматируем заголовок строки
-                                            for row_idx in range(start_row_cohorts + 2, start_row_cohorts + len(category_period_table_with_totals.index) + 2):
-                                                cell = worksheet_cohorts.cell(row=row_idx, column=1)
-                                                cell.alignment = ExcelAlignment(horizontal="left", vertical="center")
-                                            
-                                            # Обновляем начальную строку для следующей таблицы (таблица + 2 пустые строки)
-                                            start_row_cohorts = start_row_cohorts + len(category_period_table_with_totals.index) + 3
-                                
-                                # Таблица 7: Сводная таблица по всем когортам
-                                # Таблица 8 всегда создаётся с базовыми метриками (1-5)
-                                # Метрики 6-9 добавляются только при наличии данных категорий
-                                if st.session_state.get('churn_table') is not None:
-                                    churn_table = st.session_state.churn_table
-                                    has_categories_file_excel = (
-                                        st.session_state.get('upload_categories_file') is not None or
-                                        st.session_state.get('category_summary_table') is not None
-                                    )
-                                    summary_data = {}
-                                    
-                                    # 1–3. Базовые метрики (всегда)
-                                    summary_data['Кол-во клиентов в когорте'] = {}
-                                    for _, row in churn_table.iterrows():
-                                        cohort = row['Когорта']
-                                        summary_data['Кол-во клиентов в когорте'][cohort] = int(row['Кол-во клиентов когорты'])
-                                    summary_data['Накопительное кол-во вернувшихся в категорию'] = {}
-                                    for _, row in churn_table.iterrows():
-                                        cohort = row['Когорта']
-                                        summary_data['Накопительное кол-во вернувшихся в категорию'][cohort] = _churn_int(row['Накопительное кол-во возврата'])
-                                    summary_data['Накопительное кол-во вернувшихся в категорию %'] = {}
-                                    for _, row in churn_table.iterrows():
-                                        cohort = row['Когорта']
-                                        v_ret = row['Накопительный % возврата']
-                                        summary_data['Накопительное кол-во вернувшихся в категорию %'][cohort] = v_ret if v_ret == '-' else f"{float(v_ret):.1f}%"
-                                    
-                                    # 4–5. Отток из категории (из первого файла — всегда)
-                                    summary_data['Отток из категории когорты'] = {}
-                                    for _, row in churn_table.iterrows():
-                                        cohort = row['Когорта']
-                                        summary_data['Отток из категории когорты'][cohort] = _churn_int(row['Отток кол-во'])
-                                    summary_data['Отток из категории когорты %'] = {}
-                                    for _, row in churn_table.iterrows():
-                                        cohort = row['Когорта']
-                                        v = row['Отток %']
-                                        summary_data['Отток из категории когорты %'][cohort] = v if v == '-' else f"{float(v):.1f}%"
-                                    
-                                    if has_categories_file_excel:
-                                        _pa_ex = st.session_state.get('period_after_label', 'месяца')
-                                        _k_ит = f"Итого присутствуют в других категориях после {_pa_ex} когорты"
-                                        _k_доля = f"Доля присутствуют в других категориях после {_pa_ex} когорты"
-                                        _k_кол = f"Кол-во клиентов когорты в других категориях после {_pa_ex} когорты"
-                                        _k_кол_pct = f"Кол-во клиентов когорты в других категориях после {_pa_ex} когорты %"
-                                        summary_data[_k_кол] = {}
-                                        summary_data[_k_кол_pct] = {}
-                                        summary_data['Отток из сети'] = {}
-                                        summary_data['Отток из сети %'] = {}
-                                        for cohort in sorted_periods:
-                                            summary_data[_k_кол][cohort] = 0
-                                            summary_data[_k_кол_pct][cohort] = 0.0
-                                            summary_data['Отток из сети'][cohort] = 0
-                                            summary_data['Отток из сети %'][cohort] = 0.0
-                                        
-                                        if 'category_summary_table' in st.session_state and st.session_state.category_summary_table is not None:
-                                            category_summary = st.session_state.category_summary_table
-                                            if _k_ит in category_summary.index:
-                                                for cohort in sorted_periods:
-                                                    if cohort in category_summary.columns:
-                                                        value = category_summary.loc[_k_ит, cohort]
-                                                        summary_data[_k_кол][cohort] = int(value) if pd.notna(value) else 0
-                                            if _k_доля in category_summary.index:
-                                                for cohort in sorted_periods:
-                                                    if cohort in category_summary.columns:
-                                                        value = category_summary.loc[_k_доля, cohort]
-                                                        if pd.notna(value):
-                                                            summary_data[_k_кол_pct][cohort] = value
-                                            else:
-                                                for cohort in sorted_periods:
-                                                    cohort_size = summary_data['Кол-во клиентов в когорте'].get(cohort, 0)
-                                                    present_after_count = summary_data[_k_кол].get(cohort, 0)
-                                                    if cohort_size > 0:
-                                                        percent = (present_after_count / cohort_size) * 100
-                                                        summary_data[_k_кол_pct][cohort] = percent
-                                            if 'Отток из сети' in category_summary.index:
-                                                for cohort in sorted_periods:
-                                                    if cohort in category_summary.columns:
-                                                        value = category_summary.loc['Отток из сети', cohort]
-                                                        summary_data['Отток из сети'][cohort] = int(value) if pd.notna(value) else 0
-                                            if 'Доля оттока из сети от когорты' in category_summary.index:
-                                                for cohort in sorted_periods:
-                                                    if cohort in category_summary.columns:
-                                                        value = category_summary.loc['Доля оттока из сети от когорты', cohort]
-                                                        if pd.notna(value):
-                                                            summary_data['Отток из сети %'][cohort] = value
-                                    
-                                    # Создаем DataFrame
-                                    summary_df = pd.DataFrame(summary_data, index=sorted_periods).T
-                                    summary_df.index.name = 'Метрика / Когорта'
-                                    
-                                    # Записываем в Excel
-                                    summary_df.to_excel(writer, sheet_name="7. Сводная таблица по всем когортам", startrow=0, index=True)
-                                    worksheet_summary = writer.sheets["7. Сводная таблица по всем когортам"]
-                                    
-                                    # Форматируем таблицу
-                                    for row_idx in range(2, len(summary_df.index) + 2):
-                                        for col_idx in range(2, len(summary_df.columns) + 2):
-                                            cell = worksheet_summary.cell(row=row_idx, column=col_idx)
-                                            cell.alignment = ExcelAlignment(horizontal="center", vertical="center")
-                                            row_name = summary_df.index[row_idx - 2]
-                                            
-                                            if cell.value is not None and not isinstance(cell.value, str):
-                                                if '%' in row_name:
-                                                    # Процентные колонки
-                                                    cell.value = float(cell.value) / 100.0 if isinstance(cell.value, (int, float)) and cell.value > 1 else float(cell.value)
-                                                    cell.number_format = '0.0%'
-                                                else:
-                                                    # Числовые колонки
-                                                    cell.number_format = '0'
-                                    
-                                    # Форматируем заголовок строки
-                                    for row_idx in range(2, len(summary_df.index) + 2):
-                                        cell = worksheet_summary.cell(row=row_idx, column=1)
-                                        cell.alignment = ExcelAlignment(horizontal="left", vertical="center")
-                                
-                                # Удаляем пустой лист по умолчанию
-                                if 'Sheet' in workbook.sheetnames:
-                                    workbook.remove(workbook['Sheet'])
-                            
-                            buffer.seek(0)
-                            return buffer.getvalue()
-                        
                         # CSS для увеличения размера кнопок загрузки
                         st.markdown("""
                         <style>
@@ -997,59 +1211,69 @@ if uploaded_file is not None:
                             font-size: 20px !important;
                             font-weight: bold !important;
                         }
+                        .st-key-build_full_report button {
+                            height: 60px !important;
+                            padding: 15px 30px !important;
+                        }
+                        .st-key-build_full_report button p {
+                            font-size: 20px !important;
+                            font-weight: bold !important;
+                        }
                         </style>
                         """, unsafe_allow_html=True)
                         
                         # Строка: слева — «Продукт построения когорт», справа — кнопка скачивания Excel
                         col_product, col_excel_btn = st.columns([3, 1])
                         
-                        # Генерируем файл каждый раз при рендеринге (данные могут обновиться)
-                        try:
-                            excel_data_full = create_full_report_excel()
-                            st.session_state.excel_report_data = excel_data_full
-                        except Exception as e:
-                            if 'excel_report_data' in st.session_state and st.session_state.excel_report_data is not None:
-                                excel_data_full = st.session_state.excel_report_data
-                                st.warning(f"Использован сохраненный отчет. Ошибка при генерации: {str(e)}")
-                            else:
-                                st.error(f"Ошибка при генерации отчета: {str(e)}")
-                                excel_data_full = b""  # Пустой файл
+                        graph.set_source('report_options', get_report_options())
                         
-                        _df = st.session_state.get('df')
-                        if _df is not None and len(_df.columns) > 0:
-                            _pc = _df.columns[0]
-                            _upl = sorted(_df[_pc].dropna().astype(str).str.strip().unique())
-                            _upl = [p for p in _upl if p]
-                            _suffix = "_".join(_upl)
-                            _suffix = re.sub(r'[\\/:*?"<>|]', '_', _suffix)[:80].strip('._ ') if _suffix else ""
-                        else:
-                            _suffix = ""
+                        _suffix = "_".join(st.session_state.get('products') or [])
+                        _suffix = re.sub(r'[\\/:*?"<>|]', '_', _suffix)[:80].strip('._ ') if _suffix else ""
                         _excel_name = f"полный_отчёт_когортный_анализ_{_suffix}_{info['first_period']}_{info['last_period']}.xlsx" if _suffix else f"полный_отчёт_когортный_анализ_{info['first_period']}_{info['last_period']}.xlsx"
                         
                         # Продукт построения когорт — слева
                         with col_product:
-                            df_first = st.session_state.get('df')
-                            if df_first is not None and len(df_first.columns) > 0:
-                                product_col = df_first.columns[0]
-                                unique_products = sorted(df_first[product_col].dropna().astype(str).str.strip().unique())
-                                unique_products = [p for p in unique_products if p]
-                                if unique_products:
-                                    products_text = ", ".join(unique_products)
-                                    st.markdown(f"""
-                                    <p style="font-size: 1.5rem; font-weight: 600; margin-top: 16px;">
-                                        Продукт построения когорт: <span style="color: #0d6efd; font-weight: 700;">{products_text}</span>
-                                    </p>
-                                    """, unsafe_allow_html=True)
+                            products_text = get_products_label()
+                            if products_text:
+                                st.markdown(f"""
+                                <p style="font-size: 1.5rem; font-weight: 600; margin-top: 16px;">
+                                    Продукт построения когорт: <span style="color: #0d6efd; font-weight: 700;">{products_text}</span>
+                                </p>
+                                """, unsafe_allow_html=True)
                         
-                        # Кнопка скачивания Excel — справа
+                        # Кнопка скачивания Excel — справа. Отчёт (все матрицы, срезы и показатели) собирается
+                        # только по запросу и хранится графом до смены данных, файла категорий или настроек
                         with col_excel_btn:
-                            st.download_button(
-                                label="📥 Скачать полный отчёт в Excel",
-                                data=excel_data_full,
-                                file_name=_excel_name,
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                            excel_data_full = None
+                            if graph.is_current('report') or st.button(
+                                "📊 Сформировать полный отчёт в Excel",
                                 use_container_width=True,
-                                key="download_full_report"
+                                key="build_full_report"
+                            ):
+                                try:
+                                    with st.spinner("Формирование отчёта..."):
+                                        excel_data_full = graph.get('report')
+                                except Exception as e:
+                                    st.error(f"Ошибка при генерации отчета: {str(e)}")
+                            if excel_data_full:
+                                st.download_button(
+                                    label="📥 Скачать полный отчёт в Excel",
+                                    data=excel_data_full,
+                                    file_name=_excel_name,
+                                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                    use_container_width=True,
+                                    key="download_full_report"
+                                )
+                            if len(st.session_state.get('products') or []) > 1:
+                                st.checkbox(
+                                    "Листы по каждому продукту",
+                                    help="Добавить в отчёт по листу с матрицами и оттоком для каждого продукта",
+                                    key="report_product_slices"
+                                )
+                            st.checkbox(
+                                "Тепловые карты матриц в отчёте",
+                                help="Добавить на листы матриц 1–4 картинку тепловой карты рядом с таблицей",
+                                key="report_heatmaps"
                             )
                 else:
                     st.info("⏳ Загрузите файл и дождитесь завершения расчётов для генерации отчётов")
@@ -1246,6 +1470,50 @@ if uploaded_file is not None:
                     </style>
                     """, unsafe_allow_html=True)
                     
+                    # Срез по продукту и окно периодов: матрицы, коды клиентов и сводная таблица строятся
+                    # по выбранному срезу матрицы активности (когорта — первая покупка внутри среза)
+                    products = st.session_state.get('products') or []
+                    view_product = None
+                    window_bounds = None
+                    col_product_slice, col_period_window = st.columns([1, 3])
+                    if len(products) > 1:
+                        with col_product_slice:
+                            product_choice = st.selectbox(
+                                "Срез по продукту:",
+                                options=["Все продукты"] + products,
+                                help="Когорты по одному продукту первого столбца выгрузки",
+                                key="product_slice"
+                            )
+                        if product_choice != "Все продукты":
+                            view_product = product_choice
+                    if len(sorted_periods) > 1:
+                        with col_period_window:
+                            window_first, window_last = st.select_slider(
+                                "Окно периодов:",
+                                options=sorted_periods,
+                                value=(sorted_periods[0], sorted_periods[-1]),
+                                help="Ограничьте анализ диапазоном периодов без повторной загрузки файла",
+                                key="period_window"
+                            )
+                        if (window_first, window_last) != (sorted_periods[0], sorted_periods[-1]):
+                            window_bounds = (sorted_periods.index(window_first), sorted_periods.index(window_last))
+                    heatmap_view = st.checkbox(
+                        "🗺 Тепловая карта вместо таблицы",
+                        value=len(sorted_periods) >= HEATMAP_DEFAULT_PERIODS,
+                        help="Матрицы 1–4 рисуются одной картинкой с той же цветовой шкалой — "
+                             "быстрее стилизованной таблицы для сотен периодов",
+                        key="matrix_heatmap"
+                    )
+                    if view_product is not None or window_bounds is not None:
+                        view_label = ", ".join(
+                            ([f"продукт {view_product}"] if view_product is not None else []) +
+                            ([f"окно {window_first} — {window_last}"] if window_bounds is not None else [])
+                        )
+                        st.caption(
+                            f"Когорты пересчитаны внутри среза: {view_label}. "
+                            "Отчёт Excel, файл со всеми списками и блок категорий строятся по всем данным."
+                        )
+                    
                     # Создаем колонки для выравнивания кнопок с блоком описания
                     # Кнопки занимают всю ширину до блока кодов клиентов (соотношение 4:1 как у таблицы)
                     col_buttons_container, col_empty = st.columns([4, 1])
@@ -1254,338 +1522,32 @@ if uploaded_file is not None:
                         # Переключатель для выбора типа отображения (горизонтально, на уровне с таблицей)
                         view_type = st.radio(
                             "",
-                            options=[
-                                "Динамика уникальных клиентов когорт",
-                                "Динамика накопления возврата",
-                                "Динамика накопления возврата в %",
-                                "Приток возврата в %",
-                                "Отток клиентов из категории"
-                            ],
+                            options=list(MATRIX_VIEWS),
                             horizontal=True,
                             key="view_type_selector"
                         )
+                    view_key, description_text = MATRIX_VIEWS[view_type]
                     
                     # Уменьшаем отступ между кнопками и таблицей
                     st.markdown("<div style='margin-top: 5px;'></div>", unsafe_allow_html=True)
                     
-                    # Основной контент
-                    # Инициализируем переменные для таблицы и описания
-                    display_matrix = None
-                    description_text = ""
-                    view_key = ""
-                    
-                    # Подготовка данных в зависимости от выбранного типа
-                    if view_type == "Динамика уникальных клиентов когорт":
-                        # Применяем цветовое форматирование; нулевые значения скрываем
-                        matrix_int = cohort_matrix.astype(int)
-                        display_matrix = apply_matrix_color_gradient(matrix_int.astype(float), horizontal_dynamics=True, hide_before_diagonal=True, hide_zeros=True)
-                        display_matrix = display_matrix.format(precision=0, thousands=',', decimal='.')
-                        description_text = "Диагональ показывает количество уникальных клиентов в каждом периоде. Пересечения показывают количество клиентов, которые были активны в обоих периодах."
-                        view_key = "cohort"
-                        
-                    elif view_type == "Динамика накопления возврата":
-                        accumulation_matrix = st.session_state.accumulation_matrix
-                        matrix_int_accum = accumulation_matrix.astype(int)
-                        display_matrix = apply_matrix_color_gradient(matrix_int_accum.astype(float), hide_zeros=True)
-                        display_matrix = display_matrix.format(precision=0, thousands=',', decimal='.')
-                        description_text = "Показывает накопление уникальных клиентов когорты по периодам. Каждая ячейка содержит количество уникальных клиентов когорты, которые вернулись в любой период от начала когорты до текущего включительно."
-                        view_key = "accumulation"
-                        
-                    elif view_type == "Динамика накопления возврата в %":
-                        accumulation_percent_matrix = st.session_state.accumulation_percent_matrix
-                        display_matrix = apply_matrix_color_gradient(accumulation_percent_matrix, hide_zeros=True, horizontal_dynamics=True, hide_before_diagonal=True)
-                        
-                        # Форматирование процентов
-                        def format_percent_cell(val):
-                            if pd.isna(val) or val == '':
-                                return ''
-                            try:
-                                val_float = float(val)
-                                if val_float == 0:
-                                    return ''
-                                return f"{val_float:.1f}%"
-                            except (ValueError, TypeError):
-                                if isinstance(val, str) and '%' in val:
-                                    return val
-                                return ''
-                        
-                        display_matrix = display_matrix.format(formatter=format_percent_cell)
-                        description_text = "Показывает долю накопления уникальных клиентов когорты от общего количества клиентов в когорте. Значения выражены в процентах."
-                        view_key = "accumulation_percent"
-                        
-                    elif view_type == "Приток возврата в %":
-                        inflow_matrix = st.session_state.inflow_matrix
-                        display_matrix = apply_matrix_color_gradient(inflow_matrix, hide_zeros=True, horizontal_dynamics=True, hide_before_diagonal=True)
-                        
-                        # Форматирование процентов для притока
-                        def format_inflow_percent_cell(val):
-                            if pd.isna(val) or val == '':
-                                return ''
-                            try:
-                                val_float = float(val)
-                                if val_float == 0:
-                                    return ''
-                                return f"{val_float:.1f}%"
-                            except (ValueError, TypeError):
-                                if isinstance(val, str) and '%' in val:
-                                    return val
-                                return ''
-                        
-                        # Добавляем 0.0% на диагонали
-                        for row_name in display_matrix.data.index:
-                            if row_name in display_matrix.data.columns:
-                                display_matrix.data.loc[row_name, row_name] = '0.0%'
-                        
-                        format_dict_inflow = {col: format_inflow_percent_cell for col in display_matrix.data.columns}
-                        display_matrix = display_matrix.format(format_dict_inflow)
-                        description_text = "Показывает прирост уникальных клиентов когорты между периодами. Диагональ = 0%, первый период после диагонали = процент возврата, остальные = разница между накопительными процентами соседних периодов."
-                        view_key = "inflow"
-                    
-                    elif view_type == "Отток клиентов из категории":
-                        # Используем сохраненную таблицу оттока
-                        if st.session_state.get('churn_table') is not None:
-                            churn_table = st.session_state.churn_table
-                            
-                            # Форматируем таблицу для отображения
-                            churn_display = churn_table.copy()
-                            churn_display['Накопительный % возврата'] = churn_display['Накопительный % возврата'].apply(lambda x: x if x == '-' else f"{float(x):.1f}%")
-                            churn_display['Отток %'] = churn_display['Отток %'].apply(lambda x: x if x == '-' else f"{float(x):.1f}%")
-                            
-                            # Убеждаемся, что когорта - первый столбец
-                            column_order = ['Когорта', 'Кол-во клиентов когорты', 'Накопительное кол-во возврата', 
-                                          'Накопительный % возврата', 'Отток кол-во', 'Отток %']
-                            churn_display = churn_display[column_order]
-                            
-                            # Применяем стили для центрирования значений во всех столбцах
-                            def center_format(val):
-                                return 'text-align: center'
-                            
-                            # Создаем стилизованную таблицу с центрированием
-                            styled_churn = churn_display.style.applymap(center_format)
-                            
-                            # Используем styled_churn как display_matrix для единообразия
-                            display_matrix = styled_churn
-                            description_text = "Показывает клиентов, которые не вернулись в категорию ни разу после периода когорты."
-                            view_key = "churn"
-                        else:
-                            st.error("Таблица оттока не загружена. Пожалуйста, загрузите данные заново.")
-                            display_matrix = None
-                            description_text = ""
-                            view_key = ""
-                    
                     # Отображение описания с красивым оформлением
-                    if description_text:
-                        st.markdown(f'<div class="description-block">{description_text}</div>', unsafe_allow_html=True)
+                    st.markdown(f'<div class="description-block">{description_text}</div>', unsafe_allow_html=True)
                     
-                    # Создаем колонки для таблицы и кодов клиентов
+                    # Таблица и коды клиентов — отдельные фрагменты: выбор когорты и периода
+                    # перезапускает только панель кодов клиентов, а не всю страницу
                     col_table, col_clients = st.columns([4, 1])
                     
                     with col_table:
-                        # Отображение таблицы (широкая) с поддержкой полноэкранного режима
-                        if display_matrix is not None:
-                            # Для таблицы оттока скрываем индекс
-                            if view_key == "churn":
-                                st.dataframe(
-                                    display_matrix,
-                                    use_container_width=True,
-                                    hide_index=True
-                                )
-                                # Добавляем CSS для центрирования значений в таблице оттока
-                                st.markdown("""
-                                <style>
-                                div[data-testid="stDataFrame"] table td {
-                                    text-align: center !important;
-                                }
-                                div[data-testid="stDataFrame"] table th {
-                                    text-align: center !important;
-                                }
-                                </style>
-                                """, unsafe_allow_html=True)
-                            else:
-                                st.dataframe(
-                                    display_matrix,
-                                    use_container_width=True
-                                )
-                        else:
-                            st.info("Выберите тип отображения для просмотра данных.")
+                        render_matrix_panel(view_key, view_product, window_bounds, heatmap_view)
                     
                     with col_clients:
-                        # Компактный блок кодов клиентов
-                        st.markdown('<div style="background: white; padding: 10px; border-radius: 8px; margin-bottom: 10px; border: 2px solid #ccc; box-shadow: 0 2px 4px rgba(0,0,0,0.1);"><h4 style="color: #333; margin: 0;">👥 Коды клиентов</h4></div>', unsafe_allow_html=True)
-                        
-                        # Коды клиентов в зависимости от выбранного типа
-                        if view_key == "cohort":
-                            selected_cohort = st.selectbox(
-                                "Когорта:",
-                                options=sorted_periods,
-                                index=0,
-                                help="Выберите период, когда клиенты впервые появились",
-                                key="cohort_select_unified_1"
-                            )
-                            
-                            selected_period = st.selectbox(
-                                "Период:",
-                                options=sorted_periods,
-                                index=min(1, len(sorted_periods) - 1) if len(sorted_periods) > 1 else 0,
-                                help="Выберите период, для которого нужно показать клиентов",
-                                key="period_select_unified_1"
-                            )
-                            
-                            if selected_cohort and selected_period:
-                                period_clients_cache = st.session_state.get('period_clients_cache', None)
-                                client_cohorts_cache = st.session_state.get('client_cohorts_cache', None)
-                                common_clients = get_cohort_clients(df, year_month_col, client_col, selected_cohort, selected_period, period_clients_cache, client_cohorts_cache)
-                                
-                                if common_clients:
-                                    st.write(f"**Найдено: {len(common_clients)}**")
-                                    clients_csv = "\n".join([_format_client_code_for_copy(client) for client in common_clients])
-                                    create_copy_button(
-                                        clients_csv,
-                                        f"📋 Копировать ({len(common_clients)})",
-                                        "copy_clients_unified_1"
-                                    )
-                                else:
-                                    st.info(f"❌ Нет данных")
-                        
-                        elif view_key == "accumulation":
-                            selected_cohort = st.selectbox(
-                                "Когорта:",
-                                options=sorted_periods,
-                                index=0,
-                                help="Выберите период когорты",
-                                key="cohort_select_unified_2"
-                            )
-                            
-                            selected_period = st.selectbox(
-                                "Период:",
-                                options=sorted_periods,
-                                index=min(1, len(sorted_periods) - 1) if len(sorted_periods) > 1 else 0,
-                                help="Выберите период, до которого показывать накопленных клиентов",
-                                key="period_select_unified_2"
-                            )
-                            
-                            if selected_cohort and selected_period:
-                                period_clients_cache = st.session_state.get('period_clients_cache', None)
-                                client_cohorts_cache = st.session_state.get('client_cohorts_cache', None)
-                                accumulation_clients = get_accumulation_clients(df, year_month_col, client_col, sorted_periods, selected_cohort, selected_period, period_clients_cache=period_clients_cache, client_cohorts_cache=client_cohorts_cache)
-                                
-                                if accumulation_clients:
-                                    st.write(f"**Найдено: {len(accumulation_clients)}**")
-                                    clients_csv = "\n".join([_format_client_code_for_copy(client) for client in accumulation_clients])
-                                    create_copy_button(
-                                        clients_csv,
-                                        f"📋 Копировать ({len(accumulation_clients)})",
-                                        "copy_clients_unified_2"
-                                    )
-                                else:
-                                    st.info(f"❌ Нет данных")
-                        
-                        elif view_key == "accumulation_percent":
-                            selected_cohort = st.selectbox(
-                                "Когорта:",
-                                options=sorted_periods,
-                                index=0,
-                                help="Выберите период когорты",
-                                key="cohort_select_unified_3"
-                            )
-                            
-                            selected_period = st.selectbox(
-                                "Период:",
-                                options=sorted_periods,
-                                index=min(1, len(sorted_periods) - 1) if len(sorted_periods) > 1 else 0,
-                                help="Выберите период, до которого показывать накопленных клиентов",
-                                key="period_select_unified_3"
-                            )
-                            
-                            if selected_cohort and selected_period:
-                                period_clients_cache = st.session_state.get('period_clients_cache', None)
-                                client_cohorts_cache = st.session_state.get('client_cohorts_cache', None)
-                                accumulation_clients = get_accumulation_clients(df, year_month_col, client_col, sorted_periods, selected_cohort, selected_period, period_clients_cache=period_clients_cache, client_cohorts_cache=client_cohorts_cache)
-                                
-                                if accumulation_clients:
-                                    st.write(f"**Найдено: {len(accumulation_clients)}**")
-                                    clients_csv = "\n".join([_format_client_code_for_copy(client) for client in accumulation_clients])
-                                    create_copy_button(
-                                        clients_csv,
-                                        f"📋 Копировать ({len(accumulation_clients)})",
-                                        "copy_clients_unified_3"
-                                    )
-                                else:
-                                    st.info(f"❌ Нет данных")
-                        
-                        elif view_key == "inflow":
-                            selected_cohort = st.selectbox(
-                                "Когорта:",
-                                options=sorted_periods,
-                                index=0,
-                                help="Выберите период когорты",
-                                key="cohort_select_unified_4"
-                            )
-                            
-                            selected_period = st.selectbox(
-                                "Период:",
-                                options=sorted_periods,
-                                index=min(1, len(sorted_periods) - 1) if len(sorted_periods) > 1 else 0,
-                                help="Выберите период, для которого показать новых вернувшихся клиентов",
-                                key="period_select_unified_4"
-                            )
-                            
-                            if selected_cohort and selected_period:
-                                period_clients_cache = st.session_state.get('period_clients_cache', None)
-                                client_cohorts_cache = st.session_state.get('client_cohorts_cache', None)
-                                inflow_clients = get_inflow_clients(df, year_month_col, client_col, sorted_periods, selected_cohort, selected_period, period_clients_cache, client_cohorts_cache)
-                                
-                                if inflow_clients:
-                                    st.write(f"**Найдено: {len(inflow_clients)}**")
-                                    clients_csv = "\n".join([_format_client_code_for_copy(client) for client in inflow_clients])
-                                    create_copy_button(
-                                        clients_csv,
-                                        f"📋 Копировать ({len(inflow_clients)})",
-                                        "copy_clients_unified_4"
-                                    )
-                                else:
-                                    st.info(f"❌ Нет данных")
-                        
-                        elif view_key == "churn":
-                            # Для оттока только выбор когорты, без периода
-                            selected_cohort = st.selectbox(
-                                "Когорта:",
-                                options=sorted_periods,
-                                index=0,
-                                help="Выберите когорту для скачивания списка клиентов оттока из категории",
-                                key="cohort_select_unified_5"
-                            )
-                            
-                            if selected_cohort:
-                                period_clients_cache = st.session_state.get('period_clients_cache', None)
-                                client_cohorts_cache = st.session_state.get('client_cohorts_cache', None)
-                                churn_clients = get_churn_clients(df, year_month_col, client_col, sorted_periods, selected_cohort, period_clients_cache, client_cohorts_cache)
-                                
-                                if churn_clients:
-                                    st.write(f"**Найдено: {len(churn_clients)}**")
-                                    clients_csv = "\n".join([_format_client_code_for_copy(client) for client in churn_clients])
-                                    create_copy_button(
-                                        clients_csv,
-                                        f"📋 Копировать ({len(churn_clients)})",
-                                        "copy_clients_unified_5"
-                                    )
-                                else:
-                                    st.info(f"❌ Нет данных")
-                                
-                                # Кнопка для скачивания всех когорт (всегда видна)
-                                all_churn_clients = set()
-                                client_cohorts_cache = st.session_state.get('client_cohorts_cache', None)
-                                for cohort in sorted_periods:
-                                    cohort_churn = get_churn_clients(df, year_month_col, client_col, sorted_periods, cohort, period_clients_cache, client_cohorts_cache)
-                                    all_churn_clients.update(cohort_churn)
-                                
-                                if all_churn_clients:
-                                    all_clients_csv = "\n".join([_format_client_code_for_copy(client) for client in sorted(all_churn_clients)])
-                                    create_copy_button(
-                                        all_clients_csv,
-                                        f"📋 Копировать коды клиентов оттока всех когорт ({len(all_churn_clients)})",
-                                        "copy_all_churn_clients"
-                                    )
+                        render_client_codes_panel(view_key, view_product, window_bounds)
+                    
+                    # Взвешенные матрицы по числовым показателям выгрузки (сумма, количество) — по тому же срезу
+                    value_cols = st.session_state.get('value_cols') or []
+                    if value_cols:
+                        render_value_panel(value_cols, view_product, window_bounds)
                     
                     # Шестой блок - Присутствие клиентов оттока в других категориях
                     st.markdown("---")
@@ -1642,622 +1604,64 @@ if uploaded_file is not None:
                     # Обработка загруженного файла
                     if uploaded_file_categories is not None:
                         try:
-                            # Загрузка Excel файла
-                            if uploaded_file_categories.name.endswith('.xlsx'):
-                                df_categories = pd.read_excel(uploaded_file_categories, engine='openpyxl')
-                            else:
-                                df_categories = pd.read_excel(uploaded_file_categories, engine='xlrd')
-                            
-                            # Определяем столбцы
-                            group_col = None
-                            year_month_col = None
-                            month_col = None
-                            clients_col = None
-                            client_code_col = None
-                            
-                            # Ищем столбец Группа (может быть Группа1, Группа2, Группа3 и т.д.)
-                            for col in df_categories.columns:
-                                col_lower = str(col).lower().strip()
-                                if 'группа' in col_lower:
-                                    group_col = col
-                                    break
-                            
-                            # Ищем столбец периода (Год-месяц или Год-неделя)
-                            for col in df_categories.columns:
-                                col_lower = str(col).lower().strip()
-                                if 'год' in col_lower and ('месяц' in col_lower or 'неделя' in col_lower):
-                                    year_month_col = col
-                                    break
-                            
-                            # Ищем столбец месяц
-                            for col in df_categories.columns:
-                                col_lower = str(col).lower().strip()
-                                if col_lower == 'месяц' or (col_lower.startswith('месяц') and len(col_lower.split()) == 1):
-                                    month_col = col
-                                    break
-                            
-                            # Ищем столбец Клиентов
-                            for col in df_categories.columns:
-                                col_lower = str(col).lower().strip()
-                                if 'клиент' in col_lower and ('ов' in col_lower or 'ов' in col_lower):
-                                    clients_col = col
-                                    break
-                            
-                            # Ищем столбец Код клиента
-                            for col in df_categories.columns:
-                                col_lower = str(col).lower().strip()
-                                if 'код' in col_lower and 'клиент' in col_lower:
-                                    client_code_col = col
-                                    break
+                            # Индекс файла категорий (разбирается один раз на содержимое файла):
+                            # столбцы Группа (Группа1, Группа2, ...), период, Код клиента
+                            set_category_file(uploaded_file_categories)
+                            category_index = graph.get('category_index')
+                            group_col, year_month_col, client_code_col = (
+                                category_index.group_col, category_index.year_month_col, category_index.client_code_col
+                            )
                             
                             # Проверяем наличие всех необходимых столбцов
                             if group_col is None:
                                 st.error("❌ Не найден столбец с категориями (Группа1, Группа2, Группа3 и т.д.). Убедитесь, что в файле есть столбец с названием, содержащим 'Группа'.")
                             elif client_code_col is None:
                                 st.error("❌ Не найден столбец 'Код клиента'. Убедитесь, что в файле есть столбец с названием, содержащим 'Код' и 'клиент'.")
-                            elif year_month_col is None:
-                                st.warning("⚠️ Не найден столбец периода ('Год-месяц' или 'Год-неделя'). Данные будут обработаны без фильтрации по периоду.")
                             else:
-                                # Получаем уникальные категории
-                                categories = df_categories[group_col].dropna().unique()
-                                categories = sorted([str(cat) for cat in categories if str(cat).strip() != ''])
-                                
-                                # Сохраняем данные о категориях в session_state для использования в Excel отчёте
-                                st.session_state.df_categories = df_categories
-                                st.session_state.categories_list = categories
-                                st.session_state.group_col_name = group_col
-                                st.session_state.year_month_col_name = year_month_col
-                                st.session_state.client_code_col_name = client_code_col
-                                
-                                # Получаем клиентов оттока для каждой когорты
-                                period_clients_cache = st.session_state.get('period_clients_cache', None)
-                                
-                                # Рассчитываем метрики для всех когорт для сводной таблицы
-                                total_present_after_cohort_by_cohort = {}
-                                total_present_after_cohort_percent_by_cohort = {}
-                                network_churn_by_cohort = {}
-                                network_churn_percent_by_cohort = {}
-                                
-                                # Собираем всех клиентов из категорий (для всех периодов)
-                                all_category_clients_all_periods = set()
-                                if year_month_col is not None:
-                                    for category in categories:
-                                        category_data = df_categories[df_categories[group_col] == category]
-                                        category_clients = set(category_data[client_code_col].dropna().astype(str).unique())
-                                        all_category_clients_all_periods.update(category_clients)
-                                else:
-                                    for category in categories:
-                                        category_data = df_categories[df_categories[group_col] == category]
-                                        category_clients = set(category_data[client_code_col].dropna().astype(str).unique())
-                                        all_category_clients_all_periods.update(category_clients)
-                                
-                                # Для каждой когорты рассчитываем метрики (столбцы первого файла — из session_state)
-                                churn_table = st.session_state.churn_table
-                                client_cohorts_cache = st.session_state.get('client_cohorts_cache', None)
-                                year_month_col_1st = st.session_state.year_month_col
-                                client_col_1st = st.session_state.client_col
-                                all_network_churn_clients = set()
-                                for cohort_period in sorted_periods:
-                                    churn_clients_set_cohort = set(get_churn_clients(df, year_month_col_1st, client_col_1st, sorted_periods, cohort_period, period_clients_cache, client_cohorts_cache))
-                                    churn_clients_set_cohort = {normalize_client_code(c) for c in churn_clients_set_cohort}
-                                    churn_clients_set_cohort = {c for c in churn_clients_set_cohort if c}
-                                    
-                                    cohort_row = churn_table[churn_table['Когорта'] == cohort_period]
-                                    churn_count_cohort = _churn_int(cohort_row.iloc[0]['Отток кол-во']) if not cohort_row.empty else 0
-                                    cohort_size_cohort = int(cohort_row.iloc[0]['Кол-во клиентов когорты']) if not cohort_row.empty else 0
-                                    
-                                    cohort_index_cohort = sorted_periods.index(cohort_period) if cohort_period in sorted_periods else 0
-                                    periods_from_cohort_cohort = sorted_periods[cohort_index_cohort:]
-                                    periods_after_cohort_cohort = periods_from_cohort_cohort[1:] if len(periods_from_cohort_cohort) > 1 else []
-                                    
-                                    all_category_clients_after_cohort = set()
-                                    if year_month_col is not None and len(periods_after_cohort_cohort) > 0:
-                                        periods_after_set_cohort = {normalize_period_for_compare(p) for p in periods_after_cohort_cohort}
-                                        for category in categories:
-                                            category_data = df_categories[df_categories[group_col] == category]
-                                            period_norm = category_data[year_month_col].apply(normalize_period_for_compare)
-                                            category_data_filtered = category_data[period_norm.isin(periods_after_set_cohort)]
-                                            category_clients = {normalize_client_code(c) for c in category_data_filtered[client_code_col].dropna()}
-                                            category_clients = {c for c in category_clients if c}
-                                            all_category_clients_after_cohort.update(category_clients)
-                                    elif year_month_col is None:
-                                        all_category_clients_after_cohort = all_category_clients_all_periods
-                                    
-                                    present_in_categories_after_cohort = churn_clients_set_cohort & all_category_clients_after_cohort
-                                    total_present_after_cohort_by_cohort[cohort_period] = len(present_in_categories_after_cohort)
-                                    
-                                    # % присутствия после месяца когорты
-                                    present_after_cohort_percent = (len(present_in_categories_after_cohort) / cohort_size_cohort * 100) if cohort_size_cohort > 0 else 0
-                                    total_present_after_cohort_percent_by_cohort[cohort_period] = present_after_cohort_percent
-                                    
-                                    # Отток из сети = Отток из категории - Клиентов когорты присутствуют в других категориях после месяца когорты
-                                    network_churn_cohort = churn_count_cohort - len(present_in_categories_after_cohort)
-                                    network_churn_by_cohort[cohort_period] = max(0, network_churn_cohort)  # Не может быть отрицательным
-                                    
-                                    # % оттока из сети
-                                    network_churn_percent_cohort = (network_churn_by_cohort[cohort_period] / cohort_size_cohort * 100) if cohort_size_cohort > 0 else 0
-                                    network_churn_percent_by_cohort[cohort_period] = network_churn_percent_cohort
-                                    
-                                    # Собираем клиентов оттока из сети для этой когорты
-                                    network_churn_clients_cohort = churn_clients_set_cohort - all_category_clients_after_cohort
-                                    all_network_churn_clients.update(network_churn_clients_cohort)
-                                
-                                # Ключи метрик с учётом типа периода (недели/месяцы)
-                                _pa = st.session_state.get('period_after_label', 'месяца')
-                                _key_итого = f"Итого присутствуют в других категориях после {_pa} когорты"
-                                _key_доля = f"Доля присутствуют в других категориях после {_pa} когорты"
-                                summary_table_excel = pd.DataFrame({
-                                    'Отток из сети': network_churn_by_cohort,
-                                    'Доля оттока из сети от когорты': network_churn_percent_by_cohort,
-                                    _key_итого: total_present_after_cohort_by_cohort,
-                                    _key_доля: total_present_after_cohort_percent_by_cohort
-                                })
-                                summary_table_excel = summary_table_excel.T
-                                
-                                # Сохраняем данные для Excel отчёта и сводной таблицы
-                                st.session_state.category_summary_table = summary_table_excel
-                                st.session_state.category_cohort_table = None
-                                
-                                # Устанавливаем флаг успешной загрузки и обработки второго файла
-                                st.session_state.categories_file_uploaded = True
-                                
-                                # Обновляем Excel отчёт после сохранения всех данных
-                                if 'excel_report_cache_key' in st.session_state:
-                                    del st.session_state.excel_report_cache_key
-                                
-                                # Перегенерируем Excel отчёт после сохранения данных о категориях
-                                # Используем st.rerun() для обновления, но только если данные изменились
-                                # Вместо этого просто перегенерируем отчет
-                                try:
-                                    # Небольшая задержка для гарантии сохранения данных
-                                    st.session_state.excel_report_data = create_full_report_excel()
-                                except Exception as e:
-                                    st.warning(f"Не удалось обновить Excel отчёт: {str(e)}")
+                                if year_month_col is None:
+                                    st.warning("⚠️ Не найден столбец периода ('Год-месяц' или 'Год-неделя'). Данные будут обработаны без фильтрации по периоду.")
                                 
                                 # Новый интерфейс: слева выбор когорты, справа таблица
-                                st.markdown("### 📊 Присутствие клиентов оттока когорты в других категориях товаров")
-                                
-                                col_cohort_select, col_table = st.columns([1, 4])
-                                
-                                with col_cohort_select:
-                                    selected_cohort = st.selectbox(
-                                        "Выберите когорту:",
-                                        options=sorted_periods,
-                                        index=0,
-                                        help="Выберите когорту для анализа присутствия её клиентов оттока в других категориях",
-                                        key="category_cohort_select"
-                                    )
-                                    
-                                    # Определяем периоды начиная с выбранной когорты
-                                    cohort_index = sorted_periods.index(selected_cohort) if selected_cohort in sorted_periods else 0
-                                    periods_from_cohort = sorted_periods[cohort_index:]
-                                    # Периоды ПОСЛЕ когорты (исключая период когорты) - начинаем расчет с этого периода
-                                    periods_after_cohort = periods_from_cohort[1:] if len(periods_from_cohort) > 1 else []
-                                    
-                                    # Получаем клиентов оттока для выбранной когорты (столбцы — из первого файла)
-                                    client_cohorts_cache = st.session_state.get('client_cohorts_cache', None)
-                                    year_month_col_1 = st.session_state.year_month_col
-                                    client_col_1 = st.session_state.client_col
-                                    churn_clients_set = set(get_churn_clients(df, year_month_col_1, client_col_1, sorted_periods, selected_cohort, period_clients_cache, client_cohorts_cache))
-                                    churn_clients_set = {normalize_client_code(c) for c in churn_clients_set if normalize_client_code(c)}
-                                    
-                                    # Получаем размер когорты и отток из churn_table
-                                    churn_table = st.session_state.churn_table
-                                    cohort_row = churn_table[churn_table['Когорта'] == selected_cohort]
-                                    cohort_size = int(cohort_row.iloc[0]['Кол-во клиентов когорты']) if not cohort_row.empty else 0
-                                    churn_count = _churn_int(cohort_row.iloc[0]['Отток кол-во']) if not cohort_row.empty else 0
-                                    
-                                    # Клиенты оттока, присутствующие в других категориях ПОСЛЕ периода когорты (столбец периода — из второго файла)
-                                    all_category_clients_after_cohort = set()
-                                    year_month_col_cat_ui = year_month_col  # столбец периода во втором файле
-                                    if year_month_col_cat_ui is not None and len(periods_after_cohort) > 0:
-                                        periods_after_set = {normalize_period_for_compare(p) for p in periods_after_cohort}
-                                        for category in categories:
-                                            category_data = df_categories[df_categories[group_col] == category]
-                                            period_norm = category_data[year_month_col_cat_ui].apply(normalize_period_for_compare)
-                                            category_data_filtered = category_data[period_norm.isin(periods_after_set)]
-                                            category_clients = {normalize_client_code(c) for c in category_data_filtered[client_code_col].dropna()}
-                                            category_clients = {c for c in category_clients if c}
-                                            all_category_clients_after_cohort.update(category_clients)
-                                    elif year_month_col is None:
-                                        for category in categories:
-                                            category_data = df_categories[df_categories[group_col] == category]
-                                            category_clients = {normalize_client_code(c) for c in category_data[client_code_col].dropna()}
-                                            category_clients = {c for c in category_clients if c}
-                                            all_category_clients_after_cohort.update(category_clients)
-                                    
-                                    present_in_categories_after_cohort = churn_clients_set & all_category_clients_after_cohort
-                                    present_count_after_cohort = len(present_in_categories_after_cohort)
-                                    present_percent_after_cohort = (present_count_after_cohort / cohort_size * 100) if cohort_size > 0 else 0
-                                    
-                                    # Отток из сети = Отток из категории - Клиентов когорты присутствуют в других категориях после месяца когорты
-                                    network_churn = churn_count - present_count_after_cohort
-                                    network_churn = max(0, network_churn)  # Не может быть отрицательным
-                                    network_churn_percent = (network_churn / cohort_size * 100) if cohort_size > 0 else 0
-                                    
-                                    # Вычисляем клиентов оттока из сети
-                                    # Это клиенты оттока, которые НЕ присутствуют в других категориях после месяца когорты
-                                    network_churn_clients = churn_clients_set - all_category_clients_after_cohort
-                                    network_churn_clients_list = sorted(list(network_churn_clients))
-                                    
-                                    _pa_label = st.session_state.get('period_after_label', 'месяца')
-                                    metrics_html = f"""
-                                    <div style="line-height: 2;">
-                                    <p style="color: #333; font-size: 1rem; margin: 8px 0;">
-                                        <strong style="color: #1f77b4;">Клиентов когорты присутствуют в других категориях после {_pa_label} когорты:</strong> 
-                                        <span style="color: #2c3e50; font-weight: 600;">{present_count_after_cohort} ({present_percent_after_cohort:.1f}%)</span>
-                                    </p>
-                                    <p style="color: #333; font-size: 1rem; margin: 8px 0;">
-                                        <strong style="color: #1f77b4;">Отток из сети:</strong> 
-                                        <span style="color: #e74c3c; font-weight: 600;">{network_churn} ({network_churn_percent:.1f}%)</span>
-                                    </p>
-                                    </div>
-                                    """
-                                    st.markdown(metrics_html, unsafe_allow_html=True)
-                                    
-                                    # Кнопка копирования кодов клиентов оттока из сети для выбранной когорты
-                                    if network_churn_clients_list:
-                                        network_churn_clients_csv = "\n".join([_format_client_code_for_copy(client) for client in network_churn_clients_list])
-                                        create_copy_button(
-                                            network_churn_clients_csv,
-                                            f"📋 Копировать коды клиентов оттока из сети ({len(network_churn_clients_list)})",
-                                            f"copy_network_churn_{selected_cohort}"
-                                        )
-                                    else:
-                                        st.info("ℹ️ Отток из сети равен 0 или все клиенты оттока присутствуют в других категориях")
-                                
-                                with col_table:
-                                    # Определяем периоды ПОСЛЕ выбранной когорты (для использования в таблице)
-                                    cohort_index_table = sorted_periods.index(selected_cohort) if selected_cohort in sorted_periods else 0
-                                    periods_from_cohort_table = sorted_periods[cohort_index_table:]
-                                    # Периоды ПОСЛЕ когорты (исключая период когорты) - начинаем расчет с этого периода
-                                    periods_after_cohort_table = periods_from_cohort_table[1:] if len(periods_from_cohort_table) > 1 else []
-                                    
-                                    # Создаем таблицу: категории по строкам, периоды по столбцам (только ПОСЛЕ выбранной когорты)
-                                    category_period_table = pd.DataFrame(index=categories, columns=periods_after_cohort_table)
-                                    
-                                    # Словарь для хранения уникальных клиентов по периодам (для итоговой строки)
-                                    period_unique_clients = {period: set() for period in periods_after_cohort_table}
-                                    
-                                    # Словарь для хранения уникальных клиентов по категориям (для итогового столбца)
-                                    category_unique_clients = {category: set() for category in categories}
-                                    
-                                    # Если есть столбец периода во втором файле, фильтруем по периодам (нормализованное сравнение)
-                                    if year_month_col is not None:
-                                        cat_period_norm_ui = df_categories[year_month_col].apply(normalize_period_for_compare)
-                                        periods_after_norm_set = {normalize_period_for_compare(p) for p in periods_after_cohort_table}
-                                        for period in periods_after_cohort_table:
-                                            period_norm_key = normalize_period_for_compare(period)
-                                            period_data = df_categories[cat_period_norm_ui == period_norm_key]
-                                            
-                                            for category in categories:
-                                                category_period_data = period_data[
-                                                    (period_data[group_col] == category) & 
-                                                    (period_data[client_code_col].notna())
-                                                ]
-                                                category_period_clients = {
-                                                    normalize_client_code(c) for c in category_period_data[client_code_col].dropna()
-                                                }
-                                                category_period_clients = {c for c in category_period_clients if c}
-                                                intersection = churn_clients_set & category_period_clients
-                                                category_period_table.loc[category, period] = len(intersection)
-                                                
-                                                # Добавляем в множества для итогов
-                                                period_unique_clients[period].update(intersection)
-                                                category_unique_clients[category].update(intersection)
-                                    else:
-                                        category_clients_dict = {}
-                                        for category in categories:
-                                            category_data = df_categories[df_categories[group_col] == category]
-                                            client_codes = {normalize_client_code(c) for c in category_data[client_code_col].dropna()}
-                                            client_codes = {c for c in client_codes if c}
-                                            category_clients_dict[category] = client_codes
-                                        
-                                        # Для каждого периода ПОСЛЕ выбранной когорты используем одинаковые данные
-                                        for period in periods_after_cohort_table:
-                                            for category in categories:
-                                                category_clients_set = category_clients_dict.get(category, set())
-                                                intersection = churn_clients_set & category_clients_set
-                                                category_period_table.loc[category, period] = len(intersection)
-                                                
-                                                # Добавляем в множества для итогов
-                                                period_unique_clients[period].update(intersection)
-                                                category_unique_clients[category].update(intersection)
-                                    
-                                    # Заполняем NaN нулями
-                                    category_period_table = category_period_table.fillna(0).astype(int)
-                                    
-                                    # Создаем итоговую строку по периодам (уникальные клиенты по всем категориям)
-                                    totals_row = pd.Series(
-                                        {period: len(period_unique_clients[period]) for period in periods_after_cohort_table},
-                                        name='Итого клиентов'
-                                    )
-                                    
-                                    # Создаем итоговый столбец по категориям (уникальные клиенты за весь период)
-                                    totals_col = pd.Series(
-                                        {category: len(category_unique_clients[category]) for category in categories},
-                                        name='Итого'
-                                    )
-                                    
-                                    # Добавляем итоговую строку в таблицу
-                                    category_period_table_with_totals = category_period_table.copy()
-                                    category_period_table_with_totals.loc['Итого клиентов'] = totals_row
-                                    
-                                    # Добавляем итоговый столбец
-                                    category_period_table_with_totals['Итого'] = totals_col
-                                    category_period_table_with_totals.loc['Итого клиентов', 'Итого'] = len(present_in_categories_after_cohort)
-                                    
-                                    # Переупорядочиваем строки: итоговая строка наверх
-                                    new_index = ['Итого клиентов'] + [cat for cat in categories]
-                                    category_period_table_with_totals = category_period_table_with_totals.reindex(new_index)
-                                    
-                                    # Переупорядочиваем столбцы: итоговый столбец слева (после индекса, перед периодами)
-                                    new_columns = ['Итого'] + list(periods_after_cohort_table)
-                                    category_period_table_with_totals = category_period_table_with_totals[new_columns]
-                                    
-                                    # Отображаем основную таблицу с итогами
-                                    st.dataframe(
-                                        category_period_table_with_totals,
-                                        use_container_width=True
-                                    )
-                                    
-                                    # Добавляем стили для центрирования, выделения итоговых значений жирным, пастельным цветом и закрепления
-                                    st.markdown("""
-                                    <style>
-                                    div[data-testid="stDataFrame"] table td {
-                                        text-align: center !important;
-                                    }
-                                    div[data-testid="stDataFrame"] table th {
-                                        text-align: center !important;
-                                    }
-                                    /* Закрепляем первую строку (итоговая строка "Итого клиентов") сверху */
-                                    div[data-testid="stDataFrame"] table tbody tr:first-child td,
-                                    div[data-testid="stDataFrame"] table tbody tr:first-child th {
-                                        font-weight: bold !important;
-                                        background-color: #E3F2FD !important;
-                                        position: sticky !important;
-                                        top: 0 !important;
-                                        z-index: 10 !important;
-                                    }
-                                    /* Закрепляем первый столбец данных (итоговый столбец "Итого") слева */
-                                    div[data-testid="stDataFrame"] table tbody tr td:nth-child(2),
-                                    div[data-testid="stDataFrame"] table thead tr th:nth-child(2) {
-                                        font-weight: bold !important;
-                                        background-color: #E3F2FD !important;
-                                        position: sticky !important;
-                                        left: 0 !important;
-                                        z-index: 5 !important;
-                                    }
-                                    /* Закрепляем ячейку пересечения итоговых строки и столбца (и сверху, и слева) */
-                                    div[data-testid="stDataFrame"] table tbody tr:first-child td:nth-child(2) {
-                                        background-color: #BBDEFB !important;
-                                        font-weight: bold !important;
-                                        position: sticky !important;
-                                        top: 0 !important;
-                                        left: 0 !important;
-                                        z-index: 15 !important;
-                                    }
-                                    /* Закрепляем заголовок итогового столбца */
-                                    div[data-testid="stDataFrame"] table thead tr th:nth-child(2) {
-                                        position: sticky !important;
-                                        left: 0 !important;
-                                        z-index: 6 !important;
-                                    }
-                                    </style>
-                                    <script>
-                                    // Дополнительный скрипт для гарантированного выделения жирным, цветом и закрепления
-                                    setTimeout(function() {
-                                        const tables = document.querySelectorAll('div[data-testid="stDataFrame"] table');
-                                        tables.forEach(table => {
-                                            // Первая строка (итоговая) - закрепляем сверху
-                                            const firstRow = table.querySelector('tbody tr:first-child');
-                                            if (firstRow) {
-                                                firstRow.querySelectorAll('td, th').forEach(cell => {
-                                                    cell.style.fontWeight = 'bold';
-                                                    cell.style.position = 'sticky';
-                                                    cell.style.top = '0';
-                                                    cell.style.zIndex = '10';
-                                                    if (!cell.style.backgroundColor || cell.style.backgroundColor === '') {
-                                                        cell.style.backgroundColor = '#E3F2FD';
-                                                    }
-                                                });
-                                            }
-                                            // Первый столбец данных (итоговый) - закрепляем слева
-                                            table.querySelectorAll('tbody tr').forEach(row => {
-                                                const firstDataCell = row.querySelector('td:nth-child(2)');
-                                                if (firstDataCell) {
-                                                    firstDataCell.style.fontWeight = 'bold';
-                                                    firstDataCell.style.position = 'sticky';
-                                                    firstDataCell.style.left = '0';
-                                                    firstDataCell.style.zIndex = '5';
-                                                    if (!firstDataCell.style.backgroundColor || firstDataCell.style.backgroundColor === '') {
-                                                        firstDataCell.style.backgroundColor = '#E3F2FD';
-                                                    }
-                                                }
-                                            });
-                                            const firstHeader = table.querySelector('thead th:nth-child(2)');
-                                            if (firstHeader) {
-                                                firstHeader.style.fontWeight = 'bold';
-                                                firstHeader.style.backgroundColor = '#E3F2FD';
-                                                firstHeader.style.position = 'sticky';
-                                                firstHeader.style.left = '0';
-                                                firstHeader.style.zIndex = '6';
-                                            }
-                                            // Ячейка пересечения - закрепляем и сверху, и слева
-                                            const intersectionCell = table.querySelector('tbody tr:first-child td:nth-child(2)');
-                                            if (intersectionCell) {
-                                                intersectionCell.style.backgroundColor = '#BBDEFB';
-                                                intersectionCell.style.position = 'sticky';
-                                                intersectionCell.style.top = '0';
-                                                intersectionCell.style.left = '0';
-                                                intersectionCell.style.zIndex = '15';
-                                            }
-                                        });
-                                    }, 100);
-                                    </script>
-                                    """, unsafe_allow_html=True)
+                                # (сводка по когортам для отчёта и сводной таблицы — узел графа category_summary)
+                                render_category_cohort_panel()
                                 
                         except Exception as e:
                             st.error(f"❌ Ошибка при обработке файла: {str(e)}")
                             st.exception(e)
-                            # Сбрасываем флаг при ошибке обработки
-                            st.session_state.categories_file_uploaded = False
-                    else:
-                        # Если файл не загружен, сбрасываем флаг и очищаем данные
-                        if st.session_state.get('categories_file_uploaded', False):
-                            st.session_state.categories_file_uploaded = False
-                            # Очищаем данные категорий
-                            if 'df_categories' in st.session_state:
-                                del st.session_state.df_categories
-                            if 'category_summary_table' in st.session_state:
-                                del st.session_state.category_summary_table
-                            if 'category_cohort_table' in st.session_state:
-                                del st.session_state.category_cohort_table
                     
                     # Сводная таблица по всем когортам (после блока присутствия клиентов)
-                    st.markdown("---")
-                    st.subheader("📊 Сводная таблица по всем когортам")
-                    st.caption("Чем ближе когорта к последнему периоду в выгрузке, тем менее сопоставимы метрики: накопленный возврат ещё не успевает сформироваться, а доля оттока завышена из‑за короткого горизонта наблюдения.")
-                    if st.session_state.get('churn_table') is not None:
-                        churn_table = st.session_state.churn_table
-                        has_categories_file = (
-                            st.session_state.get('upload_categories_file') is not None or
-                            st.session_state.get('category_summary_table') is not None
-                        )
-                        summary_data = {}
-                        
-                        # 1. Кол-во клиентов в когорте
-                        summary_data['Кол-во клиентов в когорте'] = {}
-                        for _, row in churn_table.iterrows():
-                            cohort = row['Когорта']
-                            summary_data['Кол-во клиентов в когорте'][cohort] = int(row['Кол-во клиентов когорты'])
-                        
-                        # 2. Накопительное кол-во вернувшихся в категорию
-                        summary_data['Накопительное кол-во вернувшихся в категорию'] = {}
-                        for _, row in churn_table.iterrows():
-                            cohort = row['Когорта']
-                            summary_data['Накопительное кол-во вернувшихся в категорию'][cohort] = _churn_int(row['Накопительное кол-во возврата'])
-                        
-                        # 3. Накопительное кол-во вернувшихся в категорию %
-                        summary_data['Накопительное кол-во вернувшихся в категорию %'] = {}
-                        for _, row in churn_table.iterrows():
-                            cohort = row['Когорта']
-                            v_ret = row['Накопительный % возврата']
-                            summary_data['Накопительное кол-во вернувшихся в категорию %'][cohort] = v_ret if v_ret == '-' else f"{float(v_ret):.1f}%"
-                        
-                        # 4–5. Отток из категории (из первого файла — всегда при наличии churn_table)
-                        summary_data['Отток из категории когорты'] = {}
-                        for _, row in churn_table.iterrows():
-                            cohort = row['Когорта']
-                            summary_data['Отток из категории когорты'][cohort] = _churn_int(row['Отток кол-во'])
-                        summary_data['Отток из категории когорты %'] = {}
-                        for _, row in churn_table.iterrows():
-                            cohort = row['Когорта']
-                            v = row['Отток %']
-                            summary_data['Отток из категории когорты %'][cohort] = v if v == '-' else f"{float(v):.1f}%"
-                        
-                        if has_categories_file:
-                            _pa_ui = st.session_state.get('period_after_label', 'месяца')
-                            _key_итого_ui = f"Итого присутствуют в других категориях после {_pa_ui} когорты"
-                            _key_доля_ui = f"Доля присутствуют в других категориях после {_pa_ui} когорты"
-                            _key_кол_ui = f"Кол-во клиентов когорты в других категориях после {_pa_ui} когорты"
-                            _key_кол_pct_ui = f"Кол-во клиентов когорты в других категориях после {_pa_ui} когорты %"
-                            summary_data[_key_кол_ui] = {}
-                            summary_data[_key_кол_pct_ui] = {}
-                            summary_data['Отток из сети'] = {}
-                            summary_data['Отток из сети %'] = {}
-                            
-                            for cohort in sorted_periods:
-                                summary_data[_key_кол_ui][cohort] = 0
-                                summary_data[_key_кол_pct_ui][cohort] = "0.0%"
-                                summary_data['Отток из сети'][cohort] = 0
-                                summary_data['Отток из сети %'][cohort] = "0.0%"
-                            
-                            if 'category_summary_table' in st.session_state and st.session_state.category_summary_table is not None:
-                                category_summary = st.session_state.category_summary_table
-                                if _key_итого_ui in category_summary.index:
-                                    for cohort in sorted_periods:
-                                        if cohort in category_summary.columns:
-                                            value = category_summary.loc[_key_итого_ui, cohort]
-                                            summary_data[_key_кол_ui][cohort] = int(value) if pd.notna(value) else 0
-                                        else:
-                                            summary_data[_key_кол_ui][cohort] = 0
-                                if _key_доля_ui in category_summary.index:
-                                    for cohort in sorted_periods:
-                                        if cohort in category_summary.columns:
-                                            value = category_summary.loc[_key_доля_ui, cohort]
-                                            if pd.notna(value):
-                                                summary_data[_key_кол_pct_ui][cohort] = f"{float(value):.1f}%"
-                                            else:
-                                                summary_data[_key_кол_pct_ui][cohort] = "0.0%"
-                                        else:
-                                            summary_data[_key_кол_pct_ui][cohort] = "0.0%"
-                                else:
-                                    for cohort in sorted_periods:
-                                        cohort_size = summary_data['Кол-во клиентов в когорте'].get(cohort, 0)
-                                        present_after_count = summary_data[_key_кол_ui].get(cohort, 0)
-                                        if cohort_size > 0:
-                                            percent = (present_after_count / cohort_size) * 100
-                                            summary_data[_key_кол_pct_ui][cohort] = f"{percent:.1f}%"
-                                        else:
-                                            summary_data[_key_кол_pct_ui][cohort] = "0.0%"
-                                
-                                # 8. Отток из сети (обновляем значения)
-                                if 'Отток из сети' in category_summary.index:
-                                    for cohort in sorted_periods:
-                                        if cohort in category_summary.columns:
-                                            value = category_summary.loc['Отток из сети', cohort]
-                                            summary_data['Отток из сети'][cohort] = int(value) if pd.notna(value) else 0
-                                        else:
-                                            summary_data['Отток из сети'][cohort] = 0
-                                else:
-                                    for cohort in sorted_periods:
-                                        summary_data['Отток из сети'][cohort] = 0
-                                
-                                # 9. Отток из сети % (обновляем значения)
-                                if 'Доля оттока из сети от когорты' in category_summary.index:
-                                    for cohort in sorted_periods:
-                                        if cohort in category_summary.columns:
-                                            value = category_summary.loc['Доля оттока из сети от когорты', cohort]
-                                            if pd.notna(value):
-                                                summary_data['Отток из сети %'][cohort] = f"{value:.1f}%"
-                                            else:
-                                                summary_data['Отток из сети %'][cohort] = "0.0%"
-                                        else:
-                                            summary_data['Отток из сети %'][cohort] = "0.0%"
-                                else:
-                                    # Если нет строки "Доля оттока из сети от когорты", вычисляем процент вручную
-                                    for cohort in sorted_periods:
-                                        cohort_size = summary_data['Кол-во клиентов в когорте'].get(cohort, 0)
-                                        network_churn = summary_data['Отток из сети'].get(cohort, 0)
-                                        if cohort_size > 0:
-                                            percent = (network_churn / cohort_size) * 100
-                                            summary_data['Отток из сети %'][cohort] = f"{percent:.1f}%"
-                                        else:
-                                            summary_data['Отток из сети %'][cohort] = "0.0%"
-                        
-                        # Создаем DataFrame
-                        summary_df = pd.DataFrame(summary_data, index=sorted_periods).T
-                        
-                        # Отображаем таблицу
-                        st.dataframe(
-                            summary_df,
-                            use_container_width=True
-                        )
-                        
-                        # Добавляем стили для центрирования
-                        st.markdown("""
-                        <style>
-                        div[data-testid="stDataFrame"] table td {
-                            text-align: center !important;
-                        }
-                        div[data-testid="stDataFrame"] table th {
-                            text-align: center !important;
-                        }
-                        </style>
-                        """, unsafe_allow_html=True)
+                    render_summary_panel(view_product, window_bounds)
+                
+                # Диагностика: время и пиковая память этапов обработки текущего набора данных
+                stage_records = update_stage_records()
+                with st.expander("🩺 Диагностика: время этапов обработки и память", expanded=False):
+                    if stage_records:
+                        root_seconds = sum(record['seconds'] for record in stage_records if record['depth'] == 0)
+                        upload_stats = st.session_state.get('upload_stats')
+                        if upload_stats:
+                            st.caption(
+                                f"Строк в файле: {upload_stats['rows']:,} · уникальных строк продукт × период × клиент: "
+                                f"{upload_stats['compact_rows']:,} · память данных: {upload_stats['raw_mb']:.1f} МБ → "
+                                f"{upload_stats['compact_mb']:.1f} МБ".replace(',', ' ')
+                            )
+                        st.caption(f"Суммарное время этапов: {root_seconds:.2f} с")
+                        st.dataframe(summarize_records(stage_records), use_container_width=True, hide_index=True)
                     else:
-                        st.info("Загрузите данные для отображения сводной таблицы")
+                        st.info("Замеры этапов отключены (INSTRUMENTATION_ENABLED в config.py)")
+                    
+                    # Память: данные текущей сессии и общий бюджет сервера (MemoryGovernor)
+                    memory_stats = governor.stats()
+                    session_mb = get_artifact_store().nbytes / (1024 * 1024)
+                    st.caption(
+                        f"Память сессии: {session_mb:.1f} МБ · все сессии ({memory_stats['sessions']}): "
+                        f"{memory_stats['used_mb']:.1f} из {memory_stats['budget_mb']:.0f} МБ · "
+                        f"вытеснено: {memory_stats['evictions']} ({memory_stats['evicted_mb']:.1f} МБ)"
+                    )
+                    st.dataframe(get_artifact_store().usage_table(), use_container_width=True, hide_index=True)
+
+                    # Узлы графа данных: актуальность, количество расчётов и их время
+                    st.caption("Граф данных сессии: узел пересчитывается только при новой версии его входов")
+                    st.dataframe(graph.status_table(), use_container_width=True, hide_index=True)
                     
             except Exception as e:
                 st.error(f"❌ Ошибка при построении матрицы: {str(e)}")
@@ -2267,6 +1671,5 @@ if uploaded_file is not None:
             
     except Exception as e:
         st.error(f"❌ Ошибка при загрузке файла: {str(e)}")
-        st.session_state.uploaded_data = None
-        st.session_state.df = None
+        get_artifact_graph().set_source('dataset', None)
 
@@ -0,0 +1,216 @@
+"""
+Модуль графа данных сессии: узлы с объявленными входами, ключи версий по содержимому и ленивый расчёт
+"""
+import hashlib
+import time
+from collections.abc import Mapping
+
+import pandas as pd
+from instrumentation import stage_timer
+from memory_governor import estimate_size
+
+# Ключ версии незаданного источника
+_MISSING_KEY = '-'
+
+
+def content_key(value):
+    """Ключ версии небольшого значения (столбцы, флаги) — SHA-256 его repr."""
+    return hashlib.sha256(repr(value).encode('utf-8')).hexdigest()
+
+
+class LazyResults(Mapping):
+    """Словарь результатов, значение каждого ключа вычисляется при первом обращении к нему.
+
+    Args:
+        loaders: ключ -> функция без аргументов, возвращающая значение
+        memoize: сохранять вычисленные значения (False — их кэширует источник, например граф)
+        on_update: функция без аргументов, вызываемая после сохранения нового значения
+            (например, чтобы хранилище заново оценило размер)
+    """
+
+    def __init__(self, loaders, memoize=True, on_update=None):
+        self._loaders = dict(loaders)
+        self._memoize = memoize
+        self._on_update = on_update
+        self._values = {}
+
+    def __getitem__(self, key):
+        if key in self._values:
+            return self._values[key]
+        value = self._loaders[key]()
+        if self._memoize:
+            self._values[key] = value
+            if self._on_update is not None:
+                self._on_update()
+        return value
+
+    def __iter__(self):
+        return iter(self._loaders)
+
+    def __len__(self):
+        return len(self._loaders)
+
+    @property
+    def nbytes(self):
+        """Оценка памяти уже вычисленных значений (ArtifactStore учитывает её через estimate_size)."""
+        return sum(estimate_size(value) for value in self._values.values())
+
+
+class _Node:
+    """Узел графа: функция расчёта от значений входов и счётчики расчётов."""
+
+    __slots__ = ('name', 'compute', 'inputs', 'recomputable', 'computed', 'seconds', 'total_seconds')
+
+    def __init__(self, name, compute, inputs, recomputable):
+        self.name = name
+        self.compute = compute
+        self.inputs = tuple(inputs)
+        self.recomputable = recomputable
+        self.computed = 0
+        self.seconds = None
+        self.total_seconds = 0.0
+
+
+class ArtifactGraph:
+    """Граф зависимостей данных одной сессии поверх ArtifactStore.
+
+    Источник (set_source) — значение с ключом версии, например SHA-256 содержимого
+    загруженного файла. Узел (add_node) — функция от значений своих входов; ключ узла —
+    хеш имени и ключей входов, поэтому новая версия источника меняет ключи всех узлов,
+    которые от него зависят. Узел вычисляется только по запросу (get) и не чаще одного
+    раза на версию входов; значение хранится в ArtifactStore под именем узла, а
+    вытесненное при нехватке памяти пересчитывается при следующем запросе.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._nodes = {}
+        self._source_keys = {}
+        # Имя узла -> ключ версии, для которой сохранено значение
+        self._stored_keys = {}
+        # Узлы, значение текущей версии которых — None (в ArtifactStore не хранится)
+        self._empty = set()
+
+    def add_node(self, name, compute, inputs=(), recomputable=True):
+        """Объявляет узел.
+
+        Args:
+            name: имя узла (ключ в ArtifactStore)
+            compute: функция расчёта; получает значения входов в порядке inputs
+            inputs: имена узлов и источников, от которых зависит значение
+            recomputable: можно ли вытеснять значение при нехватке памяти
+        """
+        self._nodes[name] = _Node(name, compute, inputs, recomputable)
+
+    def set_source(self, name, value, key=None, recomputable=False):
+        """Задаёт значение источника (None — источник не задан).
+
+        При смене ключа значения всех зависящих узлов удаляются из хранилища сразу,
+        не дожидаясь их следующего запроса.
+
+        Args:
+            key: ключ версии значения (по умолчанию — content_key(value))
+        """
+        if value is None:
+            key = None
+        elif key is None:
+            key = content_key(value)
+        previous = self._source_keys.get(name)
+        if key == previous and (value is None or self.store.get(name) is not None):
+            return
+        if key != previous:
+            for dependent in self._dependents(name):
+                self._discard(dependent)
+        if key is None:
+            self._source_keys.pop(name, None)
+        else:
+            self._source_keys[name] = key
+        self.store.put(name, value, recomputable=recomputable)
+
+    def key(self, name):
+        """Ключ версии источника или узла (для незаданного источника — '-')."""
+        node = self._nodes.get(name)
+        if node is None:
+            return self._source_keys.get(name, _MISSING_KEY)
+        digest = hashlib.sha256(name.encode('utf-8'))
+        for input_name in node.inputs:
+            digest.update(b'\0' + self.key(input_name).encode('utf-8'))
+        return digest.hexdigest()
+
+    def is_current(self, name):
+        """Есть ли значение узла для текущей версии входов (без расчёта)."""
+        node = self._nodes.get(name)
+        if node is None:
+            return name in self._source_keys
+        if self._stored_keys.get(name) != self.key(name):
+            return False
+        return name in self._empty or self.store.get(name) is not None
+
+    def get(self, name):
+        """Значение источника или узла; узел (и его входы) вычисляется, если значения текущей версии нет."""
+        node = self._nodes.get(name)
+        if node is None:
+            return self.store.get(name)
+        key = self.key(name)
+        if self._stored_keys.get(name) == key:
+            if name in self._empty:
+                return None
+            value = self.store.get(name)
+            if value is not None:
+                return value
+        args = [self.get(input_name) for input_name in node.inputs]
+        with stage_timer(f'artifact.{name}'):
+            started = time.perf_counter()
+            value = node.compute(*args)
+            seconds = time.perf_counter() - started
+        node.computed += 1
+        node.seconds = seconds
+        node.total_seconds += seconds
+        self._stored_keys[name] = key
+        if value is None:
+            self._empty.add(name)
+        else:
+            self._empty.discard(name)
+        self.store.put(name, value, recomputable=node.recomputable)
+        return value
+
+    def update(self, name, value):
+        """Сохраняет изменённое значение текущей версии узла (например, дополненный словарь срезов)."""
+        node = self._nodes[name]
+        self._stored_keys[name] = self.key(name)
+        self._empty.discard(name)
+        self.store.put(name, value, recomputable=node.recomputable)
+
+    def status_table(self):
+        """Таблица узлов: входы, актуальность, количество расчётов и время."""
+        rows = [
+            {
+                'Узел': node.name,
+                'Входы': ', '.join(node.inputs),
+                'Актуален': self.is_current(node.name),
+                'Расчётов': node.computed,
+                'Последний расчёт, с': None if node.seconds is None else round(node.seconds, 4),
+                'Всего, с': round(node.total_seconds, 4),
+            }
+            for node in self._nodes.values()
+        ]
+        return pd.DataFrame(
+            rows, columns=['Узел', 'Входы', 'Актуален', 'Расчётов', 'Последний расчёт, с', 'Всего, с']
+        )
+
+    def _dependents(self, name):
+        """Все узлы, прямо или косвенно зависящие от name."""
+        found = set()
+        pending = [name]
+        while pending:
+            current = pending.pop()
+            for node in self._nodes.values():
+                if current in node.inputs and node.name not in found:
+                    found.add(node.name)
+                    pending.append(node.name)
+        return found
+
+    def _discard(self, name):
+        self._stored_keys.pop(name, None)
+        self._empty.discard(name)
+        self.store.put(name, None)
@@ -0,0 +1,3 @@
+"""
+Бенчмарки этапов когортного анализа на синтетических выгрузках Qlik
+"""
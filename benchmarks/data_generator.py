@@ -0,0 +1,162 @@
+"""
+Генератор синтетических выгрузок в формате Qlik для бенчмарков
+"""
+import numpy as np
+import pandas as pd
+
+# Названия месяцев в том виде, в каком их выгружает Qlik ('2025-март', '2024-янв')
+MONTH_NAMES = ['янв', 'фев', 'март', 'апр', 'май', 'июнь', 'июль', 'авг', 'сен', 'окт', 'ноя', 'дек']
+
+
+def make_periods(n_periods, period_type='month', start_year=2023):
+    """Возвращает список из n_periods подряд идущих периодов.
+
+    Args:
+        n_periods: количество периодов
+        period_type: 'month' — '2025-март', 'week' — '2025/01'
+        start_year: год первого периода
+
+    Returns:
+        list: периоды в хронологическом порядке
+    """
+    periods = []
+    if period_type == 'week':
+        for i in range(n_periods):
+            year, week = divmod(i, 52)
+            periods.append(f"{start_year + year}/{week + 1:02d}")
+    else:
+        for i in range(n_periods):
+            year, month = divmod(i, 12)
+            periods.append(f"{start_year + year}-{MONTH_NAMES[month]}")
+    return periods
+
+
+def _zipf_weights(n, exponent):
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+
+def generate_qlik_export(n_rows, n_periods=24, n_clients=None, period_type='month', n_products=1,
+                         zipf_exponent=1.1, float_codes=True, seed=0):
+    """Генерирует основную выгрузку: продукт, период, код клиента, сумма.
+
+    Активность клиентов распределена по Zipf: небольшая доля клиентов даёт
+    большую часть строк. Каждый клиент начинает покупать в случайном периоде
+    и дальше появляется только в периодах не раньше него.
+
+    Args:
+        n_rows: количество строк
+        n_periods: количество периодов
+        n_clients: количество клиентов (по умолчанию n_rows // 5)
+        period_type: 'month' или 'week'
+        n_products: количество значений в первом столбце (продукт/сегмент)
+        zipf_exponent: показатель распределения Zipf для активности клиентов
+        float_codes: коды клиентов как float (196107.0), как их часто отдаёт Excel
+        seed: зерно генератора случайных чисел
+
+    Returns:
+        pd.DataFrame: столбцы 'Продукт', 'Год-месяц' | 'Год-неделя', 'Код клиента', 'Сумма'
+    """
+    rng = np.random.default_rng(seed)
+    if n_clients is None:
+        n_clients = max(1, n_rows // 5)
+    periods = np.array(make_periods(n_periods, period_type), dtype=object)
+
+    client_ids = rng.choice(n_clients, size=n_rows, p=_zipf_weights(n_clients, zipf_exponent))
+    client_start = rng.integers(0, n_periods, size=n_clients)
+    start = client_start[client_ids]
+    period_idx = start + (rng.random(n_rows) * (n_periods - start)).astype(np.int64)
+
+    codes = 100000 + rng.permutation(n_clients * 3)[:n_clients]
+    client_codes = codes[client_ids].astype(float if float_codes else np.int64)
+    products = np.array([f"Продукт {i + 1}" for i in range(n_products)], dtype=object)
+
+    product_values = products[rng.integers(0, n_products, size=n_rows)]
+    amounts = np.round(rng.lognormal(mean=6.0, sigma=1.0, size=n_rows), 2)
+
+    period_col = 'Год-неделя' if period_type == 'week' else 'Год-месяц'
+    return pd.DataFrame({
+        'Продукт': product_values,
+        period_col: periods[period_idx],
+        'Код клиента': client_codes,
+        'Сумма': amounts,
+    })
+
+
+def write_qlik_csv(path, n_rows=None, target_bytes=None, n_periods=36, n_clients=2_000_000, period_type='month',
+                   n_products=1, zipf_exponent=1.1, chunk_rows=1_000_000, seed=0):
+    """Записывает основную выгрузку в .csv блоками, не держа её целиком в памяти.
+
+    Распределение строк то же, что у generate_qlik_export: клиенты, их первые периоды
+    и коды выбираются один раз, каждый блок — chunk_rows новых строк. Запись
+    останавливается после n_rows строк или когда размер файла достигает target_bytes.
+
+    Args:
+        path: путь к создаваемому .csv
+        n_rows: количество строк (None — до достижения target_bytes)
+        target_bytes: минимальный размер файла в байтах (None — ровно n_rows строк)
+        n_periods: количество периодов
+        n_clients: количество клиентов
+        period_type: 'month' или 'week'
+        n_products: количество значений в столбце продукта
+        zipf_exponent: показатель распределения Zipf для активности клиентов
+        chunk_rows: строк в одном записываемом блоке
+        seed: зерно генератора случайных чисел
+
+    Returns:
+        dict: {'rows': записано строк, 'bytes': размер файла}
+    """
+    if n_rows is None and target_bytes is None:
+        raise ValueError("нужно задать n_rows или target_bytes")
+    rng = np.random.default_rng(seed)
+    periods = np.array(make_periods(n_periods, period_type), dtype=object)
+    cumulative = np.cumsum(_zipf_weights(n_clients, zipf_exponent))
+    client_start = rng.integers(0, n_periods, size=n_clients)
+    codes = (100000 + rng.permutation(n_clients * 3)[:n_clients]).astype(float)
+    products = np.array([f"Продукт {i + 1}" for i in range(n_products)], dtype=object)
+    period_col = 'Год-неделя' if period_type == 'week' else 'Год-месяц'
+
+    written = 0
+    size = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        while (n_rows is None or written < n_rows) and (target_bytes is None or size < target_bytes):
+            rows = chunk_rows if n_rows is None else min(chunk_rows, n_rows - written)
+            client_ids = np.minimum(np.searchsorted(cumulative, rng.random(rows)), n_clients - 1)
+            start = client_start[client_ids]
+            period_idx = start + (rng.random(rows) * (n_periods - start)).astype(np.int64)
+            pd.DataFrame({
+                'Продукт': products[rng.integers(0, n_products, size=rows)],
+                period_col: periods[period_idx],
+                'Код клиента': codes[client_ids],
+                'Сумма': np.round(rng.lognormal(mean=6.0, sigma=1.0, size=rows), 2),
+            }).to_csv(f, header=written == 0, index=False)
+            written += rows
+            size = f.tell()
+    return {'rows': written, 'bytes': size}
+
+
+def generate_categories_export(df, n_categories=20, rows_per_client=3, client_share=0.5, seed=0):
+    """Генерирует выгрузку присутствия клиентов в других категориях (второй файл).
+
+    Args:
+        df: основная выгрузка (generate_qlik_export), из неё берутся клиенты и периоды
+        n_categories: количество категорий
+        rows_per_client: среднее количество строк на клиента
+        client_share: доля клиентов основной выгрузки, присутствующих в категориях
+        seed: зерно генератора случайных чисел
+
+    Returns:
+        pd.DataFrame: столбцы 'Группа2', период, 'Код клиента'
+    """
+    rng = np.random.default_rng(seed)
+    period_col = df.columns[1]
+    clients = df['Код клиента'].dropna().unique()
+    clients = clients[rng.random(len(clients)) < client_share]
+    periods = df[period_col].dropna().unique()
+    n_rows = max(1, len(clients) * rows_per_client)
+    categories = np.array([f"Категория {i + 1}" for i in range(n_categories)], dtype=object)
+    return pd.DataFrame({
+        'Группа2': categories[rng.choice(n_categories, size=n_rows, p=_zipf_weights(n_categories, 1.0))],
+        period_col: periods[rng.integers(0, len(periods), size=n_rows)],
+        'Код клиента': clients[rng.integers(0, len(clients), size=n_rows)] if len(clients) else np.nan,
+    })
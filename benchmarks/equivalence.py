@@ -0,0 +1,454 @@
+"""
+Проверка совпадения расчётов приложения с эталонными расчётами на множествах
+
+Эталон — benchmarks.reference: дословная копия исходных реализаций matrix_builder и
+data_processing на циклах и множествах, не зависящая от матрицы активности. С ним
+сравниваются production-функции (build_cohort_matrix, build_accumulation_matrix,
+build_churn_table, get_*_clients) и быстрый движок (ClientActivityMatrix и
+client_lists_export) — каждый на исходной и на компактной (ingestion.compact_upload)
+таблице, а также списки по одной ячейке (client_list_ids, панель «Коды клиентов»).
+Данные генерируются случайно: смешанные форматы периодов, пустые и невалидные значения,
+коды клиентов числами с плавающей точкой, целыми, строками или всеми тремя записями
+вперемешку в одной выгрузке (196107.0, 196107 и '196107' — один клиент). Списки клиентов
+сравниваются в том виде, в каком они выводятся.
+
+Эталон получает данные после prepare_reference_input — там же перечислены осознанные
+изменения поведения относительно исходных реализаций.
+
+Пример:
+    python -m benchmarks.equivalence --datasets 20 --rows 5000
+    python -m benchmarks.equivalence --datasets 3 --rows 200000 --timing
+"""
+import argparse
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from activity_matrix import build_activity_matrix
+from client_lists_export import (
+    VIEW_ACCUMULATION, VIEW_CHURN, VIEW_INFLOW, VIEW_RETENTION, client_list_ids, iter_client_lists
+)
+from data_processing import (
+    build_churn_table, create_period_clients_cache, get_accumulation_clients, get_churn_clients,
+    get_client_cohorts, get_cohort_clients, get_inflow_clients
+)
+from ingestion import compact_upload
+from matrix_builder import (
+    build_accumulation_matrix, build_accumulation_percent_matrix, build_cohort_matrix, build_inflow_matrix
+)
+from utils import format_client_code_for_copy, format_client_codes, get_sorted_periods
+
+from benchmarks import reference
+from benchmarks.data_generator import MONTH_NAMES
+
+YEAR_MONTH_COL = 'Год-месяц'
+CLIENT_COL = 'Код клиента'
+
+MATRIX_KEYS = ['cohort_matrix', 'accumulation_matrix', 'accumulation_percent_matrix', 'inflow_matrix']
+
+# Полные названия месяцев — второй вариант написания того же месяца
+_MONTH_FULL_NAMES = ['январь', 'февраль', 'март', 'апрель', 'май', 'июнь',
+                     'июль', 'август', 'сентябрь', 'октябрь', 'ноябрь', 'декабрь']
+
+# Значения, которые parse_period не распознаёт (уходят в конец sorted_periods)
+_INVALID_PERIODS = ['Итого', 'н/д', '2024-?']
+
+# Функции расчётов на множествах: production-версии и их исходные копии (benchmarks.reference)
+_PRODUCTION_FUNCTIONS = {
+    'build_cohort_matrix': build_cohort_matrix,
+    'build_accumulation_matrix': build_accumulation_matrix,
+    'build_accumulation_percent_matrix': build_accumulation_percent_matrix,
+    'build_inflow_matrix': build_inflow_matrix,
+    'create_period_clients_cache': create_period_clients_cache,
+    'get_client_cohorts': get_client_cohorts,
+    'get_cohort_clients': get_cohort_clients,
+    'get_accumulation_clients': get_accumulation_clients,
+    'get_inflow_clients': get_inflow_clients,
+    'get_churn_clients': get_churn_clients,
+    'build_churn_table': build_churn_table,
+}
+_REFERENCE_FUNCTIONS = {name: getattr(reference, name) for name in _PRODUCTION_FUNCTIONS}
+
+_DIGITS = re.compile(r'[+-]?\d+')
+
+
+def _period_labels(rng, n_periods, period_type):
+    """Подписи периодов по порядку; у каждого периода одна или две записи (разные форматы)."""
+    labels = []
+    for i in range(n_periods):
+        year = 2023 + i // (12 if period_type == 'month' else 52)
+        if period_type == 'month':
+            month = i % 12
+            variants = [f"{year}-{MONTH_NAMES[month]}", f"{year}-{_MONTH_FULL_NAMES[month]}"]
+        else:
+            week = i % 52 + 1
+            variants = [f"{year}/{week:02d}", f"{year}-W{week:02d}", f"{year}-нед{week}"]
+        n_variants = 2 if rng.random() < 0.3 else 1
+        labels.append([str(label) for label in rng.choice(variants, size=n_variants, replace=False)])
+    return labels
+
+
+def generate_random_export(rng, n_rows, n_periods=None, period_type=None, client_kind=None):
+    """Случайная выгрузка «Год-месяц» × «Код клиента» с неаккуратными значениями.
+
+    Args:
+        rng: np.random.Generator
+        n_rows: количество строк
+        n_periods: количество периодов (по умолчанию случайно от 1 до 15)
+        period_type: 'month' или 'week' (по умолчанию случайно)
+        client_kind: 'float' (196107.0), 'int', 'str' или 'mixed' — каждая запись одним из
+            трёх видов (по умолчанию случайно)
+
+    Returns:
+        tuple: (DataFrame, описание параметров набора)
+    """
+    n_periods = n_periods or int(rng.integers(1, 16))
+    period_type = period_type or str(rng.choice(['month', 'week']))
+    client_kind = client_kind or str(rng.choice(['float', 'int', 'str', 'mixed']))
+    n_clients = max(1, n_rows // int(rng.integers(2, 8)))
+
+    client_ids = rng.integers(0, n_clients, size=n_rows)
+    start = rng.integers(0, n_periods, size=n_clients)[client_ids]
+    period_idx = start + (rng.random(n_rows) * (n_periods - start)).astype(np.int64)
+
+    labels = _period_labels(rng, n_periods, period_type)
+    periods = np.array([labels[idx][rng.integers(len(labels[idx]))] for idx in period_idx], dtype=object)
+    invalid = rng.random(n_rows) < 0.01
+    periods[invalid] = [_INVALID_PERIODS[i] for i in rng.integers(len(_INVALID_PERIODS), size=int(invalid.sum()))]
+    periods[rng.random(n_rows) < 0.02] = None
+
+    codes = 100000 + rng.permutation(n_clients * 3)[:n_clients][client_ids]
+    if client_kind == 'float':
+        clients = codes.astype(float)
+        clients[rng.random(n_rows) < 0.02] = np.nan
+    elif client_kind == 'mixed':
+        encodings = (float, int, lambda code: f" {code}" if rng.random() < 0.1 else str(code))
+        clients = np.array([encodings[kind](code) for kind, code in zip(rng.integers(3, size=n_rows), codes.tolist())],
+                           dtype=object)
+        clients[rng.random(n_rows) < 0.02] = None
+    else:
+        clients = codes.astype(object) if client_kind == 'int' else np.array([str(c) for c in codes], dtype=object)
+        clients[rng.random(n_rows) < 0.02] = None
+
+    df = pd.DataFrame({YEAR_MONTH_COL: periods, CLIENT_COL: clients})
+    params = f"rows={n_rows} periods={n_periods} {period_type} codes={client_kind}"
+    return df, params
+
+
+def _reference_client_code(value):
+    """Ключ клиента для эталона: целое число для числовых кодов (без потери точности), иначе строка."""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return int(value) if float(value).is_integer() else str(value)
+    text = str(value).strip()
+    if not text:
+        return None
+    if _DIGITS.fullmatch(text):
+        return int(text)
+    try:
+        number = float(text)
+    except ValueError:
+        return text
+    return int(number) if number.is_integer() else text
+
+
+def prepare_reference_input(df, year_month_col=YEAR_MONTH_COL, client_col=CLIENT_COL):
+    """Входные данные эталона: исходная выгрузка с двумя осознанными изменениями поведения.
+
+    1. Коды клиентов приводятся к одному ключу на клиента (_reference_client_code):
+       приложение с компактной загрузки считает 196107.0, 196107 и '196107' одним
+       клиентом, исходные функции — разными.
+    2. Строки упорядочиваются по тексту периода (устойчивая сортировка). Исходная
+       сортировка ставит разные записи одного периода ('2023/02' и '2023-W02') в порядке
+       первого появления, приложение — по тексту (utils.sort_periods), чтобы порядок не
+       зависел от порядка строк и сжатия выгрузки. После сортировки строк порядок
+       первого появления совпадает с порядком по тексту; на остальные результаты порядок
+       строк не влияет.
+
+    Returns:
+        pd.DataFrame: столбцы year_month_col и client_col
+    """
+    prepared = pd.DataFrame({
+        year_month_col: df[year_month_col].to_numpy(dtype=object),
+        client_col: pd.Series([_reference_client_code(value) for value in df[client_col].tolist()], dtype=object),
+    })
+    labels = prepared[year_month_col].map(lambda period: '' if pd.isna(period) else str(period))
+    return prepared.loc[labels.sort_values(kind='stable').index].reset_index(drop=True)
+
+
+def _set_results(df, year_month_col, client_col, functions, format_code):
+    """Матрицы, таблица оттока и все списки клиентов функциями на множествах.
+
+    Args:
+        functions: словарь _PRODUCTION_FUNCTIONS или _REFERENCE_FUNCTIONS
+        format_code: вывод кода клиента в списке
+
+    Returns:
+        dict: sorted_periods, матрицы MATRIX_KEYS, churn_table и client_lists —
+            словарь (вид, когорта, период) -> список кодов для вывода (пустые списки не включаются)
+    """
+    cohort_matrix, sorted_periods = functions['build_cohort_matrix'](df, year_month_col, client_col)
+    accumulation_matrix = functions['build_accumulation_matrix'](df, year_month_col, client_col, sorted_periods)
+    accumulation_percent_matrix = functions['build_accumulation_percent_matrix'](accumulation_matrix, cohort_matrix)
+    period_clients_cache = functions['create_period_clients_cache'](df, year_month_col, client_col, sorted_periods)
+    client_cohorts_cache = functions['get_client_cohorts'](df, year_month_col, client_col, sorted_periods)
+    caches = dict(period_clients_cache=period_clients_cache, client_cohorts_cache=client_cohorts_cache)
+
+    client_lists = {}
+    for cohort_idx, cohort in enumerate(sorted_periods):
+        client_lists[(VIEW_CHURN, cohort, '')] = functions['get_churn_clients'](
+            df, year_month_col, client_col, sorted_periods, cohort, **caches
+        )
+        for target in sorted_periods[cohort_idx:]:
+            client_lists[(VIEW_RETENTION, cohort, target)] = functions['get_cohort_clients'](
+                df, year_month_col, client_col, cohort, target, **caches
+            )
+            client_lists[(VIEW_ACCUMULATION, cohort, target)] = functions['get_accumulation_clients'](
+                df, year_month_col, client_col, sorted_periods, cohort, target, **caches
+            )
+            client_lists[(VIEW_INFLOW, cohort, target)] = functions['get_inflow_clients'](
+                df, year_month_col, client_col, sorted_periods, cohort, target, **caches
+            )
+
+    return {
+        'sorted_periods': sorted_periods,
+        'cohort_matrix': cohort_matrix,
+        'accumulation_matrix': accumulation_matrix,
+        'accumulation_percent_matrix': accumulation_percent_matrix,
+        'inflow_matrix': functions['build_inflow_matrix'](accumulation_percent_matrix),
+        'churn_table': functions['build_churn_table'](
+            df, year_month_col, client_col, sorted_periods, cohort_matrix, accumulation_matrix,
+            accumulation_percent_matrix, client_cohorts_cache, period_clients_cache
+        ),
+        'client_lists': {key: [format_code(code) for code in codes] for key, codes in client_lists.items() if codes},
+    }
+
+
+def reference_results(df, year_month_col=YEAR_MONTH_COL, client_col=CLIENT_COL):
+    """Результаты эталона (benchmarks.reference) на prepare_reference_input(df).
+
+    Исходная таблица оттока выводит '-' для ненаблюдаемых значений последней когорты,
+    текущая — NA; для сравнения '-' заменяется на NA.
+    """
+    results = _set_results(
+        prepare_reference_input(df, year_month_col, client_col), year_month_col, client_col,
+        _REFERENCE_FUNCTIONS, str
+    )
+    churn_table = results['churn_table']
+    results['churn_table'] = churn_table.mask(churn_table.astype(object).eq('-'))
+    return results
+
+
+def production_results(df, year_month_col=YEAR_MONTH_COL, client_col=CLIENT_COL):
+    """То же, что reference_results, публичными функциями matrix_builder и data_processing."""
+    return _set_results(df, year_month_col, client_col, _PRODUCTION_FUNCTIONS, format_client_code_for_copy)
+
+
+def fast_results(df, year_month_col=YEAR_MONTH_COL, client_col=CLIENT_COL):
+    """То же, что reference_results, через матрицу активности и client_lists_export (как в приложении)."""
+    sorted_periods = get_sorted_periods(df, year_month_col)
+    activity_matrix = build_activity_matrix(df, year_month_col, client_col, sorted_periods)
+    cohort_matrix = activity_matrix.cohort_matrix()
+    accumulation_matrix = activity_matrix.accumulation_matrix()
+    accumulation_percent_matrix = build_accumulation_percent_matrix(accumulation_matrix, cohort_matrix)
+    codes = format_client_codes(activity_matrix.clients)
+    return {
+        'sorted_periods': sorted_periods,
+        'cohort_matrix': cohort_matrix,
+        'accumulation_matrix': accumulation_matrix,
+        'accumulation_percent_matrix': accumulation_percent_matrix,
+        'inflow_matrix': build_inflow_matrix(accumulation_percent_matrix),
+        'churn_table': build_churn_table(
+            df, year_month_col, client_col, sorted_periods, cohort_matrix, accumulation_matrix,
+            accumulation_percent_matrix, activity_matrix.client_cohorts(), activity_matrix.period_clients()
+        ),
+        'client_lists': {
+            (view, cohort, period): codes[ids].tolist()
+            for view, cohort, period, ids in iter_client_lists(activity_matrix)
+        },
+    }
+
+
+def panel_client_lists(df, year_month_col=YEAR_MONTH_COL, client_col=CLIENT_COL):
+    """Списки клиентов по одному через client_list_ids, как их показывает панель «Коды клиентов».
+
+    Returns:
+        dict: (вид, когорта, период) -> список кодов для вывода (пустые списки не включаются)
+    """
+    sorted_periods = get_sorted_periods(df, year_month_col)
+    activity_matrix = build_activity_matrix(df, year_month_col, client_col, sorted_periods)
+    codes = format_client_codes(activity_matrix.clients)
+    cells = [(VIEW_CHURN, cohort, '') for cohort in sorted_periods]
+    cells += [
+        (view, cohort, period)
+        for view in (VIEW_RETENTION, VIEW_ACCUMULATION, VIEW_INFLOW)
+        for cohort_idx, cohort in enumerate(sorted_periods)
+        for period in sorted_periods[cohort_idx:]
+    ]
+    lists = {cell: codes[client_list_ids(activity_matrix, *cell)].tolist() for cell in cells}
+    return {cell: cell_codes for cell, cell_codes in lists.items() if cell_codes}
+
+
+def _same_values(left, right):
+    """Поэлементное совпадение таблиц (NA совпадает с NA), включая индекс и столбцы."""
+    if list(left.index) != list(right.index) or list(left.columns) != list(right.columns):
+        return False
+    left_values = left.astype(object).where(left.notna(), None).to_numpy()
+    right_values = right.astype(object).where(right.notna(), None).to_numpy()
+    return bool((left_values == right_values).all())
+
+
+def diff_results(expected, actual, max_lists=5):
+    """Расхождения проверяемых результатов с эталоном.
+
+    Returns:
+        list: строки с описанием расхождений (пустой список — результаты совпадают)
+    """
+    if expected['sorted_periods'] != actual['sorted_periods']:
+        return [f"sorted_periods: {expected['sorted_periods']} != {actual['sorted_periods']}"]
+    problems = []
+    for key in MATRIX_KEYS:
+        ref_matrix = expected[key].astype(float)
+        fast_matrix = actual[key].astype(float)
+        if not _same_values(ref_matrix, fast_matrix):
+            mismatch = np.argwhere(ref_matrix.to_numpy() != fast_matrix.to_numpy())
+            cells = [(ref_matrix.index[r], ref_matrix.columns[c]) for r, c in mismatch[:3]]
+            problems.append(f"{key}: {len(mismatch)} ячеек не совпадает, например {cells}")
+    if not _same_values(expected['churn_table'], actual['churn_table']):
+        problems.append("churn_table: значения не совпадают")
+
+    ref_lists = expected['client_lists']
+    fast_lists = actual['client_lists']
+    list_problems = [
+        f"{key}: эталон {len(ref_lists.get(key, []))} кодов, проверяемый {len(fast_lists.get(key, []))}"
+        for key in sorted(set(ref_lists) | set(fast_lists), key=str)
+        if ref_lists.get(key) != fast_lists.get(key)
+    ]
+    problems.extend(list_problems[:max_lists])
+    if len(list_problems) > max_lists:
+        problems.append(f"... и ещё {len(list_problems) - max_lists} списков")
+    return problems
+
+
+def _timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def long_code_export():
+    """Набор с кодами от 2**53, различающимися только последней цифрой.
+
+    Через float такие коды совпадают ('12345678901234567890' и '12345678901234567891'
+    дают 12345678901234567168), поэтому набор проверяет, что каждый остаётся отдельным
+    клиентом и выводится без изменений.
+
+    Returns:
+        tuple: (DataFrame, ожидаемый список клиентов первой когорты в первом периоде)
+    """
+    rows = [
+        ('2024-01', '12345678901234567890'), ('2024-01', '12345678901234567891'),
+        ('2024-01', 9007199254740993), ('2024-01', 9007199254740992), ('2024-01', 101),
+        ('2024-02', ' 12345678901234567891'), ('2024-02', '9007199254740993'), ('2024-02', 101.0),
+        ('2024-03', 12345678901234567890), ('2024-03', np.int64(9007199254740992)),
+    ]
+    df = pd.DataFrame({YEAR_MONTH_COL: [period for period, _ in rows],
+                       CLIENT_COL: pd.Series([code for _, code in rows], dtype=object)})
+    expected = ['101', '9007199254740992', '9007199254740993', '12345678901234567890', '12345678901234567891']
+    return df, expected
+
+
+def _compare(df):
+    """Сравнивает production-функции и быстрый движок с эталоном на исходной и компактной таблице.
+
+    Returns:
+        tuple: (список (вид, результат), описания расхождений, время эталона, быстрого движка
+            и быстрого движка на компактной таблице)
+    """
+    reference_result, reference_seconds = _timed(reference_results, df)
+    fast, fast_seconds = _timed(fast_results, df)
+    compact = compact_upload(df, YEAR_MONTH_COL, CLIENT_COL)
+    fast_compact, compact_seconds = _timed(fast_results, compact)
+    checked = [
+        ('production, исходная', production_results(df)),
+        ('production, компактная', production_results(compact)),
+        ('быстрый, исходная', fast),
+        ('быстрый, компактная', fast_compact),
+        ('панель, компактная', dict(fast_compact, client_lists=panel_client_lists(compact))),
+    ]
+    problems = [
+        f"[{label}] {line}" for label, result in checked for line in diff_results(reference_result, result)
+    ]
+    return checked, problems, reference_seconds, fast_seconds, compact_seconds
+
+
+def check_long_codes():
+    """Проверка long_code_export: совпадение с эталоном и точные коды в выводе.
+
+    Returns:
+        list: описания расхождений (пустой — проверка пройдена)
+    """
+    df, expected = long_code_export()
+    checked, problems, *_ = _compare(df)
+    first = get_sorted_periods(df, YEAR_MONTH_COL)[0]
+    for label, result in checked:
+        codes = result['client_lists'].get((VIEW_RETENTION, first, first), [])
+        if codes != expected:
+            problems.append(f"[{label}] когорта {first}: {codes}, ожидалось {expected}")
+    return problems
+
+
+def run(n_datasets, n_rows, seed=0, timing=False, log=print):
+    """Сравнивает production-функции и быстрый движок с эталоном на наборе long_code_export
+    и n_datasets случайных наборах.
+
+    Returns:
+        int: количество наборов с расхождениями
+    """
+    problems = check_long_codes()
+    log(f"{'#0':<4} {'коды от 2**53':<45} {'OK' if not problems else 'РАСХОЖДЕНИЕ'}")
+    for problem in problems:
+        log(f"    {problem}")
+    failures = bool(problems)
+
+    rng = np.random.default_rng(seed)
+    for number in range(1, n_datasets + 1):
+        df, params = generate_random_export(rng, n_rows)
+        _, problems, reference_seconds, fast_seconds, compact_seconds = _compare(df)
+        status = 'OK' if not problems else 'РАСХОЖДЕНИЕ'
+        line = f"#{number:<3} {params:<45} {status}"
+        if timing:
+            speedup = reference_seconds / fast_seconds if fast_seconds else float('inf')
+            line += (f"  эталон {reference_seconds:.3f} s, быстрый {fast_seconds:.3f} s "
+                     f"(компактная {compact_seconds:.3f} s), x{speedup:.1f}")
+        log(line)
+        for problem in problems:
+            log(f"    {problem}")
+        failures += bool(problems)
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сравнение расчётов когортного анализа с эталонными на множествах")
+    parser.add_argument('--datasets', type=int, default=20, help="количество случайных наборов данных")
+    parser.add_argument('--rows', type=int, default=3000, help="количество строк в наборе")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timing', action='store_true', help="выводить время эталона и быстрого движка")
+    args = parser.parse_args(argv)
+
+    failures = run(args.datasets, args.rows, seed=args.seed, timing=args.timing,
+                   log=lambda line: print(line, file=sys.stderr))
+    if failures:
+        print(f"Наборов с расхождениями: {failures} из {args.datasets}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
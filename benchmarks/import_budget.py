@@ -0,0 +1,89 @@
+"""
+Проверка времени импорта расчётных модулей и отсутствия Streamlit/matplotlib среди их зависимостей
+
+Каждый модуль импортируется в отдельном чистом процессе интерпретатора.
+
+Пример:
+    python -m benchmarks.import_budget
+    python -m benchmarks.import_budget --budget-ms 800 --modules engine activity_matrix
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from engine import FORBIDDEN_MODULES
+
+# Модули ядра: всё, кроме app.py и ui_components.py
+ENGINE_MODULES = [
+    'engine', 'utils', 'ingestion', 'activity_matrix', 'matrix_builder', 'value_matrices', 'out_of_core',
+    'data_processing', 'category_index', 'category_analysis', 'excel_exporter', 'client_lists_export',
+]
+
+DEFAULT_BUDGET_MS = 1500
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - started
+forbidden = {forbidden!r}
+print(json.dumps({{
+    'seconds': seconds,
+    'forbidden': sorted(name for name in sys.modules if name.split('.')[0] in forbidden),
+}}))
+"""
+
+
+def measure_import(module, forbidden=FORBIDDEN_MODULES):
+    """Импортирует модуль в отдельном процессе.
+
+    Returns:
+        dict: {'module', 'seconds', 'forbidden': загруженные запрещённые модули}
+    """
+    output = subprocess.run(
+        [sys.executable, '-c', _PROBE.format(module=module, forbidden=tuple(forbidden))],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result['module'] = module
+    return result
+
+
+def check(modules, budget_ms):
+    """Замеряет импорт модулей и собирает нарушения бюджета.
+
+    Returns:
+        tuple: (список замеров, список строк с нарушениями)
+    """
+    results = []
+    violations = []
+    for module in modules:
+        result = measure_import(module)
+        results.append(result)
+        milliseconds = result['seconds'] * 1000
+        print(f"{module:<22} {milliseconds:8.1f} ms", file=sys.stderr)
+        if milliseconds > budget_ms:
+            violations.append(f"{module}: {milliseconds:.0f} ms > {budget_ms} ms")
+        if result['forbidden']:
+            violations.append(f"{module}: загружены {', '.join(sorted({n.split('.')[0] for n in result['forbidden']}))}")
+    return results, violations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бюджет времени импорта расчётных модулей когортного анализа")
+    parser.add_argument('--modules', nargs='+', default=ENGINE_MODULES, help="проверяемые модули")
+    parser.add_argument('--budget-ms', type=int, default=DEFAULT_BUDGET_MS, help="допустимое время импорта модуля, мс")
+    args = parser.parse_args(argv)
+
+    _, violations = check(args.modules, args.budget_ms)
+    for line in violations:
+        print(f"НАРУШЕНИЕ: {line}", file=sys.stderr)
+    return 1 if violations else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
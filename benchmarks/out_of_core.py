@@ -0,0 +1,174 @@
+"""
+Бенчмарк потокового расчёта (out_of_core.py) на .csv выгрузке больше оперативной памяти
+
+Размер файла по умолчанию — 5 × доступной памяти (MemAvailable); расчёт запускается
+в отдельном процессе, пиковая память — его максимальный RSS (Linux).
+
+Пример:
+    python -m benchmarks.out_of_core --path /data/export.csv
+    python -m benchmarks.out_of_core --rows 2000000 --verify
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from activity_matrix import build_activity_matrix
+from config import OUT_OF_CORE_CHUNK_ROWS
+from data_processing import build_churn_table
+from instrumentation import configure as configure_instrumentation
+from matrix_builder import build_accumulation_percent_matrix
+from out_of_core import build_out_of_core_cohorts
+
+from benchmarks.data_generator import write_qlik_csv
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PROBE = """
+import json, resource, time
+from instrumentation import configure
+configure(enabled=False)
+from out_of_core import build_out_of_core_cohorts
+started = time.perf_counter()
+result = build_out_of_core_cohorts({path!r}, chunk_rows={chunk_rows})
+print(json.dumps({{
+    'seconds': time.perf_counter() - started,
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'rows': result['rows'],
+    'clients': result['clients'],
+    'periods': len(result['sorted_periods']),
+    'state_mb': result['state_bytes'] / (1024 * 1024),
+}}))
+"""
+
+
+def available_memory_bytes():
+    """Доступная оперативная память (MemAvailable из /proc/meminfo; None, если не определить)."""
+    try:
+        with open('/proc/meminfo', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def measure(path, chunk_rows=OUT_OF_CORE_CHUNK_ROWS):
+    """Запускает build_out_of_core_cohorts в отдельном процессе.
+
+    Returns:
+        dict: время, пиковый RSS процесса (МБ), строки, клиенты, периоды, размер файла состояния (МБ)
+    """
+    output = subprocess.run(
+        [sys.executable, '-c', _PROBE.format(path=os.path.abspath(path), chunk_rows=chunk_rows)],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def verify(n_rows=200_000, n_periods=70, n_clients=100_000, seed=0):
+    """Сверяет потоковый расчёт с расчётом по матрице активности на небольшой выгрузке.
+
+    Маленькие блоки строк и клиентов, более 64 периодов и клиентов больше начальной
+    ёмкости хранилища проверяют чтение блоками и увеличение файла состояния.
+
+    Returns:
+        list: описания расхождений (пустой — результаты совпадают)
+    """
+    configure_instrumentation(enabled=False)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'export.csv')
+        write_qlik_csv(path, n_rows=n_rows, n_periods=n_periods, n_clients=n_clients, chunk_rows=50_000, seed=seed)
+        streamed = build_out_of_core_cohorts(path, chunk_rows=30_000, block_clients=10_000)
+        df = pd.read_csv(path)
+
+    year_month_col = df.columns[1]
+    matrix = build_activity_matrix(df, year_month_col, 'Код клиента')
+    cohort_matrix = matrix.cohort_matrix()
+    accumulation_matrix = matrix.accumulation_matrix()
+    churn_table = build_churn_table(
+        df, year_month_col, 'Код клиента', matrix.periods, cohort_matrix, accumulation_matrix,
+        build_accumulation_percent_matrix(accumulation_matrix, cohort_matrix)
+    )
+    mismatches = []
+    if streamed['sorted_periods'] != matrix.periods:
+        mismatches.append("порядок периодов")
+    if not np.array_equal(streamed['cohort_matrix'].to_numpy(), cohort_matrix.to_numpy()):
+        mismatches.append("когортная матрица")
+    if not np.array_equal(streamed['accumulation_matrix'].to_numpy(), accumulation_matrix.to_numpy()):
+        mismatches.append("матрица накопления")
+    if not streamed['churn_table'].equals(churn_table):
+        mismatches.append("таблица оттока")
+    if streamed['clients'] != matrix.n_clients:
+        mismatches.append(f"клиенты: {streamed['clients']} != {matrix.n_clients}")
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Потоковый когортный анализ выгрузки больше оперативной памяти")
+    parser.add_argument('--path', default=os.path.join(tempfile.gettempdir(), 'cohort_out_of_core.csv'),
+                        help="файл выгрузки .csv (создаётся, если его нет)")
+    parser.add_argument('--rows', type=int, help="строк в создаваемой выгрузке (по умолчанию — по --ram-factor)")
+    parser.add_argument('--ram-factor', type=float, default=5.0, help="размер создаваемой выгрузки в долях доступной памяти")
+    parser.add_argument('--periods', type=int, default=36, help="количество периодов")
+    parser.add_argument('--clients', type=int, default=2_000_000, help="количество клиентов")
+    parser.add_argument('--chunk-rows', type=int, default=OUT_OF_CORE_CHUNK_ROWS, help="строк в читаемом блоке")
+    parser.add_argument('--keep', action='store_true', help="не удалять созданную выгрузку")
+    parser.add_argument('--verify', action='store_true', help="сначала сверить результат с расчётом в памяти")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="файл для JSON результата (по умолчанию stdout)")
+    args = parser.parse_args(argv)
+
+    if args.verify:
+        mismatches = verify(seed=args.seed)
+        for line in mismatches:
+            print(f"РАСХОЖДЕНИЕ: {line}", file=sys.stderr)
+        if mismatches:
+            return 1
+        print("Сверка с расчётом в памяти: OK", file=sys.stderr)
+
+    memory = available_memory_bytes()
+    created = not os.path.exists(args.path)
+    if created:
+        target_bytes = None
+        if args.rows is None:
+            if memory is None:
+                print("Не удалось определить доступную память, задайте --rows", file=sys.stderr)
+                return 1
+            target_bytes = int(memory * args.ram_factor)
+        print(f"Создаём выгрузку {args.path} ...", file=sys.stderr)
+        write_qlik_csv(args.path, n_rows=args.rows, target_bytes=target_bytes, n_periods=args.periods,
+                       n_clients=args.clients, seed=args.seed)
+
+    try:
+        file_bytes = os.path.getsize(args.path)
+        result = measure(args.path, args.chunk_rows)
+    finally:
+        if created and not args.keep:
+            os.remove(args.path)
+
+    result['file_mb'] = file_bytes / (1024 * 1024)
+    result['available_memory_mb'] = None if memory is None else memory / (1024 * 1024)
+    result['file_to_memory'] = None if memory is None else file_bytes / memory
+    print(f"{result['rows']} строк, {result['file_mb']:.0f} МБ за {result['seconds']:.1f} s, "
+          f"пиковый RSS {result['peak_rss_mb']:.0f} МБ", file=sys.stderr)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,554 @@
+"""
+Эталонные расчёты когортного анализа на множествах — замороженная копия исходных реализаций
+
+Ниже без изменений скопированы исходные версии get_sorted_periods (utils), matrix_builder
+и data_processing (циклы по периодам и клиентам, пересечения множеств). Они не используют
+ни матрицу активности, ни канонизацию кодов приложения: production-функции и быстрый
+движок сравниваются с ними в benchmarks.equivalence. Код функций не меняется вместе с
+оптимизациями; подготовка входных данных и осознанные изменения поведения описаны в
+benchmarks.equivalence (prepare_reference_input).
+"""
+import pandas as pd
+# parse_period не менялся с исходной версии
+from utils import parse_period
+
+
+# Исходная версия utils.get_sorted_periods
+
+def get_sorted_periods(df, year_month_col):
+    """Возвращает список периодов в том же порядке, что и matrix_builder (для согласованной когорты).
+    
+    Args:
+        df: DataFrame с данными
+        year_month_col: название столбца с периодом
+        
+    Returns:
+        list: отсортированный список периодов
+    """
+    unique_periods = df[year_month_col].dropna().unique()
+    periods_with_sort = [(p, parse_period(str(p).strip())) for p in unique_periods]
+    valid_periods = [(p, parsed) for p, parsed in periods_with_sort if parsed != (0, 0, 0)]
+    invalid_periods = [p for p, parsed in periods_with_sort if parsed == (0, 0, 0)]
+    if valid_periods:
+        valid_periods.sort(key=lambda x: (x[1][0], x[1][2], x[1][1]))
+        sorted_periods = [p[0] for p in valid_periods]
+        if invalid_periods:
+            sorted_periods.extend(sorted(invalid_periods))
+    else:
+        sorted_periods = sorted([str(p) for p in unique_periods])
+    return sorted_periods
+
+
+# Исходная версия matrix_builder
+
+def _cohort_clients_by_first_period(df, year_month_col, client_col, sorted_periods):
+    """Строит словарь период -> множество клиентов, для которых этот период — первый по порядку.
+    
+    Когорта = период первой покупки клиента (по порядку sorted_periods).
+    """
+    period_indices = {period: idx for idx, period in enumerate(sorted_periods)}
+    df_filtered = df[[year_month_col, client_col]].dropna()
+    client_cohorts = {}
+    for client, group in df_filtered.groupby(client_col):
+        periods = group[year_month_col].dropna().unique()
+        valid = [p for p in periods if p in period_indices]
+        if valid:
+            first_period = min(valid, key=lambda p: period_indices[p])
+            client_cohorts[client] = first_period
+    cohort_clients = {period: set() for period in sorted_periods}
+    for client, first_period in client_cohorts.items():
+        cohort_clients[first_period].add(client)
+    return cohort_clients
+
+
+def build_cohort_matrix(df, year_month_col, client_col, value_type='clients'):
+    """Строит когортную матрицу по периоду "Год-месяц".
+    
+    Когорта периода = клиенты, у которых первая покупка пришлась на этот период
+    (клиент закреплён за одной когортой — по первой покупке).
+    
+    Args:
+        df: DataFrame с данными
+        year_month_col: название столбца с годом-месяцем
+        client_col: название столбца с кодом клиента
+        value_type: тип значений в матрице ('clients' - уникальные клиенты, 'count' - количество записей)
+        
+    Returns:
+        tuple: (matrix_intersection, sorted_periods) - матрица пересечений и отсортированный список периодов
+    """
+    unique_periods = df[year_month_col].dropna().unique()
+    periods_with_sort = [(period, parse_period(str(period).strip())) for period in unique_periods]
+    valid_periods = [(p, parsed) for p, parsed in periods_with_sort if parsed != (0, 0, 0)]
+    invalid_periods = [p for p, parsed in periods_with_sort if parsed == (0, 0, 0)]
+    
+    if valid_periods:
+        valid_periods.sort(key=lambda x: (x[1][0], x[1][2], x[1][1]))
+        sorted_periods = [period[0] for period in valid_periods]
+        if invalid_periods:
+            sorted_periods.extend(sorted(invalid_periods))
+    else:
+        sorted_periods = sorted([str(p) for p in unique_periods])
+    
+    # Период -> множество клиентов в этом периоде (для столбцов)
+    period_clients = {}
+    for period in sorted_periods:
+        period_data = df[df[year_month_col] == period]
+        if value_type == 'clients':
+            period_clients[period] = set(period_data[client_col].dropna().unique())
+        else:
+            period_clients[period] = len(period_data)
+    
+    if value_type == 'clients':
+        # Когорта = первая покупка: период -> множество клиентов с первой покупкой в этом периоде
+        cohort_clients = _cohort_clients_by_first_period(df, year_month_col, client_col, sorted_periods)
+    else:
+        cohort_clients = None
+    
+    matrix_intersection = pd.DataFrame(
+        index=sorted_periods,
+        columns=sorted_periods,
+        dtype=int
+    )
+    
+    for row_period in sorted_periods:
+        for col_period in sorted_periods:
+            if value_type == 'clients':
+                if row_period == col_period:
+                    matrix_intersection.loc[row_period, col_period] = len(cohort_clients[row_period])
+                else:
+                    intersection = len(cohort_clients[row_period] & period_clients[col_period])
+                    matrix_intersection.loc[row_period, col_period] = intersection
+            else:
+                if row_period == col_period:
+                    matrix_intersection.loc[row_period, col_period] = period_clients[row_period]
+                else:
+                    matrix_intersection.loc[row_period, col_period] = 0
+    
+    return matrix_intersection, sorted_periods
+
+
+def build_accumulation_matrix(df, year_month_col, client_col, sorted_periods):
+    """Строит матрицу накопления возврата клиентов.
+    
+    Когорта = период первой покупки. На диагонали — размер когорты.
+    В ячейках после диагонали — накопленное кол-во клиентов когорты, которые
+    вернулись хотя бы раз в периодах ПОСЛЕ когорты (без учёта самого периода когорты).
+    
+    Args:
+        df: DataFrame с данными
+        year_month_col: название столбца с годом-месяцем
+        client_col: название столбца с кодом клиента
+        sorted_periods: отсортированный список периодов
+        
+    Returns:
+        pd.DataFrame: матрица накопления уникальных клиентов
+    """
+    matrix_accumulation = pd.DataFrame(
+        index=sorted_periods,
+        columns=sorted_periods,
+        dtype=int
+    )
+    period_clients_dict = {}
+    for period in sorted_periods:
+        period_data = df[df[year_month_col] == period]
+        period_clients_dict[period] = set(period_data[client_col].dropna().unique())
+    
+    cohort_clients_by_period = _cohort_clients_by_first_period(df, year_month_col, client_col, sorted_periods)
+    period_indices = {period: idx for idx, period in enumerate(sorted_periods)}
+    
+    for row_period in sorted_periods:
+        row_idx = period_indices[row_period]
+        cohort_clients = cohort_clients_by_period[row_period]
+        # Возврат = только периоды после когорты; на диагонали — размер когорты
+        current_accumulated = set()
+        
+        for col_idx in range(row_idx, len(sorted_periods)):
+            col_period = sorted_periods[col_idx]
+            if col_idx == row_idx:
+                matrix_accumulation.loc[row_period, col_period] = len(cohort_clients)
+            else:
+                period_clients = period_clients_dict[col_period]
+                current_accumulated.update(cohort_clients & period_clients)
+                matrix_accumulation.loc[row_period, col_period] = len(current_accumulated)
+        
+        for col_idx in range(row_idx):
+            col_period = sorted_periods[col_idx]
+            matrix_accumulation.loc[row_period, col_period] = 0
+    
+    return matrix_accumulation
+
+
+def build_accumulation_percent_matrix(accumulation_matrix, cohort_matrix):
+    """Строит матрицу накопления возврата в процентах.
+    
+    Доля накопления количества клиентов от количества клиентов в когорте.
+    
+    Args:
+        accumulation_matrix: матрица накопления (абсолютные значения)
+        cohort_matrix: исходная когортная матрица (для получения количества клиентов в когорте)
+        
+    Returns:
+        pd.DataFrame: матрица в процентах
+    """
+    matrix_percent = pd.DataFrame(
+        index=accumulation_matrix.index,
+        columns=accumulation_matrix.columns,
+        dtype=float
+    )
+    
+    # Получаем индексы периодов для определения порядка
+    period_indices = {period: idx for idx, period in enumerate(accumulation_matrix.index)}
+    
+    for row_period in accumulation_matrix.index:
+        row_idx = period_indices.get(row_period, 0)
+        
+        # Количество клиентов в когорте (диагональ)
+        cohort_size = cohort_matrix.loc[row_period, row_period]
+        
+        for col_period in accumulation_matrix.columns:
+            col_idx = period_indices.get(col_period, 0)
+            
+            if col_idx < row_idx:
+                # До диагонали = 0
+                matrix_percent.loc[row_period, col_period] = 0.0
+            elif col_idx == row_idx:
+                # Диагональ = 100% (все клиенты когорты)
+                matrix_percent.loc[row_period, col_period] = 100.0
+            else:
+                # После диагонали = процент от размера когорты
+                if cohort_size > 0:
+                    accumulated = accumulation_matrix.loc[row_period, col_period]
+                    percent = (accumulated / cohort_size) * 100
+                    matrix_percent.loc[row_period, col_period] = percent
+                else:
+                    matrix_percent.loc[row_period, col_period] = 0.0
+    
+    return matrix_percent
+
+
+def build_inflow_matrix(accumulation_percent_matrix):
+    """Строит матрицу притока возврата в процентах.
+    
+    Показывает прирост уникальных клиентов когорты между периодами.
+    
+    Args:
+        accumulation_percent_matrix: матрица накопления в процентах
+        
+    Returns:
+        pd.DataFrame: матрица притока в процентах
+    """
+    inflow_matrix = pd.DataFrame(
+        index=accumulation_percent_matrix.index,
+        columns=accumulation_percent_matrix.columns,
+        dtype=float
+    )
+    
+    # Получаем индексы периодов для определения порядка
+    period_indices = {period: idx for idx, period in enumerate(accumulation_percent_matrix.index)}
+    
+    for row_period in accumulation_percent_matrix.index:
+        row_idx = period_indices.get(row_period, 0)
+        
+        for col_period in accumulation_percent_matrix.columns:
+            col_idx = period_indices.get(col_period, 0)
+            
+            # Диагональ = 0%
+            if row_idx == col_idx:
+                inflow_matrix.loc[row_period, col_period] = 0.0
+            elif col_idx < row_idx:
+                # До диагонали = 0
+                inflow_matrix.loc[row_period, col_period] = 0.0
+            else:
+                # Первый столбец после диагонали = значение из матрицы накопления
+                if col_idx == row_idx + 1:
+                    inflow_matrix.loc[row_period, col_period] = accumulation_percent_matrix.loc[row_period, col_period]
+                else:
+                    # Остальные столбцы = разница между текущим и предыдущим значением
+                    current_val = accumulation_percent_matrix.loc[row_period, col_period]
+                    # Находим предыдущий период
+                    prev_period = accumulation_percent_matrix.columns[col_idx - 1]
+                    prev_val = accumulation_percent_matrix.loc[row_period, prev_period]
+                    inflow_matrix.loc[row_period, col_period] = current_val - prev_val
+    
+    return inflow_matrix
+
+
+# Исходная версия data_processing
+
+def get_cohort_clients(df, year_month_col, client_col, cohort_period, target_period, period_clients_cache=None, client_cohorts_cache=None, sorted_periods=None):
+    """Получает коды клиентов из когорты (период первой покупки), которые были в целевом периоде.
+    
+    Args:
+        df: DataFrame с данными
+        year_month_col: название столбца с периодом
+        client_col: название столбца с кодом клиента
+        cohort_period: период когорты (первая покупка)
+        target_period: целевой период
+        period_clients_cache: кэш период -> множество клиентов
+        client_cohorts_cache: кэш клиент -> период когорты (первая покупка)
+        sorted_periods: отсортированный список периодов (нужен при client_cohorts_cache=None)
+        
+    Returns:
+        list: отсортированный список кодов клиентов
+    """
+    if client_cohorts_cache is None:
+        if sorted_periods is None:
+            sorted_periods = get_sorted_periods(df, year_month_col)
+        client_cohorts_cache = get_client_cohorts(df, year_month_col, client_col, sorted_periods)
+    clients_in_cohort = {c for c, first in client_cohorts_cache.items() if first == cohort_period}
+    if period_clients_cache:
+        clients_in_period = period_clients_cache.get(target_period, set())
+    else:
+        clients_in_period = set(df[df[year_month_col] == target_period][client_col].dropna().unique())
+    return sorted(list(clients_in_cohort & clients_in_period))
+
+
+def get_accumulation_clients(df, year_month_col, client_col, sorted_periods, cohort_period, target_period, period_clients_cache=None, client_cohorts_cache=None):
+    """Получает накопленные коды клиентов из когорты (период первой покупки) до целевого периода включительно.
+    
+    Args:
+        df: DataFrame с данными
+        year_month_col: название столбца с периодом
+        client_col: название столбца с кодом клиента
+        sorted_periods: отсортированный список периодов
+        cohort_period: период когорты (первая покупка)
+        target_period: целевой период
+        period_clients_cache: кэш период -> множество клиентов
+        client_cohorts_cache: кэш клиент -> период когорты (первая покупка)
+        
+    Returns:
+        list: отсортированный список кодов клиентов
+    """
+    period_indices = {period: idx for idx, period in enumerate(sorted_periods)}
+    cohort_idx = period_indices.get(cohort_period, -1)
+    target_idx = period_indices.get(target_period, -1)
+    
+    if cohort_idx < 0 or target_idx < 0 or target_idx <= cohort_idx:
+        return []
+    
+    if client_cohorts_cache is None:
+        client_cohorts_cache = get_client_cohorts(df, year_month_col, client_col, sorted_periods)
+    cohort_clients = {c for c, first in client_cohorts_cache.items() if first == cohort_period}
+    
+    returned_clients = set()
+    for period in sorted_periods[cohort_idx + 1:target_idx + 1]:
+        if period_clients_cache:
+            period_clients = period_clients_cache.get(period, set())
+        else:
+            period_clients = set(df[df[year_month_col] == period][client_col].dropna().unique())
+        returned_clients.update(cohort_clients & period_clients)
+    
+    return sorted(list(returned_clients))
+
+
+def get_client_cohorts(df, year_month_col, client_col, sorted_periods):
+    """Определяет когорту для каждого клиента (первый период появления по порядку sorted_periods).
+    
+    Args:
+        df: DataFrame с данными
+        year_month_col: название столбца с периодом
+        client_col: название столбца с кодом клиента
+        sorted_periods: отсортированный список периодов
+        
+    Returns:
+        dict: словарь {client: cohort_period}
+    """
+    period_indices = {period: idx for idx, period in enumerate(sorted_periods)}
+    df_filtered = df[[year_month_col, client_col]].dropna()
+    client_cohorts = {}
+    for client, group in df_filtered.groupby(client_col):
+        periods = group[year_month_col].dropna().unique()
+        valid = [p for p in periods if p in period_indices]
+        if valid:
+            first_period = min(valid, key=lambda p: period_indices[p])
+            client_cohorts[client] = first_period
+    return client_cohorts
+
+
+def get_churn_clients(df, year_month_col, client_col, sorted_periods, cohort_period, period_clients_cache=None, client_cohorts_cache=None):
+    """Получает коды клиентов оттока из когорты.
+    
+    Отток = клиенты когорты, которые не вернулись ни разу после периода когорты.
+    Когорта определяется как первый период появления клиента.
+    
+    Args:
+        df: DataFrame с данными
+        year_month_col: название столбца с периодом
+        client_col: название столбца с кодом клиента
+        sorted_periods: отсортированный список периодов
+        cohort_period: период когорты
+        period_clients_cache: кэш словарь период -> множество клиентов
+        client_cohorts_cache: кэш словарь клиент -> период когорты
+        
+    Returns:
+        list: отсортированный список кодов клиентов оттока
+    """
+    period_indices = {period: idx for idx, period in enumerate(sorted_periods)}
+    cohort_idx = period_indices.get(cohort_period, -1)
+    
+    if cohort_idx < 0:
+        return []
+    
+    # Получаем когорты клиентов (если кэш не передан, вычисляем)
+    if client_cohorts_cache is None:
+        client_cohorts_cache = get_client_cohorts(df, year_month_col, client_col, sorted_periods)
+    
+    # Получаем множество клиентов, для которых указанный период является их когортой (первым появлением)
+    cohort_clients = set()
+    for client, client_cohort in client_cohorts_cache.items():
+        if client_cohort == cohort_period:
+            cohort_clients.add(client)
+    
+    # Если когорта пустая, возвращаем пустой список
+    if not cohort_clients:
+        return []
+    
+    # Находим всех клиентов когорты, которые вернулись хотя бы раз в любом периоде после когорты
+    returned_clients = set()
+    for period in sorted_periods[cohort_idx + 1:]:
+        if period_clients_cache:
+            period_clients = period_clients_cache.get(period, set())
+        else:
+            period_clients = set(df[df[year_month_col] == period][client_col].dropna().unique())
+        returned_clients.update(cohort_clients & period_clients)
+    
+    # Отток = клиенты когорты - вернувшиеся клиенты
+    churn_clients = cohort_clients - returned_clients
+    return sorted(list(churn_clients))
+
+
+def get_inflow_clients(df, year_month_col, client_col, sorted_periods, cohort_period, target_period, period_clients_cache=None, client_cohorts_cache=None):
+    """Получает коды клиентов из когорты (период первой покупки), которые вернулись именно в целевом периоде (новый приток).
+    
+    Args:
+        df: DataFrame с данными
+        year_month_col: название столбца с периодом
+        client_col: название столбца с кодом клиента
+        sorted_periods: отсортированный список периодов
+        cohort_period: период когорты (первая покупка)
+        target_period: целевой период
+        period_clients_cache: кэш период -> множество клиентов
+        client_cohorts_cache: кэш клиент -> период когорты (первая покупка)
+        
+    Returns:
+        list: отсортированный список кодов клиентов
+    """
+    period_indices = {period: idx for idx, period in enumerate(sorted_periods)}
+    cohort_idx = period_indices.get(cohort_period, -1)
+    target_idx = period_indices.get(target_period, -1)
+    
+    if cohort_idx < 0 or target_idx < 0 or target_idx <= cohort_idx:
+        return []
+    
+    if client_cohorts_cache is None:
+        client_cohorts_cache = get_client_cohorts(df, year_month_col, client_col, sorted_periods)
+    cohort_clients = {c for c, first in client_cohorts_cache.items() if first == cohort_period}
+    
+    if period_clients_cache:
+        target_period_clients = period_clients_cache.get(target_period, set())
+    else:
+        target_period_clients = set(df[df[year_month_col] == target_period][client_col].dropna().unique())
+    returned_in_target = cohort_clients & target_period_clients
+    
+    if target_idx == cohort_idx + 1:
+        return sorted(list(returned_in_target))
+    
+    prev_periods_clients = set()
+    for period in sorted_periods[cohort_idx + 1:target_idx]:
+        if period_clients_cache:
+            period_clients = period_clients_cache.get(period, set())
+        else:
+            period_clients = set(df[df[year_month_col] == period][client_col].dropna().unique())
+        prev_periods_clients.update(cohort_clients & period_clients)
+    
+    new_returns = returned_in_target - prev_periods_clients
+    return sorted(list(new_returns))
+
+
+def create_period_clients_cache(df, year_month_col, client_col, sorted_periods):
+    """Создает кэш период -> множество клиентов для оптимизации.
+    
+    Args:
+        df: DataFrame с данными
+        year_month_col: название столбца с периодом
+        client_col: название столбца с кодом клиента
+        sorted_periods: отсортированный список периодов
+        
+    Returns:
+        dict: словарь период -> множество клиентов
+    """
+    period_clients_cache = {}
+    for period in sorted_periods:
+        period_data = df[df[year_month_col] == period]
+        period_clients_cache[period] = set(period_data[client_col].dropna().unique())
+    return period_clients_cache
+
+
+def build_churn_table(df, year_month_col, client_col, sorted_periods, cohort_matrix, 
+                       accumulation_matrix, accumulation_percent_matrix, 
+                       client_cohorts_cache=None, period_clients_cache=None):
+    """Строит таблицу оттока клиентов для всех когорт.
+    
+    Когорта = период первой покупки клиента. Размер когорты и отток считаются по этой логике.
+    
+    Args:
+        df: DataFrame с данными
+        year_month_col: название столбца с периодом
+        client_col: название столбца с кодом клиента
+        sorted_periods: отсортированный список периодов
+        cohort_matrix: матрица когорт
+        accumulation_matrix: матрица накопления
+        accumulation_percent_matrix: матрица накопления в процентах
+        client_cohorts_cache: кэш словарь клиент -> период когорты
+        period_clients_cache: кэш словарь период -> множество клиентов
+        
+    Returns:
+        pd.DataFrame: таблица оттока
+    """
+    churn_data = []
+    
+    # Оптимизация: создаём period_indices один раз вне цикла
+    period_indices = {period: idx for idx, period in enumerate(sorted_periods)}
+    last_period = sorted_periods[-1]
+    last_period_idx = period_indices[last_period]
+    
+    for cohort_period in sorted_periods:
+        cohort = cohort_period
+        cohort_size = cohort_matrix.loc[cohort_period, cohort_period]
+        cohort_idx = period_indices[cohort_period]
+        is_last_cohort = (cohort_idx == last_period_idx)
+        
+        if is_last_cohort:
+            # Для последней когорты нет периодов наблюдения после — не считаем возврат и отток
+            churn_data.append({
+                'Когорта': cohort,
+                'Кол-во клиентов когорты': int(cohort_size),
+                'Накопительное кол-во возврата': '-',
+                'Накопительный % возврата': '-',
+                'Отток кол-во': '-',
+                'Отток %': '-'
+            })
+            continue
+        
+        total_returned = accumulation_matrix.loc[cohort_period, last_period]
+        if cohort_size > 0:
+            total_returned_percent = (total_returned / cohort_size) * 100
+        else:
+            total_returned_percent = 0
+        churn_count = int(cohort_size - total_returned)
+        if cohort_size > 0:
+            churn_percent = (churn_count / cohort_size) * 100
+        else:
+            churn_percent = 0
+        
+        churn_data.append({
+            'Когорта': cohort,
+            'Кол-во клиентов когорты': int(cohort_size),
+            'Накопительное кол-во возврата': int(total_returned),
+            'Накопительный % возврата': total_returned_percent,
+            'Отток кол-во': churn_count,
+            'Отток %': churn_percent
+        })
+    
+    churn_df = pd.DataFrame(churn_data)
+    return churn_df
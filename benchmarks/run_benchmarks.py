@@ -0,0 +1,246 @@
+"""
+Запуск бенчмарков этапов когортного анализа (время и пиковая память), результат — JSON
+
+Пример:
+    python -m benchmarks.run_benchmarks --sizes 10000 100000 --output bench.json
+    python -m benchmarks.run_benchmarks --sizes 10000 --baseline bench.json
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from activity_matrix import build_activity_matrix
+from category_analysis import CategoryPresence, build_category_summary_table
+from category_index import category_index_from_frame
+from data_processing import build_churn_table, create_period_clients_cache, get_client_cohorts
+from excel_exporter import create_full_report_excel
+from ingestion import compact_upload, get_product_column, get_value_columns
+from instrumentation import configure as configure_instrumentation, memory_tracing
+from matrix_builder import (
+    build_accumulation_matrix, build_accumulation_percent_matrix, build_cohort_matrix, build_inflow_matrix
+)
+from utils import get_period_after_label
+from value_matrices import build_value_matrices
+
+from benchmarks.data_generator import generate_categories_export, generate_qlik_export
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+
+
+def _stage_compact_upload(ctx):
+    df = ctx['df']
+    product_col = get_product_column(df, ctx['year_month_col'], ctx['client_col'])
+    ctx['value_cols'] = get_value_columns(df, exclude=(product_col, ctx['year_month_col'], ctx['client_col']))
+    ctx['df_compact'] = compact_upload(df, ctx['year_month_col'], ctx['client_col'], product_col, ctx['value_cols'])
+
+
+def _stage_build_cohort_matrix(ctx):
+    ctx['cohort_matrix'], ctx['sorted_periods'] = build_cohort_matrix(ctx['df'], ctx['year_month_col'], ctx['client_col'])
+
+
+def _stage_build_accumulation_matrix(ctx):
+    ctx['accumulation_matrix'] = build_accumulation_matrix(ctx['df'], ctx['year_month_col'], ctx['client_col'], ctx['sorted_periods'])
+
+
+def _stage_build_activity_matrix(ctx):
+    # Как в приложении: матрица активности строится по компактной таблице
+    ctx['activity_matrix'] = build_activity_matrix(ctx['df_compact'], ctx['year_month_col'], ctx['client_col'], ctx['sorted_periods'])
+    ctx['activity_matrix'].cohort_matrix()
+    ctx['activity_matrix'].accumulation_matrix()
+
+
+def _stage_value_matrices(ctx):
+    ctx['value_matrices'] = [
+        (value_col, build_value_matrices(
+            ctx['df_compact'], ctx['year_month_col'], ctx['client_col'], value_col, ctx['activity_matrix']
+        ))
+        for value_col in ctx['value_cols']
+    ]
+
+
+def _stage_get_client_cohorts(ctx):
+    ctx['client_cohorts_cache'] = get_client_cohorts(ctx['df'], ctx['year_month_col'], ctx['client_col'], ctx['sorted_periods'])
+    ctx['period_clients_cache'] = create_period_clients_cache(ctx['df'], ctx['year_month_col'], ctx['client_col'], ctx['sorted_periods'])
+
+
+def _stage_build_churn_table(ctx):
+    ctx['accumulation_percent_matrix'] = build_accumulation_percent_matrix(ctx['accumulation_matrix'], ctx['cohort_matrix'])
+    ctx['inflow_matrix'] = build_inflow_matrix(ctx['accumulation_percent_matrix'])
+    ctx['churn_table'] = build_churn_table(
+        ctx['df'], ctx['year_month_col'], ctx['client_col'], ctx['sorted_periods'], ctx['cohort_matrix'],
+        ctx['accumulation_matrix'], ctx['accumulation_percent_matrix'],
+        ctx['client_cohorts_cache'], ctx['period_clients_cache']
+    )
+
+
+def _stage_category_presence(ctx):
+    category_index = category_index_from_frame(ctx['df_categories'])
+    presence = CategoryPresence(ctx['activity_matrix'], category_index)
+    ctx['category_summary_table'] = build_category_summary_table(
+        presence, ctx['churn_table'], get_period_after_label(ctx['sorted_periods'])
+    )
+    ctx['category_period_tables'] = presence.period_tables()
+
+
+def _stage_create_full_report_excel(ctx):
+    ctx['report_bytes'] = create_full_report_excel(
+        ctx['cohort_matrix'], ctx['accumulation_matrix'], ctx['accumulation_percent_matrix'], ctx['inflow_matrix'],
+        ctx['churn_table'], ctx['sorted_periods'], products_label='Продукт 1',
+        category_summary_table=ctx.get('category_summary_table'),
+        category_period_tables=ctx.get('category_period_tables'),
+        include_category_metrics=ctx.get('category_summary_table') is not None,
+        period_after_label=get_period_after_label(ctx['sorted_periods']),
+        value_matrices=ctx.get('value_matrices')
+    )
+
+
+# Этапы в порядке выполнения: каждый следующий использует результаты предыдущих
+STAGES = [
+    ('compact_upload', _stage_compact_upload),
+    ('build_cohort_matrix', _stage_build_cohort_matrix),
+    ('build_accumulation_matrix', _stage_build_accumulation_matrix),
+    ('build_activity_matrix', _stage_build_activity_matrix),
+    ('value_matrices', _stage_value_matrices),
+    ('get_client_cohorts', _stage_get_client_cohorts),
+    ('build_churn_table', _stage_build_churn_table),
+    ('category_presence', _stage_category_presence),
+    ('create_full_report_excel', _stage_create_full_report_excel),
+]
+
+
+def measure(func, ctx, repeat=1, trace_memory=True):
+    """Замеряет время (лучшее из repeat запусков) и пиковую память одного этапа.
+
+    Returns:
+        tuple: (seconds, peak_mb) — peak_mb равен None, если память не замерялась
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(ctx)
+        timings.append(time.perf_counter() - start)
+    peak_mb = None
+    if trace_memory:
+        with memory_tracing() as tracer:
+            func(ctx)
+            peak_mb = tracer.peak_mb() if tracer is not None else None
+    return min(timings), peak_mb
+
+
+def run(sizes, n_periods, period_type, clients_ratio, n_categories, stages=None, repeat=1, trace_memory=True, seed=0, log=None):
+    """Прогоняет выбранные этапы на синтетических данных каждого размера.
+
+    Returns:
+        list: записи результатов (словари) по каждому этапу и размеру
+    """
+    # Замеры этапов приложения отключаются: бенчмарк сам измеряет время и память
+    configure_instrumentation(enabled=False)
+    selected = [(name, func) for name, func in STAGES if stages is None or name in stages]
+    results = []
+    for n_rows in sizes:
+        df = generate_qlik_export(
+            n_rows, n_periods=n_periods, n_clients=max(1, int(n_rows * clients_ratio)),
+            period_type=period_type, seed=seed
+        )
+        ctx = {
+            'df': df,
+            'year_month_col': df.columns[1],
+            'client_col': 'Код клиента',
+            'df_categories': generate_categories_export(df, n_categories=n_categories, seed=seed),
+        }
+        # Этапы выполняются по порядку до последнего выбранного; невыбранные — без замера
+        last_selected = max(STAGES.index(stage) for stage in selected) if selected else -1
+        for name, func in STAGES[:last_selected + 1]:
+            if (name, func) not in selected:
+                func(ctx)
+                continue
+            seconds, peak_mb = measure(func, ctx, repeat=repeat, trace_memory=trace_memory)
+            record = {
+                'stage': name,
+                'rows': n_rows,
+                'periods': n_periods,
+                'period_type': period_type,
+                'clients': int(df['Код клиента'].nunique()),
+                'categories': n_categories,
+                'seconds': round(seconds, 6),
+                'peak_mb': None if peak_mb is None else round(peak_mb, 3),
+            }
+            results.append(record)
+            if log is not None:
+                log(f"{name:<28} rows={n_rows:<10} {seconds:10.3f} s  peak={record['peak_mb']} MB")
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Сравнивает время этапов с базовым прогоном.
+
+    Returns:
+        list: строки с описанием регрессий (этапы, ставшие медленнее в tolerance раз и более)
+    """
+    baseline_index = {(r['stage'], r['rows']): r for r in baseline.get('results', [])}
+    regressions = []
+    for record in results:
+        base = baseline_index.get((record['stage'], record['rows']))
+        if base is None or not base.get('seconds'):
+            continue
+        ratio = record['seconds'] / base['seconds']
+        if ratio >= tolerance:
+            regressions.append(f"{record['stage']} rows={record['rows']}: {base['seconds']:.3f} s -> {record['seconds']:.3f} s (x{ratio:.2f})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки когортного анализа на синтетических выгрузках Qlik")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="количество строк выгрузки")
+    parser.add_argument('--periods', type=int, default=24, help="количество периодов")
+    parser.add_argument('--period-type', choices=['month', 'week'], default='month')
+    parser.add_argument('--clients-ratio', type=float, default=0.2, help="доля уникальных клиентов от числа строк")
+    parser.add_argument('--categories', type=int, default=20, help="количество категорий во втором файле")
+    parser.add_argument('--stages', nargs='+', choices=[name for name, _ in STAGES], help="замеряемые этапы")
+    parser.add_argument('--repeat', type=int, default=1, help="количество повторов замера времени")
+    parser.add_argument('--no-memory', action='store_true', help="не замерять пиковую память (tracemalloc)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="файл для JSON результатов (по умолчанию stdout)")
+    parser.add_argument('--baseline', help="JSON предыдущего прогона для поиска регрессий")
+    parser.add_argument('--tolerance', type=float, default=1.25, help="допустимое замедление относительно baseline")
+    args = parser.parse_args(argv)
+
+    results = run(
+        args.sizes, args.periods, args.period_type, args.clients_ratio, args.categories,
+        stages=args.stages, repeat=args.repeat, trace_memory=not args.no_memory, seed=args.seed,
+        log=lambda line: print(line, file=sys.stderr)
+    )
+    payload = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+        },
+        'results': results,
+    }
+    text = json.dumps(payload, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"РЕГРЕССИЯ: {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,273 @@
+"""
+Модуль для анализа присутствия клиентов оттока в других категориях товаров
+"""
+import numpy as np
+import pandas as pd
+from instrumentation import timed_stage
+
+
+def detect_category_column_names(columns):
+    """Определяет столбцы файла категорий по названиям: группа, период и код клиента.
+
+    Args:
+        columns: названия столбцов второго файла (выгрузка Qlik по категориям)
+
+    Returns:
+        tuple: (group_col, year_month_col, client_code_col); не найденные столбцы — None
+    """
+    group_col = None
+    year_month_col = None
+    client_code_col = None
+    for col in columns:
+        col_lower = str(col).lower().strip()
+        if group_col is None and 'группа' in col_lower:
+            group_col = col
+        if year_month_col is None and 'год' in col_lower and ('месяц' in col_lower or 'неделя' in col_lower):
+            year_month_col = col
+        if client_code_col is None and 'код' in col_lower and 'клиент' in col_lower:
+            client_code_col = col
+    return group_col, year_month_col, client_code_col
+
+
+def detect_category_columns(df_categories):
+    """Определяет столбцы файла категорий: группа, период и код клиента.
+
+    Args:
+        df_categories: DataFrame второго файла (выгрузка Qlik по категориям)
+
+    Returns:
+        tuple: (group_col, year_month_col, client_code_col); не найденные столбцы — None
+    """
+    return detect_category_column_names(df_categories.columns)
+
+
+def get_categories(df_categories, group_col):
+    """Возвращает отсортированный список непустых категорий (как строки).
+
+    Args:
+        df_categories: DataFrame файла категорий
+        group_col: название столбца с категорией
+
+    Returns:
+        list: список категорий
+    """
+    categories = df_categories[group_col].dropna().unique()
+    return sorted([str(cat) for cat in categories if str(cat).strip() != ''])
+
+
+def _period_columns(category_index, periods_after_cohort):
+    """id периода индекса для каждого периода после когорты (-1 — периода нет в файле категорий).
+
+    Без столбца периода в файле категорий каждому периоду соответствуют все строки (id 0).
+    """
+    if not category_index.has_periods:
+        return np.zeros(len(periods_after_cohort), dtype=np.int64)
+    slots = [category_index.period_slot(period) for period in periods_after_cohort]
+    return np.array([-1 if slot is None else slot for slot in slots], dtype=np.int64)
+
+
+def _unique_counts(group_ids, client_ids, n_groups, n_clients):
+    """Количество уникальных клиентов в каждой группе."""
+    pairs = np.unique(group_ids.astype(np.int64) * n_clients + client_ids)
+    return np.bincount(pairs // n_clients, minlength=n_groups) if n_groups else np.zeros(0, dtype=np.int64)
+
+
+def _presence_table(category_index, periods, columns, category_ids, period_ids, client_ids):
+    """Таблица присутствия с итогами по отобранным строкам индекса категорий.
+
+    Args:
+        category_index: индекс файла категорий (CategoryIndex)
+        periods: периоды после когорты (столбцы таблицы)
+        columns: id периода индекса для каждого столбца (-1 — периода нет в файле категорий)
+        category_ids, period_ids, client_ids: строки индекса с клиентами оттока в этих периодах
+
+    Returns:
+        pd.DataFrame: таблица с итогами (строка «Итого клиентов», столбец «Итого»)
+    """
+    categories = category_index.categories
+    n_categories = len(categories)
+    n_slots = max(len(category_index.periods), 1)
+    n_clients = max(category_index.n_clients, 1)
+
+    # Тройки уникальны, поэтому клиенты ячейки считаются простым подсчётом строк
+    cell_counts = np.bincount(
+        category_ids.astype(np.int64) * n_slots + period_ids, minlength=n_categories * n_slots
+    ).reshape(n_categories, n_slots)
+    slot_totals = _unique_counts(period_ids, client_ids, n_slots, n_clients)
+    category_totals = _unique_counts(category_ids, client_ids, n_categories, n_clients)
+
+    values = np.zeros((n_categories + 1, len(periods) + 1), dtype=np.int64)
+    found = columns >= 0
+    values[1:, 1:][:, found] = cell_counts[:, columns[found]]
+    values[0, 1:][found] = slot_totals[columns[found]]
+    values[1:, 0] = category_totals
+    values[0, 0] = len(np.unique(client_ids))
+    return pd.DataFrame(values, index=['Итого клиентов'] + list(categories), columns=['Итого'] + list(periods))
+
+
+@timed_stage()
+def build_category_period_table(churn_clients_set, category_index, periods_after_cohort):
+    """Строит таблицу присутствия клиентов оттока когорты в категориях по периодам после когорты.
+
+    Строки — категории, столбцы — периоды; сверху строка «Итого клиентов», слева столбец «Итого»
+    (уникальные клиенты по периоду / категории), в пересечении — все уникальные клиенты.
+
+    Args:
+        churn_clients_set: множество канонических ключей клиентов оттока когорты
+        category_index: индекс файла категорий (CategoryIndex)
+        periods_after_cohort: периоды после когорты (из первого файла)
+
+    Returns:
+        pd.DataFrame: таблица с итогами
+    """
+    periods = list(periods_after_cohort)
+    n_slots = max(len(category_index.periods), 1)
+
+    # Строки индекса с клиентами оттока в периодах после когорты
+    columns = _period_columns(category_index, periods)
+    selected_slots = np.zeros(n_slots, dtype=bool)
+    selected_slots[columns[columns >= 0]] = True
+    rows = category_index.client_mask(churn_clients_set)[category_index.client_ids]
+    rows &= selected_slots[category_index.period_ids]
+    return _presence_table(
+        category_index, periods, columns,
+        category_index.category_ids[rows], category_index.period_ids[rows], category_index.client_ids[rows]
+    )
+
+
+class CategoryPresence:
+    """Присутствие клиентов оттока всех когорт в категориях в периодах после когорты.
+
+    Клиенты первого файла сопоставляются с клиентами индекса категорий один раз (по
+    каноническому ключу кода), признак оттока берётся из матрицы активности. Строки индекса
+    с клиентами оттока раскладываются по когортам, оставляются только периоды после
+    когорты, и таблица любой когорты считается подсчётом по её срезу — без построения
+    множеств клиентов по ячейкам.
+
+    Attributes:
+        category_index: индекс файла категорий (CategoryIndex)
+        periods: периоды первого файла (когорты) в порядке sorted_periods
+    """
+
+    def __init__(self, activity_matrix, category_index):
+        self.category_index = category_index
+        self.periods = list(activity_matrix.periods)
+        n_cohorts = max(len(self.periods), 1)
+
+        # Пары (клиент индекса категорий, когорта) для клиентов оттока: коды обоих файлов —
+        # канонические ключи, поэтому сопоставление — один get_indexer по массиву
+        churned = np.flatnonzero(activity_matrix.churned_mask())
+        index_clients = category_index.client_positions(activity_matrix.clients[churned]).astype(np.int64)
+        cohorts = activity_matrix.first_period_idx()[churned].astype(np.int64)
+        known = index_clients >= 0
+        pairs = np.unique(index_clients[known] * n_cohorts + cohorts[known])
+        pair_clients = pairs // n_cohorts
+        pair_cohorts = pairs % n_cohorts
+
+        # Строки индекса каждой пары (через сортировку строк по id клиента)
+        order = np.argsort(category_index.client_ids, kind='stable')
+        sorted_clients = category_index.client_ids[order]
+        starts = np.searchsorted(sorted_clients, pair_clients, side='left')
+        lengths = np.searchsorted(sorted_clients, pair_clients, side='right') - starts
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        rows = order[np.repeat(starts, lengths) + offsets]
+        row_cohorts = np.repeat(pair_cohorts, lengths)
+
+        # Только периоды после когорты: период индекса входит, если ему соответствует
+        # период первого файла позже когорты (без столбца периода — все строки)
+        self._columns = _period_columns(category_index, self.periods)
+        if category_index.has_periods:
+            last_position = np.full(max(len(category_index.periods), 1), -1, dtype=np.int64)
+            found = self._columns >= 0
+            np.maximum.at(last_position, self._columns[found], np.flatnonzero(found))
+            after = last_position[category_index.period_ids[rows]] > row_cohorts
+            rows = rows[after]
+            row_cohorts = row_cohorts[after]
+
+        cohort_order = np.argsort(row_cohorts, kind='stable')
+        rows = rows[cohort_order]
+        self._cohorts = row_cohorts[cohort_order]
+        self._category_ids = category_index.category_ids[rows]
+        self._period_ids = category_index.period_ids[rows]
+        self._client_ids = category_index.client_ids[rows]
+        self._bounds = np.searchsorted(self._cohorts, np.arange(len(self.periods) + 1))
+
+    @property
+    def nbytes(self):
+        return sum(arr.nbytes for arr in (
+            self._cohorts, self._category_ids, self._period_ids, self._client_ids, self._bounds, self._columns
+        ))
+
+    def _slice(self, cohort_period):
+        cohort_idx = self.periods.index(cohort_period)
+        return cohort_idx, slice(self._bounds[cohort_idx], self._bounds[cohort_idx + 1])
+
+    def present_counts(self):
+        """Количество клиентов оттока каждой когорты, присутствующих в категориях после когорты."""
+        n_clients = max(self.category_index.n_clients, 1)
+        return _unique_counts(self._cohorts, self._client_ids, len(self.periods), n_clients)
+
+    def present_clients(self, cohort_period):
+        """Канонические ключи клиентов оттока когорты, присутствующих в категориях после когорты."""
+        _, rows = self._slice(cohort_period)
+        return set(self.category_index.clients[np.unique(self._client_ids[rows])].tolist())
+
+    def period_table(self, cohort_period):
+        """Таблица присутствия когорты (как build_category_period_table для её клиентов оттока)."""
+        cohort_idx, rows = self._slice(cohort_period)
+        periods_after = self.periods[cohort_idx + 1:]
+        if not periods_after:
+            rows = slice(0, 0)
+        return _presence_table(
+            self.category_index, periods_after, self._columns[cohort_idx + 1:],
+            self._category_ids[rows], self._period_ids[rows], self._client_ids[rows]
+        )
+
+    @timed_stage('category_presence.period_tables')
+    def period_tables(self):
+        """Таблицы присутствия всех когорт, после которых есть периоды.
+
+        Returns:
+            list: [(когорта, таблица), ...]
+        """
+        return [(cohort, self.period_table(cohort)) for cohort in self.periods[:-1]]
+
+
+@timed_stage()
+def build_category_summary_table(presence, churn_table, period_after_label='месяца'):
+    """Строит сводку по присутствию клиентов оттока в других категориях для всех когорт.
+
+    Отток из сети = отток из категории − клиенты оттока, присутствующие в других категориях
+    после периода когорты.
+
+    Args:
+        presence: присутствие клиентов оттока в категориях (CategoryPresence)
+        churn_table: таблица оттока (build_churn_table)
+        period_after_label: 'месяца' или 'недели' для подписей метрик
+
+    Returns:
+        pd.DataFrame: таблица метрики × когорты
+    """
+    churn_by_cohort = churn_table.set_index('Когорта')
+    cohort_sizes = pd.to_numeric(churn_by_cohort['Кол-во клиентов когорты'], errors='coerce').fillna(0).astype(int)
+    churn_counts = pd.to_numeric(churn_by_cohort['Отток кол-во'], errors='coerce').fillna(0).astype(int)
+
+    total_present = {}
+    total_present_percent = {}
+    network_churn = {}
+    network_churn_percent = {}
+    for cohort_period, present_count in zip(presence.periods, presence.present_counts().tolist()):
+        cohort_size = int(cohort_sizes.get(cohort_period, 0))
+        churn_count = int(churn_counts.get(cohort_period, 0))
+        total_present[cohort_period] = present_count
+        total_present_percent[cohort_period] = (present_count / cohort_size * 100) if cohort_size > 0 else 0
+        network_churn[cohort_period] = max(0, churn_count - present_count)
+        network_churn_percent[cohort_period] = (network_churn[cohort_period] / cohort_size * 100) if cohort_size > 0 else 0
+
+    summary_table = pd.DataFrame({
+        'Отток из сети': network_churn,
+        'Доля оттока из сети от когорты': network_churn_percent,
+        f"Итого присутствуют в других категориях после {period_after_label} когорты": total_present,
+        f"Доля присутствуют в других категориях после {period_after_label} когорты": total_present_percent
+    }).T
+    return summary_table
@@ -0,0 +1,242 @@
+"""
+Модуль компактного индекса файла категорий: целочисленные (категория, период, клиент) и словари
+"""
+import numpy as np
+import pandas as pd
+from utils import canonical_client_keys, client_key_array, normalize_period_for_compare
+from category_analysis import detect_category_column_names
+from instrumentation import timed_stage
+
+# Количество строк файла, нормализуемых за один блок при потоковом чтении
+_CHUNK_ROWS = 65536
+
+
+def _category_label(val):
+    """Название категории как строка; пустые значения — ''."""
+    label = str(val)
+    return label if label.strip() != '' else ''
+
+
+class _Encoder:
+    """Сопоставляет нормализованным значениям столбца целочисленные id, общие для всех блоков.
+
+    normalize получает одно значение, а при vectorized=True — массив уникальных значений
+    блока (например, utils.canonical_client_keys).
+    """
+
+    def __init__(self, normalize, vectorized=False):
+        self.normalize = normalize
+        self.vectorized = vectorized
+        self.ids = {}
+        self.values = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def encode(self, raw_values):
+        """id для каждого значения блока (-1 — пустое значение); нормализуется только уникальное."""
+        codes, uniques = pd.factorize(pd.Series(raw_values, dtype=object))
+        mapping = np.empty(len(uniques) + 1, dtype=np.int64)
+        normalized = self.normalize(uniques) if self.vectorized else map(self.normalize, uniques)
+        for pos, value in enumerate(normalized):
+            if value == '':
+                mapping[pos] = -1
+                continue
+            value_id = self.ids.get(value)
+            if value_id is None:
+                value_id = len(self.values)
+                self.ids[value] = value_id
+                self.values.append(value)
+            mapping[pos] = value_id
+        mapping[-1] = -1
+        return mapping[codes]
+
+
+class CategoryIndex:
+    """Уникальные тройки (категория, период, клиент) файла категорий в виде массивов id.
+
+    Категории хранятся как строки в порядке get_categories, периоды — в виде
+    normalize_period_for_compare, клиенты — канонические ключи utils.canonical_client_keys
+    (те же, что в компактной таблице первого файла). Строки с
+    пустой категорией, кодом клиента или периодом (если столбец периода есть)
+    не учитываются. Если столбца периода нет, period_ids равны 0, а periods пуст.
+
+    Attributes:
+        group_col, year_month_col, client_code_col: названия столбцов файла (не найденные — None)
+        categories: отсортированный список категорий (id категории = позиция)
+        periods: нормализованные периоды (id периода = позиция)
+        clients: массив канонических ключей клиентов, int64 или dtype=object (id клиента = позиция)
+        category_ids, period_ids, client_ids: массивы id уникальных троек
+    """
+
+    def __init__(self, group_col, year_month_col, client_code_col, categories, periods, clients,
+                 category_ids, period_ids, client_ids):
+        self.group_col = group_col
+        self.year_month_col = year_month_col
+        self.client_code_col = client_code_col
+        self.categories = list(categories)
+        self.periods = list(periods)
+        self.clients = clients
+        self.category_ids = category_ids
+        self.period_ids = period_ids
+        self.client_ids = client_ids
+        self._period_lookup = {period: idx for idx, period in enumerate(self.periods)}
+        self._client_index = None
+
+    @property
+    def has_periods(self):
+        return self.year_month_col is not None
+
+    @property
+    def n_clients(self):
+        return len(self.clients)
+
+    def __len__(self):
+        return len(self.client_ids)
+
+    @property
+    def nbytes(self):
+        """Приблизительный объём памяти индекса в байтах (без учёта строк в clients)."""
+        return self.clients.nbytes + self.category_ids.nbytes + self.period_ids.nbytes + self.client_ids.nbytes
+
+    def client_positions(self, codes):
+        """id клиента индекса для каждого канонического ключа (-1 — клиента нет в файле категорий)."""
+        if self._client_index is None:
+            self._client_index = pd.Index(self.clients)
+        return self._client_index.get_indexer(codes)
+
+    def client_mask(self, codes):
+        """Булев признак клиентов индекса (по id), входящих в множество канонических ключей."""
+        mask = np.zeros(self.n_clients, dtype=bool)
+        positions = self.client_positions(list(codes))
+        mask[positions[positions >= 0]] = True
+        return mask
+
+    def period_slot(self, period):
+        """id периода в индексе по периоду первого файла (None, если в файле категорий его нет)."""
+        return self._period_lookup.get(normalize_period_for_compare(period))
+
+
+def _iter_xlsx_rows(source):
+    """Строки первого листа .xlsx в режиме только чтения (без загрузки всего листа в память)."""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _iter_column_chunks(uploaded_file):
+    """Заголовок и блоки строк файла категорий.
+
+    .xlsx читается потоково через openpyxl, .xls — через pandas (xlrd); в обоих случаях
+    в блоки попадают только нужные столбцы (группа, период, код клиента).
+
+    Yields:
+        сначала tuple (group_col, year_month_col, client_code_col), затем блоки —
+        списки столбцов [значения группы, значения периода или None, значения кода]
+    """
+    uploaded_file.seek(0)
+    if not uploaded_file.name.endswith('.xlsx'):
+        header = pd.read_excel(uploaded_file, engine='xlrd', nrows=0).columns
+        columns = detect_category_column_names(header)
+        yield columns
+        used = [col for col in columns if col is not None]
+        if columns[0] is None or columns[2] is None:
+            return
+        uploaded_file.seek(0)
+        data = pd.read_excel(uploaded_file, engine='xlrd', usecols=used)
+        yield [data[col].tolist() if col is not None else None for col in columns]
+        return
+
+    rows = _iter_xlsx_rows(uploaded_file)
+    header = next(rows, None) or ()
+    names = [value if value is not None else f"Unnamed: {pos}" for pos, value in enumerate(header)]
+    columns = detect_category_column_names(names)
+    yield columns
+    if columns[0] is None or columns[2] is None:
+        rows.close()
+        return
+    positions = [names.index(col) if col is not None else None for col in columns]
+    chunk = [[], [], []]
+    for row in rows:
+        for values, pos in zip(chunk, positions):
+            if pos is not None:
+                values.append(row[pos] if pos < len(row) else None)
+        if len(chunk[0]) >= _CHUNK_ROWS:
+            yield [values if pos is not None else None for values, pos in zip(chunk, positions)]
+            chunk = [[], [], []]
+    if chunk[0]:
+        yield [values if pos is not None else None for values, pos in zip(chunk, positions)]
+
+
+def _index_from_chunks(columns, chunks):
+    """Строит CategoryIndex из названий столбцов и блоков их значений (см. _iter_column_chunks)."""
+    group_col, year_month_col, client_code_col = columns
+    category_encoder = _Encoder(_category_label)
+    period_encoder = _Encoder(normalize_period_for_compare)
+    client_encoder = _Encoder(canonical_client_keys, vectorized=True)
+    parts = []
+    for group_values, period_values, client_values in chunks:
+        category_ids = category_encoder.encode(group_values)
+        client_ids = client_encoder.encode(client_values)
+        if period_values is not None:
+            period_ids = period_encoder.encode(period_values)
+        else:
+            period_ids = np.zeros(len(client_ids), dtype=np.int64)
+        valid = (category_ids >= 0) & (client_ids >= 0) & (period_ids >= 0)
+        parts.append((category_ids[valid], period_ids[valid], client_ids[valid]))
+
+    categories = category_encoder.values
+    periods = period_encoder.values
+    clients = client_key_array(client_encoder.values)
+    if not parts:
+        empty = np.zeros(0, dtype=np.int32)
+        return CategoryIndex(group_col, year_month_col, client_code_col, [], [], clients, empty, empty, empty)
+
+    category_ids, period_ids, client_ids = (np.concatenate(arrays) for arrays in zip(*parts))
+    # Категории — в отсортированном порядке (как get_categories)
+    category_order = np.argsort(np.asarray(categories, dtype=object), kind='stable')
+    category_rank = np.empty(len(categories), dtype=np.int64)
+    category_rank[category_order] = np.arange(len(categories))
+    category_ids = category_rank[category_ids]
+    categories = [categories[idx] for idx in category_order]
+
+    # Уникальные тройки (категория, период, клиент)
+    n_periods = max(len(periods), 1)
+    n_clients = max(len(clients), 1)
+    keys = np.unique((category_ids * n_periods + period_ids) * n_clients + client_ids)
+    return CategoryIndex(
+        group_col, year_month_col, client_code_col, categories, periods, clients,
+        (keys // (n_periods * n_clients)).astype(np.int32),
+        (keys // n_clients % n_periods).astype(np.int32),
+        (keys % n_clients).astype(np.int32),
+    )
+
+
+@timed_stage()
+def build_category_index(uploaded_file):
+    """Читает файл категорий и строит CategoryIndex.
+
+    Нормализация категорий, периодов и кодов клиентов выполняется один раз на каждое
+    уникальное значение, в памяти остаются только массивы id уникальных троек.
+
+    Args:
+        uploaded_file: файл категорий из st.file_uploader (.xlsx или .xls)
+
+    Returns:
+        CategoryIndex: индекс; если не найден столбец группы или кода клиента, индекс пуст
+    """
+    chunks = _iter_column_chunks(uploaded_file)
+    return _index_from_chunks(next(chunks), chunks)
+
+
+def category_index_from_frame(df_categories):
+    """Строит CategoryIndex из уже загруженного DataFrame файла категорий (например, в бенчмарках)."""
+    columns = detect_category_column_names(df_categories.columns)
+    if columns[0] is None or columns[2] is None:
+        return _index_from_chunks(columns, iter(()))
+    chunk = [df_categories[col].tolist() if col is not None else None for col in columns]
+    return _index_from_chunks(columns, iter([chunk]))
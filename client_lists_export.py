@@ -0,0 +1,182 @@
+"""
+Модуль выгрузки всех списков кодов клиентов (вид, когорта, период, код) одним файлом
+"""
+import csv
+import glob
+import gzip
+import os
+import tempfile
+import time
+
+import numpy as np
+from config import CLIENT_LISTS_EXPORT_MAX_AGE_HOURS, CLIENT_LISTS_EXPORT_PREFIX
+from instrumentation import timed_stage
+from utils import format_client_codes
+
+# Виды списков — те же, что в блоке «Коды клиентов»
+VIEW_RETENTION = 'Динамика уникальных клиентов'
+VIEW_ACCUMULATION = 'Динамика накопления возврата'
+VIEW_INFLOW = 'Приток возврата'
+VIEW_CHURN = 'Отток клиентов из категории'
+
+EXPORT_COLUMNS = ['Вид', 'Когорта', 'Период', 'Код клиента']
+
+
+def _grouped(keys, client_ids, rank):
+    """Разбивает клиентов на группы по ключу; внутри группы клиенты упорядочены по коду.
+
+    Yields:
+        tuple: (key, массив id клиентов группы)
+    """
+    if len(keys) == 0:
+        return
+    order = np.lexsort((rank[client_ids], keys))
+    keys_sorted = keys[order]
+    clients_sorted = client_ids[order]
+    bounds = np.flatnonzero(np.diff(keys_sorted)) + 1
+    starts = np.concatenate(([0], bounds))
+    ends = np.concatenate((bounds, [len(keys_sorted)]))
+    for start, end in zip(starts, ends):
+        yield keys_sorted[start], clients_sorted[start:end]
+
+
+def iter_client_lists(activity_matrix):
+    """Генератор всех списков клиентов по матрице активности, блоками по (вид, когорта, период).
+
+    Совпадает с get_cohort_clients / get_accumulation_clients / get_inflow_clients /
+    get_churn_clients: клиенты когорты в периоде, накопленный возврат до периода
+    включительно, первый возврат в периоде и отток (период — пустой). Списки не
+    накапливаются в памяти — каждый блок отдаётся сразу после расчёта.
+
+    Yields:
+        tuple: (вид, когорта, период или '', массив id клиентов)
+    """
+    periods = activity_matrix.periods
+    n_periods = activity_matrix.n_periods
+    if activity_matrix.n_clients == 0:
+        return
+    rank = activity_matrix.client_sort_rank()
+    client_ids = np.arange(activity_matrix.n_clients)
+    first_idx = activity_matrix.first_period_idx().astype(np.int64)
+    first_return = activity_matrix.first_return_idx()
+    returned = ~activity_matrix.churned_mask()
+
+    # Клиенты когорты, активные в периоде, — все ненулевые элементы матрицы
+    entry_clients = activity_matrix._row_ids()
+    entry_keys = first_idx[entry_clients] * n_periods + activity_matrix.indices
+    for key, ids in _grouped(entry_keys, entry_clients, rank):
+        yield VIEW_RETENTION, periods[key // n_periods], periods[key % n_periods], ids
+
+    # Накопительный возврат: клиент входит во все периоды с первого возврата до последнего
+    for cohort_idx, ids in _grouped(first_idx[returned], client_ids[returned], rank):
+        cohort_first_return = first_return[ids]
+        for target_idx in range(int(cohort_first_return.min()), n_periods):
+            yield VIEW_ACCUMULATION, periods[cohort_idx], periods[target_idx], ids[cohort_first_return <= target_idx]
+
+    # Приток: первый возврат именно в периоде
+    inflow_keys = first_idx[returned] * n_periods + first_return[returned]
+    for key, ids in _grouped(inflow_keys, client_ids[returned], rank):
+        yield VIEW_INFLOW, periods[key // n_periods], periods[key % n_periods], ids
+
+    # Отток: клиенты когорты без возвратов
+    for cohort_idx, ids in _grouped(first_idx[~returned], client_ids[~returned], rank):
+        yield VIEW_CHURN, periods[cohort_idx], '', ids
+
+
+def client_list_ids(activity_matrix, view, cohort, period=''):
+    """id клиентов одного списка (вид, когорта, период) — тот же блок, что даёт iter_client_lists.
+
+    Считается только выбранный список (для панели «Коды клиентов»), без словарей
+    множеств клиентов по периодам; клиенты упорядочены по коду.
+
+    Args:
+        activity_matrix: матрица активности (ClientActivityMatrix)
+        view: вид списка (VIEW_RETENTION, VIEW_ACCUMULATION, VIEW_INFLOW или VIEW_CHURN)
+        cohort: период когорты
+        period: период списка (для VIEW_CHURN не используется)
+
+    Returns:
+        np.ndarray: id клиентов (пустой, если когорты или периода нет в матрице)
+    """
+    cohort_idx, period_idx = activity_matrix.period_ids(np.array([cohort, period], dtype=object)).tolist()
+    if cohort_idx < 0 or (view != VIEW_CHURN and period_idx < 0):
+        return np.zeros(0, dtype=np.int64)
+    if view == VIEW_RETENTION:
+        col_indptr, col_clients = activity_matrix.to_csc()
+        ids = col_clients[col_indptr[period_idx]:col_indptr[period_idx + 1]]
+        ids = ids[activity_matrix.first_period_idx()[ids] == cohort_idx]
+    else:
+        ids = np.flatnonzero(activity_matrix.first_period_idx() == cohort_idx)
+        first_return = activity_matrix.first_return_idx()[ids]
+        if view == VIEW_ACCUMULATION:
+            ids = ids[(first_return >= 0) & (first_return <= period_idx)]
+        elif view == VIEW_INFLOW:
+            ids = ids[first_return == period_idx]
+        else:
+            ids = ids[first_return < 0]
+    return ids[np.argsort(activity_matrix.client_sort_rank()[ids], kind='stable')]
+
+
+@timed_stage()
+def write_client_lists_csv(activity_matrix, path=None):
+    """Записывает все списки клиентов в сжатый CSV (gzip, разделитель ';', UTF-8 с BOM).
+
+    Строки пишутся потоково по мере генерации блоков, в памяти хранятся только
+    форматированные коды клиентов (по одному на клиента).
+
+    Args:
+        activity_matrix: матрица активности (ClientActivityMatrix)
+        path: путь файла; если None, создаётся временный файл с префиксом
+            CLIENT_LISTS_EXPORT_PREFIX (удаляется remove_export_file)
+
+    Returns:
+        tuple: (путь к файлу, количество строк без заголовка)
+    """
+    if path is None:
+        with tempfile.NamedTemporaryFile(prefix=CLIENT_LISTS_EXPORT_PREFIX, suffix='.csv.gz', delete=False) as tmp:
+            path = tmp.name
+    codes = format_client_codes(activity_matrix.clients)
+    n_rows = 0
+    try:
+        with gzip.open(path, 'wt', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f, delimiter=';')
+            writer.writerow(EXPORT_COLUMNS)
+            for view, cohort, period, ids in iter_client_lists(activity_matrix):
+                writer.writerows((view, cohort, period, code) for code in codes[ids])
+                n_rows += len(ids)
+    except BaseException:
+        # Недописанный файл (в том числе при остановке запуска Streamlit) не оставляем на диске
+        remove_export_file(path)
+        raise
+    return path, n_rows
+
+
+def remove_export_file(path):
+    """Удаляет файл выгрузки; отсутствующий файл не считается ошибкой."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def sweep_stale_exports(max_age_hours=CLIENT_LISTS_EXPORT_MAX_AGE_HOURS, directory=None):
+    """Удаляет временные файлы выгрузки старше max_age_hours (оставшиеся после падения процесса).
+
+    Args:
+        max_age_hours: возраст файла по времени изменения, ч
+        directory: каталог временных файлов (по умолчанию tempfile.gettempdir())
+
+    Returns:
+        int: количество удалённых файлов
+    """
+    directory = directory or tempfile.gettempdir()
+    deadline = time.time() - max_age_hours * 3600
+    removed = 0
+    for path in glob.glob(os.path.join(directory, f'{CLIENT_LISTS_EXPORT_PREFIX}*.csv.gz')):
+        try:
+            if os.path.getmtime(path) < deadline:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
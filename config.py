@@ -73,3 +73,44 @@ CATEGORIES_TEMPLATE_IMAGE_PATHS = [
     'churn_categories_template.jpeg'
 ]
 
+
+# Замеры времени и пиковой памяти этапов обработки (instrumentation.py)
+INSTRUMENTATION_ENABLED = True
+# Пиковая память через tracemalloc (замедляет выполнение Python-кода). tracemalloc общий на
+# процесс, поэтому по умолчанию замеряется только время; бенчмарки включают отслеживание сами
+# (instrumentation.memory_tracing), True — отслеживание на всё время жизни процесса сервера
+INSTRUMENTATION_TRACE_MEMORY = False
+# Уровень логирования записей об этапах
+INSTRUMENTATION_LOG_LEVEL = 'INFO'
+
+# Общий бюджет памяти тяжёлых данных всех сессий сервера (memory_governor.py), МБ
+MEMORY_BUDGET_MB = 2048
+# Данные, использованные менее указанного времени назад, не вытесняются, сек
+MEMORY_EVICTION_MIN_IDLE_SEC = 60
+
+# Списки кодов клиентов длиннее порога не встраиваются в кнопку копирования (HTML страницы),
+# а отдаются файлом для скачивания с предпросмотром первых кодов
+COPY_BUTTON_MAX_CODES = 20000
+COPY_PREVIEW_CODES = 10
+
+# Файл со всеми списками клиентов (client_lists_export.py) пишется во временный каталог с этим
+# префиксом и удаляется вместе с сессией; файлы старше CLIENT_LISTS_EXPORT_MAX_AGE_HOURS
+# (оставшиеся после падения процесса) удаляются при создании новой сессии
+CLIENT_LISTS_EXPORT_PREFIX = 'cohort_client_lists_'
+CLIENT_LISTS_EXPORT_MAX_AGE_HOURS = 24
+
+# Потоковый расчёт выгрузок больше оперативной памяти (out_of_core.py): строк выгрузки
+# в одном читаемом блоке и клиентов в одном блоке при сборке матриц из состояния на диске
+OUT_OF_CORE_CHUNK_ROWS = 1_000_000
+OUT_OF_CORE_BLOCK_CLIENTS = 262_144
+
+# Тепловая карта матриц 1–4 (heatmap_renderer.py): при числе периодов от HEATMAP_DEFAULT_PERIODS
+# матрица по умолчанию показывается картинкой вместо стилизованной таблицы; значения
+# подписываются в ячейках, только если периодов не больше HEATMAP_ANNOTATE_MAX_PERIODS
+HEATMAP_DEFAULT_PERIODS = 100
+HEATMAP_ANNOTATE_MAX_PERIODS = 30
+# Не больше стольких подписей периодов на каждой оси
+HEATMAP_MAX_TICKS = 40
+HEATMAP_DPI = 100
+# Количество отрисованных картинок, хранимых в кэше процесса
+HEATMAP_CACHE_SIZE = 32
@@ -1,8 +1,11 @@
 """
 Модуль для обработки данных и работы с клиентами
 """
+import numpy as np
 import pandas as pd
 from utils import get_sorted_periods
+from activity_matrix import canonical_client_frame, client_cohort_codes
+from instrumentation import timed_stage
 
 
 def get_cohort_clients(df, year_month_col, client_col, cohort_period, target_period, period_clients_cache=None, client_cohorts_cache=None, sorted_periods=None):
@@ -29,6 +32,7 @@ def get_cohort_clients(df, year_month_col, client_col, cohort_period, target_per
     if period_clients_cache:
         clients_in_period = period_clients_cache.get(target_period, set())
     else:
+        df = canonical_client_frame(df, year_month_col, client_col)
         clients_in_period = set(df[df[year_month_col] == target_period][client_col].dropna().unique())
     return sorted(list(clients_in_cohort & clients_in_period))
 
@@ -59,6 +63,8 @@ def get_accumulation_clients(df, year_month_col, client_col, sorted_periods, coh
     if client_cohorts_cache is None:
         client_cohorts_cache = get_client_cohorts(df, year_month_col, client_col, sorted_periods)
     cohort_clients = {c for c, first in client_cohorts_cache.items() if first == cohort_period}
+    if not period_clients_cache:
+        df = canonical_client_frame(df, year_month_col, client_col)
     
     returned_clients = set()
     for period in sorted_periods[cohort_idx + 1:target_idx + 1]:
@@ -71,8 +77,11 @@ def get_accumulation_clients(df, year_month_col, client_col, sorted_periods, coh
     return sorted(list(returned_clients))
 
 
+@timed_stage()
 def get_client_cohorts(df, year_month_col, client_col, sorted_periods):
     """Определяет когорту для каждого клиента (первый период появления по порядку sorted_periods).
+
+    Словарь строится по компактной форме client_cohort_codes (один groupby по клиенту).
     
     Args:
         df: DataFrame с данными
@@ -83,16 +92,8 @@ def get_client_cohorts(df, year_month_col, client_col, sorted_periods):
     Returns:
         dict: словарь {client: cohort_period}
     """
-    period_indices = {period: idx for idx, period in enumerate(sorted_periods)}
-    df_filtered = df[[year_month_col, client_col]].dropna()
-    client_cohorts = {}
-    for client, group in df_filtered.groupby(client_col):
-        periods = group[year_month_col].dropna().unique()
-        valid = [p for p in periods if p in period_indices]
-        if valid:
-            first_period = min(valid, key=lambda p: period_indices[p])
-            client_cohorts[client] = first_period
-    return client_cohorts
+    clients, first_idx = client_cohort_codes(df, year_month_col, client_col, sorted_periods)
+    return dict(zip(clients.tolist(), [sorted_periods[idx] for idx in first_idx.tolist()]))
 
 
 def get_churn_clients(df, year_month_col, client_col, sorted_periods, cohort_period, period_clients_cache=None, client_cohorts_cache=None):
@@ -134,6 +135,8 @@ def get_churn_clients(df, year_month_col, client_col, sorted_periods, cohort_per
         return []
     
     # Находим всех клиентов когорты, которые вернулись хотя бы раз в любом периоде после когорты
+    if not period_clients_cache:
+        df = canonical_client_frame(df, year_month_col, client_col)
     returned_clients = set()
     for period in sorted_periods[cohort_idx + 1:]:
         if period_clients_cache:
@@ -173,6 +176,8 @@ def get_inflow_clients(df, year_month_col, client_col, sorted_periods, cohort_pe
     if client_cohorts_cache is None:
         client_cohorts_cache = get_client_cohorts(df, year_month_col, client_col, sorted_periods)
     cohort_clients = {c for c, first in client_cohorts_cache.items() if first == cohort_period}
+    if not period_clients_cache:
+        df = canonical_client_frame(df, year_month_col, client_col)
     
     if period_clients_cache:
         target_period_clients = period_clients_cache.get(target_period, set())
@@ -195,6 +200,7 @@ def get_inflow_clients(df, year_month_col, client_col, sorted_periods, cohort_pe
     return sorted(list(new_returns))
 
 
+@timed_stage()
 def create_period_clients_cache(df, year_month_col, client_col, sorted_periods):
     """Создает кэш период -> множество клиентов для оптимизации.
     
@@ -207,6 +213,7 @@ def create_period_clients_cache(df, year_month_col, client_col, sorted_periods):
     Returns:
         dict: словарь период -> множество клиентов
     """
+    df = canonical_client_frame(df, year_month_col, client_col)
     period_clients_cache = {}
     for period in sorted_periods:
         period_data = df[df[year_month_col] == period]
@@ -214,72 +221,116 @@ def create_period_clients_cache(df, year_month_col, client_col, sorted_periods):
     return period_clients_cache
 
 
+def _masked_array(values, observed, dtype):
+    """Nullable-массив значений, где ненаблюдаемые позиции — NA."""
+    array = pd.array(values, dtype=dtype)
+    array[~observed] = pd.NA
+    return array
+
+
+@timed_stage()
 def build_churn_table(df, year_month_col, client_col, sorted_periods, cohort_matrix, 
                        accumulation_matrix, accumulation_percent_matrix, 
                        client_cohorts_cache=None, period_clients_cache=None):
     """Строит таблицу оттока клиентов для всех когорт.
     
-    Когорта = период первой покупки клиента. Размер когорты и отток считаются по этой логике.
+    Когорта = период первой покупки клиента. Размер когорты берётся с диагонали когортной
+    матрицы, возврат — из последнего столбца матрицы накопления. Для последней когорты
+    нет периодов наблюдения после неё, поэтому возврат и отток — NA (Int64/Float64),
+    форматирование выполняется при отображении и экспорте.
     
     Args:
-        df: DataFrame с данными
+        df: не используется, оставлен для совместимости вызовов (можно передать None)
         year_month_col: название столбца с периодом
         client_col: название столбца с кодом клиента
         sorted_periods: отсортированный список периодов
         cohort_matrix: матрица когорт
         accumulation_matrix: матрица накопления
         accumulation_percent_matrix: матрица накопления в процентах
-        client_cohorts_cache: кэш словарь клиент -> период когорты
-        period_clients_cache: кэш словарь период -> множество клиентов
+        client_cohorts_cache: не используется, оставлен для совместимости вызовов
+        period_clients_cache: не используется, оставлен для совместимости вызовов
         
     Returns:
         pd.DataFrame: таблица оттока
     """
-    churn_data = []
-    
-    # Оптимизация: создаём period_indices один раз вне цикла
-    period_indices = {period: idx for idx, period in enumerate(sorted_periods)}
-    last_period = sorted_periods[-1]
-    last_period_idx = period_indices[last_period]
+    n_periods = len(sorted_periods)
+    if n_periods == 0:
+        cohort_sizes = total_returned = np.zeros(0, dtype=np.int64)
+    else:
+        cohort_sizes = np.diag(cohort_matrix.loc[sorted_periods, sorted_periods].to_numpy()).astype(np.int64)
+        total_returned = accumulation_matrix.loc[sorted_periods, sorted_periods[-1]].to_numpy().astype(np.int64)
+    churn_counts = cohort_sizes - total_returned
+    safe_sizes = np.where(cohort_sizes > 0, cohort_sizes, 1)
+    total_returned_percent = np.where(cohort_sizes > 0, total_returned / safe_sizes * 100, 0.0)
+    churn_percent = np.where(cohort_sizes > 0, churn_counts / safe_sizes * 100, 0.0)
     
-    for cohort_period in sorted_periods:
-        cohort = cohort_period
-        cohort_size = cohort_matrix.loc[cohort_period, cohort_period]
-        cohort_idx = period_indices[cohort_period]
-        is_last_cohort = (cohort_idx == last_period_idx)
-        
-        if is_last_cohort:
-            # Для последней когорты нет периодов наблюдения после — не считаем возврат и отток
-            churn_data.append({
-                'Когорта': cohort,
-                'Кол-во клиентов когорты': int(cohort_size),
-                'Накопительное кол-во возврата': '-',
-                'Накопительный % возврата': '-',
-                'Отток кол-во': '-',
-                'Отток %': '-'
-            })
-            continue
-        
-        total_returned = accumulation_matrix.loc[cohort_period, last_period]
-        if cohort_size > 0:
-            total_returned_percent = (total_returned / cohort_size) * 100
-        else:
-            total_returned_percent = 0
-        churn_count = int(cohort_size - total_returned)
-        if cohort_size > 0:
-            churn_percent = (churn_count / cohort_size) * 100
-        else:
-            churn_percent = 0
-        
-        churn_data.append({
-            'Когорта': cohort,
-            'Кол-во клиентов когорты': int(cohort_size),
-            'Накопительное кол-во возврата': int(total_returned),
-            'Накопительный % возврата': total_returned_percent,
-            'Отток кол-во': churn_count,
-            'Отток %': churn_percent
-        })
+    # Для последней когорты нет периодов наблюдения после — не считаем возврат и отток
+    observed = np.arange(n_periods) < n_periods - 1
     
-    churn_df = pd.DataFrame(churn_data)
+    churn_df = pd.DataFrame({
+        'Когорта': list(sorted_periods),
+        'Кол-во клиентов когорты': pd.array(cohort_sizes, dtype='Int64'),
+        'Накопительное кол-во возврата': _masked_array(total_returned, observed, 'Int64'),
+        'Накопительный % возврата': _masked_array(total_returned_percent, observed, 'Float64'),
+        'Отток кол-во': _masked_array(churn_counts, observed, 'Int64'),
+        'Отток %': _masked_array(churn_percent, observed, 'Float64'),
+    })
     return churn_df
 
+
+@timed_stage()
+def build_summary_table(churn_table, sorted_periods, category_summary_table=None,
+                        include_category_metrics=False, period_after_label='месяца'):
+    """Строит сводную таблицу по всем когортам (метрики × когорты) с числовыми значениями.
+
+    Базовые метрики берутся из столбцов таблицы оттока, метрики присутствия в других
+    категориях и оттока из сети — из сводки по категориям (отсутствующие значения = 0).
+    Проценты хранятся в процентах (45.7), ненаблюдаемые значения (последняя когорта) — NA;
+    форматирование выполняется при отображении и экспорте.
+
+    Args:
+        churn_table: таблица оттока (build_churn_table)
+        sorted_periods: отсортированный список периодов
+        category_summary_table: сводка по категориям (build_category_summary_table) или None
+        include_category_metrics: добавлять ли метрики по другим категориям
+        period_after_label: 'месяца' или 'недели' для подписей метрик
+
+    Returns:
+        pd.DataFrame: таблица Float64, строки — метрики, столбцы — когорты
+    """
+    churn_by_cohort = churn_table.set_index('Когорта').reindex(sorted_periods)
+    rows = {
+        'Кол-во клиентов в когорте': churn_by_cohort['Кол-во клиентов когорты'],
+        'Накопительное кол-во вернувшихся в категорию': churn_by_cohort['Накопительное кол-во возврата'],
+        'Накопительное кол-во вернувшихся в категорию %': churn_by_cohort['Накопительный % возврата'],
+        'Отток из категории когорты': churn_by_cohort['Отток кол-во'],
+        'Отток из категории когорты %': churn_by_cohort['Отток %'],
+    }
+
+    if include_category_metrics:
+        if category_summary_table is None:
+            category_summary_table = pd.DataFrame()
+        category_summary = category_summary_table.reindex(columns=sorted_periods)
+
+        def category_row(name):
+            if name not in category_summary.index:
+                return pd.Series(0.0, index=sorted_periods)
+            return pd.to_numeric(category_summary.loc[name], errors='coerce').fillna(0)
+
+        present_label = f"Кол-во клиентов когорты в других категориях после {period_after_label} когорты"
+        rows[present_label] = category_row(f"Итого присутствуют в других категориях после {period_after_label} когорты")
+        rows[f"{present_label} %"] = category_row(f"Доля присутствуют в других категориях после {period_after_label} когорты")
+        rows['Отток из сети'] = category_row('Отток из сети')
+        rows['Отток из сети %'] = category_row('Доля оттока из сети от когорты')
+
+    summary = pd.DataFrame(
+        {name: pd.to_numeric(values, errors='coerce').to_numpy(dtype=float, na_value=float('nan'))
+         for name, values in rows.items()},
+        index=sorted_periods
+    ).T
+    return summary.astype('Float64')
+
+
+def summary_percent_rows(summary_table):
+    """Названия строк сводной таблицы, значения которых в процентах."""
+    return [name for name in summary_table.index if str(name).endswith('%')]
@@ -0,0 +1,68 @@
+"""
+Расчётное ядро когортного анализа без Streamlit — единая точка импорта для воркеров и CLI
+"""
+import importlib
+
+# Имя -> модуль, из которого оно берётся; модуль импортируется при первом обращении к имени,
+# поэтому `import engine` не загружает pandas, openpyxl и расчётные модули
+_EXPORTS = {
+    # Периоды, коды клиентов, столбцы
+    'parse_period': 'utils',
+    'get_sorted_periods': 'utils',
+    'get_period_after_label': 'utils',
+    'detect_columns': 'utils',
+    'normalize_client_code': 'utils',
+    'normalize_period_for_compare': 'utils',
+    'period_label': 'utils',
+    'format_client_code_for_copy': 'utils',
+    'canonical_client_keys': 'utils',
+    'format_client_codes': 'utils',
+    # Загрузка выгрузки
+    'read_excel_upload': 'ingestion',
+    'get_product_column': 'ingestion',
+    'get_products': 'ingestion',
+    'get_value_columns': 'ingestion',
+    'compact_upload': 'ingestion',
+    # Матрица активности и когорты
+    'ClientActivityMatrix': 'activity_matrix',
+    'build_activity_matrix': 'activity_matrix',
+    'build_sliced_activity_matrices': 'activity_matrix',
+    'client_cohort_codes': 'activity_matrix',
+    'build_accumulation_percent_matrix': 'matrix_builder',
+    'build_inflow_matrix': 'matrix_builder',
+    'build_value_matrices': 'value_matrices',
+    'build_out_of_core_cohorts': 'out_of_core',
+    # Отток и сводные таблицы
+    'get_client_cohorts': 'data_processing',
+    'build_churn_table': 'data_processing',
+    'build_summary_table': 'data_processing',
+    # Присутствие клиентов оттока в других категориях
+    'CategoryIndex': 'category_index',
+    'build_category_index': 'category_index',
+    'category_index_from_frame': 'category_index',
+    'CategoryPresence': 'category_analysis',
+    'build_category_summary_table': 'category_analysis',
+    # Выгрузки
+    'create_full_report_excel': 'excel_exporter',
+    'write_client_lists_csv': 'client_lists_export',
+    'remove_export_file': 'client_lists_export',
+    'sweep_stale_exports': 'client_lists_export',
+}
+
+# Модули, которые не должны загружаться при импорте ядра (проверяется benchmarks.import_budget)
+FORBIDDEN_MODULES = ('streamlit', 'matplotlib', 'seaborn')
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module 'engine' has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return __all__
@@ -1,8 +1,14 @@
 """
 Модуль для экспорта данных в Excel с форматированием
 """
+import io
+import re
+
 import pandas as pd
 from openpyxl.styles import PatternFill, Font, Alignment
+from openpyxl.utils import get_column_letter
+from instrumentation import timed_stage
+from data_processing import build_summary_table, summary_percent_rows
 
 
 def get_rgb_color_for_excel(val, min_val, max_val, mean_val, is_diagonal=False):
@@ -304,3 +310,320 @@ def apply_excel_inflow_formatting(worksheet, df, sorted_periods, data_start_row=
                 cell.font = Font(color="FFFFFF")
                 cell.alignment = Alignment(horizontal="center", vertical="center")
 
+
+
+def _add_heatmap_image(worksheet, image_bytes, n_columns, start_row):
+    """Вставляет PNG тепловой карты справа от матрицы (через один пустой столбец после неё).
+
+    Args:
+        worksheet: лист Excel с матрицей
+        image_bytes: содержимое PNG (heatmap_renderer.render_heatmap)
+        n_columns: количество столбцов данных матрицы (без столбца индекса)
+        start_row: строка заголовка матрицы (1-based)
+    """
+    from openpyxl.drawing.image import Image
+
+    worksheet.add_image(Image(io.BytesIO(image_bytes)), f"{get_column_letter(n_columns + 3)}{start_row}")
+
+
+def _write_products_header(worksheet, products_label, n_columns):
+    """Добавляет над таблицей заголовок «Продукт построения когорт»."""
+    worksheet.cell(row=1, column=1, value=f"Продукт построения когорт: {products_label}")
+    worksheet.merge_cells(f"A1:{get_column_letter(1 + n_columns)}1")
+    worksheet.cell(row=1, column=1).font = Font(bold=True, size=11)
+
+
+def _write_matrix_sheet(writer, matrix, sheet_name, products_label, table_startrow):
+    """Записывает матрицу когорт на отдельный лист и возвращает лист."""
+    matrix_copy = matrix.copy()
+    matrix_copy.index.name = 'Когорта / Период'
+    matrix_copy.to_excel(writer, sheet_name=sheet_name, startrow=table_startrow, index=True)
+    worksheet = writer.sheets[sheet_name]
+    if products_label:
+        _write_products_header(worksheet, products_label, len(matrix.columns))
+    return worksheet
+
+
+def _format_table_block(worksheet, table, start_row, percent_rows=()):
+    """Выравнивает блок таблицы (записанной с индексом) и задаёт числовые форматы.
+
+    Args:
+        worksheet: лист Excel
+        table: DataFrame, записанный на лист начиная со строки start_row (0-based, как startrow)
+        start_row: startrow, с которым таблица записана на лист
+        percent_rows: названия строк, значения которых в процентах (45.7 -> 45.7%)
+    """
+    for row_offset, row_name in enumerate(table.index):
+        row_idx = start_row + 2 + row_offset
+        for col_idx in range(2, len(table.columns) + 2):
+            cell = worksheet.cell(row=row_idx, column=col_idx)
+            cell.alignment = Alignment(horizontal="center", vertical="center")
+            if cell.value is not None and not isinstance(cell.value, str):
+                if row_name in percent_rows:
+                    cell.value = float(cell.value) / 100.0
+                    cell.number_format = '0.0%'
+                else:
+                    cell.number_format = '0'
+        worksheet.cell(row=row_idx, column=1).alignment = Alignment(horizontal="left", vertical="center")
+
+
+def _slice_sheet_name(number, name, used_names, prefix='П'):
+    """Имя листа среза: «П<номер>. <название>» без недопустимых символов, не длиннее 31 символа."""
+    clean_name = re.sub(r'[\[\]:*?/\\]', '_', str(name))
+    base = f"{prefix}{number}. {clean_name}"[:31]
+    sheet_name = base
+    suffix = 2
+    while sheet_name.lower() in used_names:
+        tail = f" ({suffix})"
+        sheet_name = base[:31 - len(tail)] + tail
+        suffix += 1
+    used_names.add(sheet_name.lower())
+    return sheet_name
+
+
+def _write_slice_sheet(writer, sheet_name, slice_name, slice_tables, sorted_periods):
+    """Записывает на один лист матрицы 1–4 и таблицу оттока среза (продукта) друг под другом.
+
+    Args:
+        writer: pd.ExcelWriter
+        sheet_name: имя листа
+        slice_name: название среза для заголовка листа
+        slice_tables: словарь с ключами cohort_matrix, accumulation_matrix,
+            accumulation_percent_matrix, inflow_matrix и churn_table
+        sorted_periods: отсортированный список периодов
+    """
+    blocks = [
+        ("1. Динамика уникальных клиентов", slice_tables['cohort_matrix'],
+         lambda ws, m, row: apply_excel_cohort_formatting(ws, m.astype(float), sorted_periods, data_start_row=row)),
+        ("2. Динамика накопления", slice_tables['accumulation_matrix'],
+         lambda ws, m, row: apply_excel_color_formatting(ws, m.astype(float), hide_zeros=True, data_start_row=row)),
+        ("3. Динамика накопления %", slice_tables['accumulation_percent_matrix'],
+         lambda ws, m, row: apply_excel_percent_formatting(ws, m, sorted_periods, data_start_row=row)),
+        ("4. Приток возврата %", slice_tables['inflow_matrix'],
+         lambda ws, m, row: apply_excel_inflow_formatting(ws, m, sorted_periods, data_start_row=row)),
+    ]
+    start_row = 2
+    worksheet = None
+    for title, matrix, apply_formatting in blocks:
+        matrix_copy = matrix.copy()
+        matrix_copy.index.name = 'Когорта / Период'
+        matrix_copy.to_excel(writer, sheet_name=sheet_name, startrow=start_row + 1, index=True)
+        worksheet = writer.sheets[sheet_name]
+        worksheet.cell(row=start_row + 1, column=1, value=title).font = Font(bold=True, size=11)
+        apply_formatting(worksheet, matrix, start_row + 3)
+        start_row += len(matrix.index) + 4
+
+    churn_table = slice_tables['churn_table']
+    churn_table_copy = churn_table.astype(object).where(churn_table.notna(), '-')
+    churn_table_copy.to_excel(writer, sheet_name=sheet_name, startrow=start_row + 1, index=False)
+    worksheet.cell(row=start_row + 1, column=1, value="5. Отток клиентов из категории").font = Font(bold=True, size=11)
+    for row_idx in range(start_row + 3, start_row + 3 + len(churn_table_copy)):
+        for col_idx in range(1, len(churn_table_copy.columns) + 1):
+            cell = worksheet.cell(row=row_idx, column=col_idx)
+            cell.alignment = Alignment(horizontal="center", vertical="center")
+            if cell.value is None or isinstance(cell.value, str):
+                continue
+            if churn_table_copy.columns[col_idx - 1] in ['Накопительный % возврата', 'Отток %']:
+                cell.value = float(cell.value) / 100.0
+                cell.number_format = '0.0%'
+            else:
+                cell.number_format = '0'
+
+    worksheet.cell(row=1, column=1, value=f"Продукт: {slice_name}").font = Font(bold=True, size=12)
+
+
+def _write_value_sheet(writer, sheet_name, value_col, value_tables, sorted_periods):
+    """Записывает на один лист взвешенные матрицы показателя друг под другом.
+
+    Args:
+        writer: pd.ExcelWriter
+        sheet_name: имя листа
+        value_col: название показателя для заголовка листа
+        value_tables: словарь вид матрицы -> DataFrame (value_matrices.build_value_matrices)
+        sorted_periods: отсортированный список периодов
+    """
+    start_row = 2
+    worksheet = None
+    for number, (title, matrix) in enumerate(value_tables.items(), start=1):
+        matrix_copy = matrix.copy()
+        matrix_copy.index.name = 'Когорта / Период'
+        matrix_copy.to_excel(writer, sheet_name=sheet_name, startrow=start_row + 1, index=True)
+        worksheet = writer.sheets[sheet_name]
+        worksheet.cell(row=start_row + 1, column=1, value=f"{number}. {title}").font = Font(bold=True, size=11)
+        apply_excel_cohort_formatting(worksheet, matrix.astype(float), sorted_periods, data_start_row=start_row + 3)
+        for row_idx in range(start_row + 3, start_row + 3 + len(matrix.index)):
+            for col_idx in range(2, len(matrix.columns) + 2):
+                cell = worksheet.cell(row=row_idx, column=col_idx)
+                if cell.value is not None and not isinstance(cell.value, str):
+                    cell.number_format = '#,##0.00'
+        start_row += len(matrix.index) + 4
+    worksheet.cell(row=1, column=1, value=f"Показатель: {value_col}").font = Font(bold=True, size=12)
+
+
+@timed_stage()
+def create_full_report_excel(cohort_matrix, accumulation_matrix, accumulation_percent_matrix, inflow_matrix,
+                             churn_table, sorted_periods, products_label='', category_summary_table=None,
+                             category_cohort_table=None, category_period_tables=None,
+                             include_category_metrics=False, period_after_label='месяца', product_slices=None,
+                             value_matrices=None, heatmap_images=None):
+    """Создает полный Excel отчёт со всеми таблицами.
+
+    Args:
+        cohort_matrix: когортная матрица
+        accumulation_matrix: матрица накопления
+        accumulation_percent_matrix: матрица накопления в процентах
+        inflow_matrix: матрица притока в процентах
+        churn_table: таблица оттока
+        sorted_periods: отсортированный список периодов
+        products_label: подпись «Продукт построения когорт» (пустая строка — без заголовка)
+        category_summary_table: сводка присутствия в других категориях (или None)
+        category_cohort_table: таблица категории × когорты (или None)
+        category_period_tables: список (когорта, таблица присутствия по категориям) или None,
+            если файл категорий не загружен
+        include_category_metrics: добавлять ли в сводную таблицу метрики по другим категориям
+        period_after_label: 'месяца' или 'недели' для подписей метрик
+        product_slices: список (название продукта, словарь таблиц среза) — по листу на продукт
+            с матрицами 1–4 и таблицей оттока; None — без листов по продуктам
+        value_matrices: список (название показателя, словарь взвешенных матриц) — по листу
+            на показатель (сумма, на активного клиента, LTV); None — без этих листов
+        heatmap_images: PNG тепловых карт матриц 1–4 в том же порядке (None в списке — без
+            картинки), вставляются на листы справа от таблиц; None — без картинок
+
+    Returns:
+        bytes: содержимое xlsx файла
+    """
+    buffer = io.BytesIO()
+    # Смещение строки данных при наличии заголовка «Продукт построения когорт»
+    data_start_row = 4 if products_label else 2
+    table_startrow = 2 if products_label else 0
+
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        workbook = writer.book
+
+        # Таблица 1: Динамика уникальных клиентов когорт
+        worksheet1 = _write_matrix_sheet(writer, cohort_matrix, "1. Динамика уникальных клиентов", products_label, table_startrow)
+        apply_excel_cohort_formatting(worksheet1, cohort_matrix.astype(float), sorted_periods, data_start_row=data_start_row)
+
+        # Таблица 2: Динамика накопления возврата
+        worksheet2 = _write_matrix_sheet(writer, accumulation_matrix, "2. Динамика накопления", products_label, table_startrow)
+        apply_excel_color_formatting(worksheet2, accumulation_matrix.astype(float), hide_zeros=True, data_start_row=data_start_row)
+        # Форматируем значения как целые числа (только для непустых ячеек)
+        for row_idx in range(data_start_row, data_start_row + len(accumulation_matrix.index)):
+            for col_idx in range(2, len(accumulation_matrix.columns) + 2):
+                cell = worksheet2.cell(row=row_idx, column=col_idx)
+                if cell.value is not None and not isinstance(cell.value, str) and cell.value != "":
+                    cell.number_format = '0'
+
+        # Таблица 3: Динамика накопления возврата в %
+        worksheet3 = _write_matrix_sheet(writer, accumulation_percent_matrix, "3. Динамика накопления %", products_label, table_startrow)
+        apply_excel_percent_formatting(worksheet3, accumulation_percent_matrix, sorted_periods, data_start_row=data_start_row)
+
+        # Таблица 4: Приток возврата в %
+        worksheet4 = _write_matrix_sheet(writer, inflow_matrix, "4. Приток возврата %", products_label, table_startrow)
+        apply_excel_inflow_formatting(worksheet4, inflow_matrix, sorted_periods, data_start_row=data_start_row)
+
+        # Тепловые карты матриц 1–4 (обзор больших матриц одной картинкой)
+        if heatmap_images is not None:
+            matrix_sheets = [
+                (worksheet1, cohort_matrix), (worksheet2, accumulation_matrix),
+                (worksheet3, accumulation_percent_matrix), (worksheet4, inflow_matrix),
+            ]
+            for (worksheet, matrix), image_bytes in zip(matrix_sheets, heatmap_images):
+                if image_bytes is not None:
+                    _add_heatmap_image(worksheet, image_bytes, len(matrix.columns), data_start_row - 1)
+
+        # Таблица 5: Отток клиентов из категории
+        # Ненаблюдаемые значения (NA у последней когорты) выводятся как '-'
+        churn_table_copy = churn_table.astype(object).where(churn_table.notna(), '-')
+        churn_table_copy.to_excel(writer, sheet_name="5. Отток клиентов из категории", startrow=0, index=False)
+        worksheet5 = writer.sheets["5. Отток клиентов из категории"]
+        for row_idx in range(2, len(churn_table_copy) + 2):
+            for col_idx in range(1, len(churn_table_copy.columns) + 1):
+                cell = worksheet5.cell(row=row_idx, column=col_idx)
+                cell.alignment = Alignment(horizontal="center", vertical="center")
+                col_name = churn_table_copy.columns[col_idx - 1]
+                if cell.value is None or isinstance(cell.value, str):
+                    continue
+                if col_name in ['Кол-во клиентов когорты', 'Накопительное кол-во возврата', 'Отток кол-во']:
+                    cell.number_format = '0'
+                elif col_name in ['Накопительный % возврата', 'Отток %']:
+                    # Значение уже в процентах (например, 45.7), конвертируем в долю (0.457)
+                    cell.value = float(cell.value) / 100.0
+                    cell.number_format = '0.0%'
+
+        # Таблица 6: Присутствие клиентов оттока когорты в других категориях товаров
+        if category_period_tables is not None:
+            sheet_name = "6. Присутствие когорты в других категориях"
+            start_row_cohorts = 0
+            worksheet_cohorts = None
+
+            if category_summary_table is not None:
+                summary_table_excel = category_summary_table.copy()
+                summary_table_excel.index.name = 'Метрика / Когорта'
+                summary_table_excel.to_excel(writer, sheet_name=sheet_name, startrow=start_row_cohorts, index=True)
+                worksheet_cohorts = writer.sheets[sheet_name]
+                _format_table_block(worksheet_cohorts, summary_table_excel, start_row_cohorts,
+                                    percent_rows=('Доля оттока из сети от когорты',))
+                start_row_cohorts = start_row_cohorts + len(summary_table_excel.index) + 3
+
+            if category_cohort_table is not None:
+                category_table_excel = category_cohort_table.copy()
+                category_table_excel.index.name = 'Категория / Когорта'
+                category_table_excel.to_excel(writer, sheet_name=sheet_name, startrow=start_row_cohorts, index=True)
+                worksheet_cohorts = writer.sheets[sheet_name]
+                _format_table_block(worksheet_cohorts, category_table_excel, start_row_cohorts)
+                start_row_cohorts = start_row_cohorts + len(category_table_excel.index) + 3
+
+            for selected_cohort, category_period_table in category_period_tables:
+                if worksheet_cohorts is None:
+                    worksheet_cohorts = workbook.create_sheet(sheet_name)
+                last_col_letter = get_column_letter(len(category_period_table.columns) + 1)
+                worksheet_cohorts.cell(row=start_row_cohorts + 1, column=1, value=f"Когорта: {selected_cohort}")
+                worksheet_cohorts.merge_cells(f'A{start_row_cohorts + 1}:{last_col_letter}{start_row_cohorts + 1}')
+                header_cell = worksheet_cohorts.cell(row=start_row_cohorts + 1, column=1)
+                header_cell.font = Font(bold=True, size=12)
+                header_cell.alignment = Alignment(horizontal="center", vertical="center")
+                start_row_cohorts += 2
+                category_period_table.to_excel(writer, sheet_name=sheet_name, startrow=start_row_cohorts, index=True)
+                _format_table_block(worksheet_cohorts, category_period_table, start_row_cohorts)
+                # Обновляем начальную строку для следующей таблицы (таблица + 2 пустые строки)
+                start_row_cohorts = start_row_cohorts + len(category_period_table.index) + 3
+
+        # Таблица 7: Сводная таблица по всем когортам
+        # Базовые метрики (1-5) всегда, метрики по другим категориям — при наличии файла категорий
+        if churn_table is not None:
+            summary_df = build_summary_table(
+                churn_table, sorted_periods, category_summary_table=category_summary_table,
+                include_category_metrics=include_category_metrics, period_after_label=period_after_label
+            )
+            percent_rows = set(summary_percent_rows(summary_df))
+            # Ненаблюдаемые значения (последняя когорта) выводятся как '-'
+            summary_excel = summary_df.astype(object).where(summary_df.notna(), '-')
+            summary_excel.index.name = 'Метрика / Когорта'
+            summary_excel.to_excel(writer, sheet_name="7. Сводная таблица по всем когортам", startrow=0, index=True)
+            worksheet_summary = writer.sheets["7. Сводная таблица по всем когортам"]
+            _format_table_block(worksheet_summary, summary_excel, 0, percent_rows=percent_rows)
+
+        # Листы взвешенных матриц по числовым показателям выгрузки (нумерация после листа 7)
+        if value_matrices:
+            used_names = {name.lower() for name in workbook.sheetnames}
+            for number, (value_col, value_tables) in enumerate(value_matrices, start=8):
+                _write_value_sheet(
+                    writer, _slice_sheet_name(number, value_col, used_names, prefix=''), value_col,
+                    value_tables, sorted_periods
+                )
+
+        # Листы по продуктам (срезам первого столбца выгрузки)
+        if product_slices:
+            used_names = {name.lower() for name in workbook.sheetnames}
+            for number, (slice_name, slice_tables) in enumerate(product_slices, start=1):
+                _write_slice_sheet(
+                    writer, _slice_sheet_name(number, slice_name, used_names), slice_name, slice_tables, sorted_periods
+                )
+
+        # Удаляем пустой лист по умолчанию
+        if 'Sheet' in workbook.sheetnames:
+            workbook.remove(workbook['Sheet'])
+
+    buffer.seek(0)
+    return buffer.getvalue()
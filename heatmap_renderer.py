@@ -0,0 +1,156 @@
+"""
+Модуль отрисовки матриц когорт тепловой картой (PNG/SVG через matplotlib Agg) вместо стилизованной таблицы
+"""
+import hashlib
+import io
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from config import (
+    HEATMAP_ANNOTATE_MAX_PERIODS, HEATMAP_CACHE_SIZE, HEATMAP_DPI, HEATMAP_MAX_TICKS
+)
+from instrumentation import timed_stage
+
+# Вид матрицы (ключ MATRIX_VIEWS в app.py) -> (градиент по строкам, скрытие значений до диагонали,
+# формат подписи ячейки); настройки те же, что у таблиц (ui_components.apply_matrix_color_gradient)
+HEATMAP_VIEWS = {
+    'cohort': (True, True, '{:,.0f}'),
+    'accumulation': (False, False, '{:,.0f}'),
+    'accumulation_percent': (True, True, '{:.1f}%'),
+    'inflow': (True, True, '{:.1f}%'),
+}
+
+# Отрисованные картинки: (хеш матрицы, настройки) -> bytes, общие для всех сессий процесса
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def matrix_digest(matrix):
+    """SHA-256 значений, индекса и столбцов матрицы — ключ кэша отрисованных картинок."""
+    digest = hashlib.sha256(pd.util.hash_pandas_object(matrix, index=True).to_numpy().tobytes())
+    digest.update(repr(list(matrix.columns)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def heatmap_colors(values, horizontal_dynamics=False, hide_before_diagonal=False):
+    """Цвета ячеек по шкале color_gradient / get_rgb_color_for_excel для всей матрицы сразу.
+
+    Красный (минимум) — жёлтый (среднее) — зелёный (максимум); диагональ, нули, пропуски
+    и (при hide_before_diagonal) ячейки до диагонали — белые. Минимум, максимум и среднее
+    берутся по окрашиваемым ячейкам всей матрицы, а при horizontal_dynamics — каждой строки.
+
+    Args:
+        values: квадратный массив значений матрицы (когорта × период)
+        horizontal_dynamics: градиент по каждой строке отдельно
+        hide_before_diagonal: не окрашивать ячейки до диагонали
+
+    Returns:
+        tuple: (массив RGB uint8 формы (строки, столбцы, 3), булев признак окрашенных ячеек)
+    """
+    values = np.asarray(values, dtype=float)
+    rows, cols = np.indices(values.shape)
+    colored = (rows != cols) & np.isfinite(values) & (values != 0)
+    if hide_before_diagonal:
+        colored &= cols >= rows
+
+    axis = 1 if horizontal_dynamics else None
+    count = colored.sum(axis=axis, keepdims=True)
+    low = np.where(colored, values, np.inf).min(axis=axis, keepdims=True)
+    high = np.where(colored, values, -np.inf).max(axis=axis, keepdims=True)
+    total = np.where(colored, values, 0.0).sum(axis=axis, keepdims=True)
+    mean = np.divide(total, count, out=np.zeros(total.shape), where=count > 0)
+    # Неокрашиваемые ячейки приравниваются к среднему, чтобы в расчёте не было inf/nan
+    values = np.where(colored, values, mean)
+    low = np.where(np.isfinite(low), low, mean)
+    high = np.where(np.isfinite(high), high, mean)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        low_ratio = np.where(mean == low, 1.0, np.clip((values - low) / (mean - low), 0, 1))
+        high_ratio = np.where(high == mean, 1.0, np.clip((values - mean) / (high - mean), 0, 1))
+    below = values <= mean
+    rgb = np.full(values.shape + (3,), 255, dtype=np.uint8)
+    rgb[..., 0] = np.where(colored & ~below, (255 * (1 - high_ratio)).astype(np.int64), 255)
+    rgb[..., 1] = np.where(colored & below, (255 * low_ratio).astype(np.int64), 255)
+    rgb[..., 2] = np.where(colored, 0, 255)
+    return rgb, colored
+
+
+def _tick_positions(n_labels):
+    """Позиции подписей оси: все, если их не больше HEATMAP_MAX_TICKS, иначе каждая k-я."""
+    step = max(1, math.ceil(n_labels / HEATMAP_MAX_TICKS))
+    return np.arange(0, n_labels, step)
+
+
+def _draw(matrix, view_key, image_format, title):
+    """Рисует тепловую карту на Figure с холстом Agg (без pyplot и его глобального состояния)."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    horizontal_dynamics, hide_before_diagonal, label_format = HEATMAP_VIEWS[view_key]
+    values = matrix.to_numpy(dtype=float)
+    rgb, colored = heatmap_colors(values, horizontal_dynamics, hide_before_diagonal)
+    n_rows, n_cols = values.shape
+    annotate = max(n_rows, n_cols) <= HEATMAP_ANNOTATE_MAX_PERIODS
+
+    # Размер ячейки — крупнее, если в ней подписывается значение
+    cell_inches = 0.55 if annotate else 0.09
+    width = min(max(6.0, n_cols * cell_inches + 2.0), 40.0)
+    height = min(max(4.0, n_rows * cell_inches + 1.5), 40.0)
+    figure = Figure(figsize=(width, height), dpi=HEATMAP_DPI)
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    axes.imshow(rgb, aspect='auto', interpolation='nearest')
+
+    row_ticks = _tick_positions(n_rows)
+    col_ticks = _tick_positions(n_cols)
+    axes.set_yticks(row_ticks, [str(matrix.index[idx]) for idx in row_ticks], fontsize=7)
+    axes.set_xticks(col_ticks, [str(matrix.columns[idx]) for idx in col_ticks], fontsize=7, rotation=90)
+    axes.xaxis.tick_top()
+    axes.set_ylabel('Когорта')
+    if title:
+        axes.set_title(title, fontsize=10, pad=40)
+
+    if annotate:
+        diagonal = np.eye(n_rows, n_cols, dtype=bool)
+        for row, col in zip(*np.nonzero(colored | (diagonal & np.isfinite(values)))):
+            axes.text(
+                col, row, label_format.format(values[row, col]), ha='center', va='center', fontsize=7,
+                fontweight='bold' if row == col else 'normal'
+            )
+
+    figure.tight_layout()
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format=image_format, dpi=HEATMAP_DPI)
+    return buffer.getvalue()
+
+
+@timed_stage()
+def render_heatmap(matrix, view_key, image_format='png', title=''):
+    """Тепловая карта матрицы вида view_key (HEATMAP_VIEWS).
+
+    Результат кэшируется по matrix_digest и настройкам: повторный показ той же матрицы
+    (перезапуск страницы, другая сессия с тем же файлом) не рисует картинку заново.
+
+    Args:
+        matrix: квадратный DataFrame когорта × период
+        view_key: вид матрицы ('cohort', 'accumulation', 'accumulation_percent', 'inflow')
+        image_format: 'png' или 'svg'
+        title: заголовок над картой (пустая строка — без заголовка)
+
+    Returns:
+        bytes: содержимое картинки
+    """
+    key = (matrix_digest(matrix), view_key, image_format, title)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    image = _draw(matrix, view_key, image_format, title)
+    with _cache_lock:
+        _cache[key] = image
+        while len(_cache) > HEATMAP_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return image
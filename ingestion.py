@@ -0,0 +1,162 @@
+"""
+Модуль загрузки выгрузки Qlik и сжатия её до уникальных строк продукт × период × клиент
+"""
+import hashlib
+
+import numpy as np
+import pandas as pd
+from instrumentation import timed_stage
+from utils import canonical_client_keys, client_key_array, period_label
+
+
+@timed_stage()
+def read_excel_upload(uploaded_file):
+    """Читает загруженный Excel файл (.xlsx — openpyxl, .xls — xlrd).
+
+    Args:
+        uploaded_file: файл из st.file_uploader
+
+    Returns:
+        pd.DataFrame: исходные данные файла
+    """
+    engine = 'openpyxl' if uploaded_file.name.endswith('.xlsx') else 'xlrd'
+    return pd.read_excel(uploaded_file, engine=engine)
+
+
+def content_digest(uploaded_file):
+    """SHA-256 содержимого загруженного файла — ключ кэша разобранных из него данных."""
+    return hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+
+
+def get_product_column(df, year_month_col, client_col):
+    """Столбец продукта — первый столбец выгрузки, если это не период и не код клиента.
+
+    Returns:
+        название столбца или None
+    """
+    if len(df.columns) == 0:
+        return None
+    product_col = df.columns[0]
+    if product_col in (year_month_col, client_col):
+        return None
+    return product_col
+
+
+def get_products(df, product_col):
+    """Отсортированный список непустых названий продуктов (как строки)."""
+    if product_col is None:
+        return []
+    products = sorted(df[product_col].dropna().astype(str).str.strip().unique())
+    return [p for p in products if p]
+
+
+def get_value_columns(df, exclude=()):
+    """Числовые столбцы выгрузки (сумма, количество), по которым строятся взвешенные матрицы.
+
+    Столбцы кодов (название содержит «код») и столбцы из exclude показателями не считаются.
+
+    Returns:
+        list: названия столбцов в порядке выгрузки
+    """
+    value_cols = []
+    for col in df.columns:
+        if col in exclude or 'код' in str(col).lower():
+            continue
+        dtype = df[col].dtype
+        if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+            value_cols.append(col)
+    return value_cols
+
+
+def canonical_client_categorical(clients):
+    """Переводит категориальный столбец кодов клиентов в канонические ключи (utils.canonical_client_keys).
+
+    Ключи вычисляются один раз на категорию; исходные коды, дающие один ключ
+    ('196107' и 196107.0), объединяются, пустые коды становятся пропусками.
+
+    Args:
+        clients: категориальный pd.Series кодов клиентов
+
+    Returns:
+        pd.Categorical: коды клиентов со словарём канонических ключей (int64 или строки вперемешку с int)
+    """
+    keys = canonical_client_keys(clients.cat.categories)
+    keys[keys == ''] = None
+    key_codes, uniques = pd.factorize(keys)
+    codes = np.append(key_codes, -1)[clients.cat.codes.to_numpy()]
+    return pd.Categorical.from_codes(codes, categories=client_key_array(uniques))
+
+
+def period_categorical(periods):
+    """Переводит категориальный столбец периодов к общему виду utils.period_label.
+
+    Подписи вычисляются один раз на категорию; периоды, совпадающие после нормализации,
+    объединяются, пустые становятся пропусками.
+
+    Args:
+        periods: категориальный pd.Series периодов
+
+    Returns:
+        pd.Categorical: периоды со словарём нормализованных подписей
+    """
+    labels = np.array([period_label(value) for value in periods.cat.categories], dtype=object)
+    labels[labels == ''] = None
+    label_codes, uniques = pd.factorize(labels)
+    codes = np.append(label_codes, -1)[periods.cat.codes.to_numpy()]
+    return pd.Categorical.from_codes(codes, categories=uniques)
+
+
+@timed_stage()
+def compact_upload(df, year_month_col, client_col, product_col=None, value_cols=()):
+    """Сжимает выгрузку до уникальных строк (продукт, период, клиент) с категориальными столбцами.
+
+    Для когортного анализа нужны только различные пары период × клиент, поэтому остальные
+    столбцы отбрасываются, строки с пустым периодом или кодом клиента удаляются
+    (как и во всех расчётах), а повторы покупок схлопываются. Продукты хранятся как есть
+    в категориях, периоды — в общем виде utils.period_label (как в out_of_core); коды
+    клиентов один раз приводятся к каноническим ключам (canonical_client_categorical):
+    если все коды числовые, столбец — int64, иначе — категориальный со словарём ключей. Исходный вид кода восстанавливается
+    только при выводе (utils.format_client_codes). Числовые показатели из value_cols
+    суммируются по схлопнутым строкам.
+
+    Args:
+        df: исходный DataFrame выгрузки
+        year_month_col: название столбца с периодом
+        client_col: название столбца с кодом клиента
+        product_col: название столбца продукта (или None)
+        value_cols: названия числовых столбцов для суммирования (get_value_columns)
+
+    Returns:
+        pd.DataFrame: компактная таблица со столбцами [product_col,] year_month_col, client_col[, value_cols]
+    """
+    columns = [col for col in (product_col, year_month_col, client_col) if col is not None]
+    value_cols = list(value_cols)
+    lean = df[columns + value_cols].dropna(subset=[year_month_col, client_col])
+    keys = pd.DataFrame({col: lean[col].astype('category') for col in columns})
+    keys[year_month_col] = period_categorical(keys[year_month_col])
+    keys[client_col] = canonical_client_categorical(keys[client_col])
+    known = (keys[year_month_col].notna() & keys[client_col].notna()).to_numpy()
+    if not known.all():
+        lean = lean[known]
+        keys = keys[known]
+    # Дедупликация по целочисленным кодам категорий дешевле, чем по исходным объектам
+    codes = pd.DataFrame({col: keys[col].cat.codes for col in columns})
+    first = ~codes.duplicated().to_numpy()
+    compact = keys[first].reset_index(drop=True)
+    for col in columns:
+        compact[col] = compact[col].cat.remove_unused_categories()
+    client_keys = compact[client_col].cat.categories
+    if client_keys.dtype == np.int64:
+        compact[client_col] = client_keys.to_numpy()[compact[client_col].cat.codes.to_numpy()]
+    if value_cols:
+        # Номер группы — порядок первого появления, как и у оставленных строк
+        group_ids = codes.groupby(columns, sort=False).ngroup().to_numpy()
+        sums = lean[value_cols].apply(pd.to_numeric, errors='coerce').groupby(group_ids).sum()
+        for col in value_cols:
+            compact[col] = sums[col].to_numpy()
+    return compact
+
+
+def memory_usage_mb(df):
+    """Объём памяти DataFrame в МБ (с учётом строковых значений)."""
+    return df.memory_usage(deep=True).sum() / (1024 * 1024)
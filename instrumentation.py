@@ -0,0 +1,247 @@
+"""
+Модуль замеров времени и пиковой памяти этапов обработки
+"""
+import functools
+import logging
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import pandas as pd
+from config import INSTRUMENTATION_ENABLED, INSTRUMENTATION_TRACE_MEMORY, INSTRUMENTATION_LOG_LEVEL
+
+logger = logging.getLogger('cohort_analysis.stages')
+
+_settings = {
+    'enabled': INSTRUMENTATION_ENABLED,
+    'trace_memory': INSTRUMENTATION_TRACE_MEMORY,
+}
+
+# Записи текущего запуска и стек активных замеров (у каждого потока Streamlit — свои)
+_records = ContextVar('stage_records', default=None)
+_stack = ContextVar('stage_stack', default=())
+
+# tracemalloc общий на процесс, поэтому у него один владелец — memory_tracing() или
+# INSTRUMENTATION_TRACE_MEMORY; замеры этапов только читают его и не запускают/останавливают
+_tracer_lock = threading.Lock()
+_tracer = None
+
+
+def configure(enabled=None, trace_memory=None):
+    """Включает/выключает замеры и отслеживание памяти (например, в бенчмарках)."""
+    if enabled is not None:
+        _settings['enabled'] = enabled
+    if trace_memory is not None:
+        _settings['trace_memory'] = trace_memory
+
+
+class MemoryTracer:
+    """Владелец tracemalloc: общий пик памяти с начала отслеживания.
+
+    Замеры этапов сбрасывают пик tracemalloc (reset_peak), поэтому перед каждым сбросом
+    пик запоминается здесь — общий пик блока memory_tracing() не теряется.
+    """
+
+    def __init__(self):
+        self.peak = 0
+
+    def observe(self):
+        """Учитывает текущий пик tracemalloc и возвращает его (в байтах)."""
+        peak = tracemalloc.get_traced_memory()[1]
+        self.peak = max(self.peak, peak)
+        return peak
+
+    def peak_mb(self):
+        """Пик памяти с начала отслеживания, МБ."""
+        self.observe()
+        return self.peak / (1024 * 1024)
+
+
+def _start_tracer():
+    """Запускает tracemalloc и возвращает нового владельца (None — запущен кем-то другим)."""
+    global _tracer
+    with _tracer_lock:
+        if _tracer is not None or tracemalloc.is_tracing():
+            return None
+        tracemalloc.start()
+        _tracer = MemoryTracer()
+        return _tracer
+
+
+@contextmanager
+def memory_tracing():
+    """Отслеживает память на время блока: пики этапов в записях и общий пик блока.
+
+    Для точек входа бенчмарков и диагностики. Если отслеживание уже запущено (вложенный
+    вызов или INSTRUMENTATION_TRACE_MEMORY), используется действующий владелец, и
+    tracemalloc остаётся запущенным после блока.
+
+    Yields:
+        MemoryTracer или None: владелец отслеживания (None — tracemalloc запущен вне модуля)
+    """
+    global _tracer
+    tracer = _start_tracer()
+    if tracer is None:
+        yield _tracer
+        return
+    try:
+        yield tracer
+    finally:
+        with _tracer_lock:
+            tracemalloc.stop()
+            _tracer = None
+
+
+def setup_logging():
+    """Подключает вывод записей об этапах в stderr (один раз на процесс)."""
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s %(name)s %(message)s'))
+        logger.addHandler(handler)
+    logger.setLevel(INSTRUMENTATION_LOG_LEVEL)
+
+
+def reset_records():
+    """Начинает новый список записей (вызывается в начале каждого запуска скрипта).
+
+    Returns:
+        list: пустой список, в который будут добавляться записи
+    """
+    records = []
+    _records.set(records)
+    return records
+
+
+def get_records():
+    """Возвращает записи текущего запуска (список словарей)."""
+    records = _records.get()
+    return list(records) if records is not None else []
+
+
+class _Frame:
+    """Состояние одного активного замера."""
+
+    __slots__ = ('name', 'start', 'mem_start', 'mem_peak')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = 0.0
+        self.mem_start = None
+        self.mem_peak = 0
+
+
+@contextmanager
+def stage_timer(name, **meta):
+    """Замеряет время и пиковую память блока кода и сохраняет запись об этапе.
+
+    Вложенные этапы допускаются: пик родителя учитывает пики вложенных этапов.
+    Память замеряется, только если отслеживание включено (memory_tracing или
+    INSTRUMENTATION_TRACE_MEMORY); сам замер tracemalloc не запускает и не останавливает.
+
+    Args:
+        name: название этапа
+        **meta: дополнительные поля записи (например, rows)
+    """
+    if not _settings['enabled']:
+        yield
+        return
+
+    parent_stack = _stack.get()
+    frame = _Frame(name)
+    tracer = _tracer
+    if tracer is None and _settings['trace_memory']:
+        # Отслеживание на всё время жизни процесса (диагностика сервера)
+        tracer = _start_tracer()
+    if tracer is not None:
+        current = tracemalloc.get_traced_memory()[0]
+        peak = tracer.observe()
+        if parent_stack:
+            parent_stack[-1].mem_peak = max(parent_stack[-1].mem_peak, peak)
+        tracemalloc.reset_peak()
+        frame.mem_start = current
+        frame.mem_peak = current
+    token = _stack.set(parent_stack + (frame,))
+    frame.start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - frame.start
+        peak_mb = None
+        if frame.mem_start is not None and tracemalloc.is_tracing():
+            frame.mem_peak = max(frame.mem_peak, tracer.observe())
+            peak_mb = (frame.mem_peak - frame.mem_start) / (1024 * 1024)
+            if parent_stack:
+                parent_stack[-1].mem_peak = max(parent_stack[-1].mem_peak, frame.mem_peak)
+        _stack.reset(token)
+
+        record = {
+            'stage': name,
+            'root': parent_stack[0].name if parent_stack else name,
+            'parent': parent_stack[-1].name if parent_stack else None,
+            'depth': len(parent_stack),
+            'started': frame.start,
+            'seconds': round(seconds, 6),
+            'peak_mb': None if peak_mb is None else round(peak_mb, 3),
+        }
+        record.update(meta)
+        records = _records.get()
+        if records is not None:
+            records.append(record)
+        logger.info(
+            "stage=%s seconds=%.4f peak_mb=%s depth=%d",
+            name, seconds, record['peak_mb'], record['depth'], extra={'stage_record': record}
+        )
+
+
+def timed_stage(name=None):
+    """Декоратор: оборачивает вызов функции в stage_timer.
+
+    Если первый аргумент — DataFrame, в запись добавляется количество его строк.
+
+    Args:
+        name: название этапа (по умолчанию — имя функции)
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _settings['enabled']:
+                return func(*args, **kwargs)
+            meta = {}
+            if args and isinstance(args[0], pd.DataFrame):
+                meta['rows'] = len(args[0])
+            with stage_timer(stage_name, **meta):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def summarize_records(records):
+    """Сводная таблица по этапам: количество вызовов, суммарное время и максимальный пик памяти.
+
+    Args:
+        records: список записей (get_records)
+
+    Returns:
+        pd.DataFrame: таблица в порядке начала этапов (вложенные — с отступом под родителем)
+    """
+    columns = ['Этап', 'Вызовов', 'Время, с', 'Пик памяти, МБ', 'Строк']
+    if not records:
+        return pd.DataFrame(columns=columns)
+    data = pd.DataFrame(records).sort_values('started', kind='stable')
+    if 'rows' not in data.columns:
+        data['rows'] = None
+    data['label'] = ['    ' * int(depth) + stage for depth, stage in zip(data['depth'], data['stage'])]
+    summary = data.groupby('label', sort=False).agg(
+        calls=('stage', 'size'),
+        seconds=('seconds', 'sum'),
+        peak_mb=('peak_mb', 'max'),
+        rows=('rows', 'max'),
+    ).reset_index()
+    summary.columns = columns
+    summary['Время, с'] = summary['Время, с'].round(3)
+    summary['Строк'] = pd.to_numeric(summary['Строк'], errors='coerce').astype('Int64')
+    return summary
@@ -2,7 +2,9 @@
 Модуль для построения различных матриц когортного анализа
 """
 import pandas as pd
-from utils import parse_period
+from utils import get_sorted_periods
+from activity_matrix import canonical_client_frame, client_cohort_codes
+from instrumentation import timed_stage
 
 
 def _cohort_clients_by_first_period(df, year_month_col, client_col, sorted_periods):
@@ -10,21 +12,14 @@ def _cohort_clients_by_first_period(df, year_month_col, client_col, sorted_perio
     
     Когорта = период первой покупки клиента (по порядку sorted_periods).
     """
-    period_indices = {period: idx for idx, period in enumerate(sorted_periods)}
-    df_filtered = df[[year_month_col, client_col]].dropna()
-    client_cohorts = {}
-    for client, group in df_filtered.groupby(client_col):
-        periods = group[year_month_col].dropna().unique()
-        valid = [p for p in periods if p in period_indices]
-        if valid:
-            first_period = min(valid, key=lambda p: period_indices[p])
-            client_cohorts[client] = first_period
+    clients, first_idx = client_cohort_codes(df, year_month_col, client_col, sorted_periods)
     cohort_clients = {period: set() for period in sorted_periods}
-    for client, first_period in client_cohorts.items():
-        cohort_clients[first_period].add(client)
+    for client, idx in zip(clients.tolist(), first_idx.tolist()):
+        cohort_clients[sorted_periods[idx]].add(client)
     return cohort_clients
 
 
+@timed_stage()
 def build_cohort_matrix(df, year_month_col, client_col, value_type='clients'):
     """Строит когортную матрицу по периоду "Год-месяц".
     
@@ -40,18 +35,9 @@ def build_cohort_matrix(df, year_month_col, client_col, value_type='clients'):
     Returns:
         tuple: (matrix_intersection, sorted_periods) - матрица пересечений и отсортированный список периодов
     """
-    unique_periods = df[year_month_col].dropna().unique()
-    periods_with_sort = [(period, parse_period(str(period).strip())) for period in unique_periods]
-    valid_periods = [(p, parsed) for p, parsed in periods_with_sort if parsed != (0, 0, 0)]
-    invalid_periods = [p for p, parsed in periods_with_sort if parsed == (0, 0, 0)]
-    
-    if valid_periods:
-        valid_periods.sort(key=lambda x: (x[1][0], x[1][2], x[1][1]))
-        sorted_periods = [period[0] for period in valid_periods]
-        if invalid_periods:
-            sorted_periods.extend(sorted(invalid_periods))
-    else:
-        sorted_periods = sorted([str(p) for p in unique_periods])
+    sorted_periods = get_sorted_periods(df, year_month_col)
+    if value_type == 'clients':
+        df = canonical_client_frame(df, year_month_col, client_col)
     
     # Период -> множество клиентов в этом периоде (для столбцов)
     period_clients = {}
@@ -91,6 +77,7 @@ def build_cohort_matrix(df, year_month_col, client_col, value_type='clients'):
     return matrix_intersection, sorted_periods
 
 
+@timed_stage()
 def build_accumulation_matrix(df, year_month_col, client_col, sorted_periods):
     """Строит матрицу накопления возврата клиентов.
     
@@ -112,6 +99,7 @@ def build_accumulation_matrix(df, year_month_col, client_col, sorted_periods):
         columns=sorted_periods,
         dtype=int
     )
+    df = canonical_client_frame(df, year_month_col, client_col)
     period_clients_dict = {}
     for period in sorted_periods:
         period_data = df[df[year_month_col] == period]
@@ -142,6 +130,7 @@ def build_accumulation_matrix(df, year_month_col, client_col, sorted_periods):
     return matrix_accumulation
 
 
+@timed_stage()
 def build_accumulation_percent_matrix(accumulation_matrix, cohort_matrix):
     """Строит матрицу накопления возврата в процентах.
     
@@ -190,6 +179,7 @@ def build_accumulation_percent_matrix(accumulation_matrix, cohort_matrix):
     return matrix_percent
 
 
+@timed_stage()
 def build_inflow_matrix(accumulation_percent_matrix):
     """Строит матрицу притока возврата в процентах.
     
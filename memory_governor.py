@@ -0,0 +1,200 @@
+"""
+Модуль учёта памяти сессий и вытеснения тяжёлых данных при превышении общего бюджета
+"""
+import logging
+import sys
+import threading
+import time
+import weakref
+
+import numpy as np
+import pandas as pd
+from config import MEMORY_BUDGET_MB, MEMORY_EVICTION_MIN_IDLE_SEC
+
+logger = logging.getLogger('cohort_analysis.memory')
+
+# Количество элементов, по которым оценивается средний размер элемента контейнера
+_SAMPLE_SIZE = 100
+
+
+def _sampled_size(items, length):
+    """Оценка суммарного размера элементов по первым _SAMPLE_SIZE элементам."""
+    total = 0
+    count = 0
+    for item in items:
+        total += estimate_size(item)
+        count += 1
+        if count >= _SAMPLE_SIZE:
+            break
+    return total / count * length if count else 0
+
+
+def estimate_size(obj):
+    """Приблизительный объём памяти объекта в байтах.
+
+    DataFrame/Series — memory_usage(deep=True), массивы и объекты с атрибутом nbytes
+    (например, ClientActivityMatrix) — nbytes, bytes — длина; размер элементов
+    словарей, множеств и списков оценивается по выборке.
+    """
+    if obj is None:
+        return 0
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, (bytes, bytearray)):
+        return len(obj)
+    if isinstance(obj, np.ndarray) or hasattr(obj, 'nbytes'):
+        return int(obj.nbytes)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + int(
+            _sampled_size(obj.keys(), len(obj)) + _sampled_size(obj.values(), len(obj))
+        )
+    if isinstance(obj, (set, frozenset, list, tuple)):
+        return sys.getsizeof(obj) + int(_sampled_size(obj, len(obj)))
+    return sys.getsizeof(obj)
+
+
+class _Entry:
+    """Запись хранилища: значение, оценка размера и время последнего обращения."""
+
+    __slots__ = ('value', 'size', 'recomputable', 'last_access')
+
+    def __init__(self, value, size, recomputable):
+        self.value = value
+        self.size = size
+        self.recomputable = recomputable
+        self.last_access = time.monotonic()
+
+
+class ArtifactStore:
+    """Хранилище тяжёлых данных одной сессии Streamlit.
+
+    Значения с recomputable=True могут быть вытеснены MemoryGovernor — после этого
+    get() возвращает default, и приложение пересчитывает значение из данных сессии.
+    """
+
+    def __init__(self, governor, session_id):
+        self._governor = governor
+        self.session_id = session_id
+        self._entries = {}
+
+    def get(self, key, default=None):
+        with self._governor.lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            entry.last_access = time.monotonic()
+            return entry.value
+
+    def put(self, key, value, recomputable=True):
+        """Сохраняет значение (None удаляет ключ) и проверяет общий бюджет памяти."""
+        size = estimate_size(value)
+        with self._governor.lock:
+            if value is None:
+                self._entries.pop(key, None)
+                return
+            self._entries[key] = _Entry(value, size, recomputable)
+        self._governor.enforce_budget()
+
+    def clear(self):
+        with self._governor.lock:
+            self._entries.clear()
+
+    @property
+    def nbytes(self):
+        with self._governor.lock:
+            return sum(entry.size for entry in self._entries.values())
+
+    def usage_table(self):
+        """Таблица данных сессии: ключ, размер в МБ, можно ли вытеснить."""
+        with self._governor.lock:
+            rows = [
+                {
+                    'Данные': key,
+                    'Размер, МБ': round(entry.size / (1024 * 1024), 3),
+                    'Пересчитываемые': entry.recomputable,
+                }
+                for key, entry in self._entries.items()
+            ]
+        return pd.DataFrame(rows, columns=['Данные', 'Размер, МБ', 'Пересчитываемые']).sort_values(
+            'Размер, МБ', ascending=False, ignore_index=True
+        )
+
+
+class MemoryGovernor:
+    """Учёт памяти всех сессий процесса и LRU-вытеснение пересчитываемых данных.
+
+    Хранилища сессий регистрируются по слабой ссылке: при удалении сессии Streamlit
+    её хранилище освобождается вместе с session state и перестаёт учитываться.
+    Данные, к которым обращались менее min_idle_sec секунд назад (текущие запуски
+    скриптов), не вытесняются.
+    """
+
+    def __init__(self, budget_mb=MEMORY_BUDGET_MB, min_idle_sec=MEMORY_EVICTION_MIN_IDLE_SEC):
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.min_idle_sec = min_idle_sec
+        self.lock = threading.RLock()
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self._stores = weakref.WeakValueDictionary()
+
+    def create_store(self, session_id):
+        store = ArtifactStore(self, session_id)
+        with self.lock:
+            self._stores[session_id] = store
+        return store
+
+    def total_bytes(self):
+        with self.lock:
+            return sum(store.nbytes for store in list(self._stores.values()))
+
+    def enforce_budget(self):
+        """Вытесняет давно не использованные пересчитываемые данные, пока общий объём выше бюджета.
+
+        Returns:
+            int: количество вытесненных записей
+        """
+        with self.lock:
+            total = self.total_bytes()
+            if total <= self.budget_bytes:
+                return 0
+            now = time.monotonic()
+            candidates = [
+                (entry.last_access, store, key, entry)
+                for store in list(self._stores.values())
+                for key, entry in store._entries.items()
+                if entry.recomputable and now - entry.last_access >= self.min_idle_sec
+            ]
+            candidates.sort(key=lambda item: item[0])
+            evicted = 0
+            for _, store, key, entry in candidates:
+                if total <= self.budget_bytes:
+                    break
+                del store._entries[key]
+                total -= entry.size
+                evicted += 1
+                self.evictions += 1
+                self.evicted_bytes += entry.size
+                logger.info("evicted session=%s key=%s size_mb=%.2f", store.session_id, key, entry.size / (1024 * 1024))
+            if total > self.budget_bytes:
+                logger.warning(
+                    "memory budget exceeded: used_mb=%.1f budget_mb=%.1f (no idle recomputable data to evict)",
+                    total / (1024 * 1024), self.budget_bytes / (1024 * 1024)
+                )
+            return evicted
+
+    def stats(self):
+        """Сводка по процессу: число сессий, занятый объём, бюджет и вытеснения."""
+        with self.lock:
+            return {
+                'sessions': len(self._stores),
+                'used_mb': self.total_bytes() / (1024 * 1024),
+                'budget_mb': self.budget_bytes / (1024 * 1024),
+                'evictions': self.evictions,
+                'evicted_mb': self.evicted_bytes / (1024 * 1024),
+            }
+
+
+# Один учёт памяти на процесс сервера Streamlit (общий для всех сессий)
+governor = MemoryGovernor()
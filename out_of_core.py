@@ -0,0 +1,292 @@
+"""
+Модуль потокового когортного анализа выгрузок, не помещающихся в оперативную память
+
+Пока только библиотека: приложение (app.py) его не вызывает, выгрузка всегда читается в
+память. Точки входа — build_out_of_core_cohorts и python -m benchmarks.out_of_core.
+"""
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+from category_index import _Encoder, _iter_xlsx_rows
+from config import OUT_OF_CORE_CHUNK_ROWS, OUT_OF_CORE_BLOCK_CLIENTS
+from data_processing import build_churn_table
+from instrumentation import timed_stage
+from matrix_builder import build_accumulation_percent_matrix, build_inflow_matrix
+from utils import canonical_client_keys, detect_columns, period_label, sort_periods
+
+
+class ClientStateStore:
+    """Битовые маски активных периодов клиентов в файле на диске (np.memmap).
+
+    Строка — клиент (целочисленный id), бит — период в порядке его первого появления
+    в выгрузке (64 периода на слово uint64). При появлении новых клиентов или периодов
+    файл пересоздаётся с удвоенным размером; в памяти процесса остаются только
+    страницы, с которыми идёт работа.
+
+    Attributes:
+        path: путь к текущему файлу состояния
+        capacity: число строк (клиентов) в файле
+        words: число слов uint64 на клиента
+        n_clients: число клиентов, для которых выделено место
+        bits: массив np.memmap формы (capacity, words)
+    """
+
+    def __init__(self, directory, capacity=65536, words=1):
+        self.directory = directory
+        self.capacity = capacity
+        self.words = words
+        self.n_clients = 0
+        self._generation = 0
+        self.path = self._next_path()
+        self.bits = np.memmap(self.path, dtype=np.uint64, mode='w+', shape=(capacity, words))
+
+    @property
+    def nbytes(self):
+        """Размер файла состояния в байтах."""
+        return self.capacity * self.words * 8
+
+    def _next_path(self):
+        self._generation += 1
+        return os.path.join(self.directory, f"client_state_{self._generation}.bin")
+
+    def reserve(self, n_clients, n_periods):
+        """Гарантирует место для n_clients клиентов и n_periods периодов."""
+        capacity, words = self.capacity, self.words
+        while capacity < n_clients:
+            capacity *= 2
+        while words * 64 < n_periods:
+            words *= 2
+        if (capacity, words) != (self.capacity, self.words):
+            self._reallocate(capacity, words)
+        self.n_clients = max(self.n_clients, n_clients)
+
+    def _reallocate(self, capacity, words):
+        """Переносит состояние в новый файл большего размера блоками по OUT_OF_CORE_BLOCK_CLIENTS строк."""
+        path = self._next_path()
+        bits = np.memmap(path, dtype=np.uint64, mode='w+', shape=(capacity, words))
+        for start in range(0, self.n_clients, OUT_OF_CORE_BLOCK_CLIENTS):
+            stop = min(start + OUT_OF_CORE_BLOCK_CLIENTS, self.n_clients)
+            bits[start:stop, :self.words] = self.bits[start:stop]
+        old_path = self.path
+        self.bits = bits
+        self.path, self.capacity, self.words = path, capacity, words
+        os.remove(old_path)
+
+    def mark(self, client_ids, period_ids):
+        """Отмечает активность клиентов client_ids в периодах period_ids (id появления)."""
+        flat = self.bits.reshape(-1)
+        word_idx = client_ids * self.words + (period_ids >> 6)
+        masks = np.left_shift(np.uint64(1), (period_ids & 63).astype(np.uint64))
+        np.bitwise_or.at(flat, word_idx, masks)
+
+    def iter_blocks(self, n_periods, block_clients=OUT_OF_CORE_BLOCK_CLIENTS):
+        """Блоки булевых матриц активности клиентов (клиенты блока × периоды в порядке появления)."""
+        for start in range(0, self.n_clients, block_clients):
+            words = np.ascontiguousarray(self.bits[start:start + block_clients], dtype='<u8')
+            bits = np.unpackbits(words.view(np.uint8), axis=1, bitorder='little')[:, :n_periods]
+            yield bits.view(bool)
+
+    def close(self):
+        """Закрывает и удаляет файл состояния."""
+        self.bits = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _source_name(source):
+    return source if isinstance(source, (str, os.PathLike)) else getattr(source, 'name', '')
+
+
+def _header_columns(names, year_month_col, client_col):
+    """Столбцы периода и кода клиента: заданные явно или найденные detect_columns по заголовку."""
+    detected = detect_columns(pd.DataFrame(columns=list(names)))
+    return year_month_col or detected[0], client_col or detected[1]
+
+
+def iter_upload_chunks(source, year_month_col=None, client_col=None, chunk_rows=OUT_OF_CORE_CHUNK_ROWS,
+                       sep=',', encoding='utf-8'):
+    """Заголовок и блоки значений периода и кода клиента основной выгрузки.
+
+    .csv читается pandas блоками по chunk_rows строк (все значения — строки), .xlsx — потоково
+    через openpyxl, .xls (не более 65536 строк) — целиком через pandas (xlrd).
+
+    Args:
+        source: путь к файлу или файл с атрибутом name
+        year_month_col: название столбца с периодом (None — определить по заголовку)
+        client_col: название столбца с кодом клиента (None — определить по заголовку)
+        chunk_rows: строк в одном блоке
+        sep: разделитель столбцов .csv
+        encoding: кодировка .csv
+
+    Yields:
+        сначала tuple (year_month_col, client_col) — None, если столбец не найден,
+        затем блоки — tuple (значения периода, значения кода клиента)
+    """
+    name = str(_source_name(source)).lower()
+    if name.endswith('.xlsx'):
+        rows = _iter_xlsx_rows(source)
+        header = next(rows, None) or ()
+        names = [value if value is not None else f"Unnamed: {pos}" for pos, value in enumerate(header)]
+        columns = _header_columns(names, year_month_col, client_col)
+        yield columns
+        if None in columns or not set(columns) <= set(names):
+            rows.close()
+            return
+        period_pos, client_pos = (names.index(col) for col in columns)
+        periods, clients = [], []
+        for row in rows:
+            periods.append(row[period_pos] if period_pos < len(row) else None)
+            clients.append(row[client_pos] if client_pos < len(row) else None)
+            if len(periods) >= chunk_rows:
+                yield periods, clients
+                periods, clients = [], []
+        if periods:
+            yield periods, clients
+        return
+
+    if name.endswith('.xls'):
+        data = pd.read_excel(source, engine='xlrd', dtype=str)
+        columns = _header_columns(data.columns, year_month_col, client_col)
+        yield columns
+        if None not in columns and set(columns) <= set(data.columns):
+            yield data[columns[0]], data[columns[1]]
+        return
+
+    header = pd.read_csv(source, sep=sep, encoding=encoding, nrows=0).columns
+    columns = _header_columns(header, year_month_col, client_col)
+    yield columns
+    if None in columns or not set(columns) <= set(header):
+        return
+    reader = pd.read_csv(
+        source, sep=sep, encoding=encoding, usecols=list(columns), dtype=str, chunksize=chunk_rows
+    )
+    with reader:
+        for chunk in reader:
+            yield chunk[columns[0]], chunk[columns[1]]
+
+
+@timed_stage()
+def accumulate_client_state(chunks, store):
+    """Проходит по блокам выгрузки и отмечает активность клиентов в хранилище состояния.
+
+    Args:
+        chunks: блоки (значения периода, значения кода клиента), см. iter_upload_chunks
+        store: ClientStateStore
+
+    Returns:
+        tuple: (периоды в порядке первого появления, число прочитанных строк)
+    """
+    period_encoder = _Encoder(period_label)
+    client_encoder = _Encoder(canonical_client_keys, vectorized=True)
+    n_rows = 0
+    for period_values, client_values in chunks:
+        n_rows += len(client_values)
+        period_ids = period_encoder.encode(period_values)
+        client_ids = client_encoder.encode(client_values)
+        valid = (period_ids >= 0) & (client_ids >= 0)
+        store.reserve(len(client_encoder), len(period_encoder.values))
+        store.mark(client_ids[valid], period_ids[valid])
+    return period_encoder.values, n_rows
+
+
+@timed_stage()
+def matrices_from_client_state(store, periods, block_clients=OUT_OF_CORE_BLOCK_CLIENTS):
+    """Собирает когортную матрицу и матрицу накопления из битовых масок клиентов.
+
+    Клиенты обрабатываются блоками: когорта — первый активный период в порядке
+    sort_periods, первый возврат — следующий активный период после когорты
+    (как ClientActivityMatrix.cohort_matrix_values / accumulation_matrix_values).
+
+    Args:
+        store: ClientStateStore после accumulate_client_state
+        periods: периоды в порядке первого появления (id периода = позиция)
+        block_clients: клиентов в одном блоке
+
+    Returns:
+        tuple: (sorted_periods, когортная матрица, матрица накопления) — матрицы как DataFrame
+    """
+    sorted_periods = sort_periods(periods)
+    order = pd.Index(periods).get_indexer(sorted_periods)
+    n = len(sorted_periods)
+    cohort_counts = np.zeros(n * n, dtype=np.int64)
+    first_return_counts = np.zeros(n * n, dtype=np.int64)
+    for bits in store.iter_blocks(len(periods), block_clients):
+        active = bits[:, order]
+        active = active[active.any(axis=1)]
+        first_idx = active.argmax(axis=1)
+        rows, cols = np.nonzero(active)
+        cohort_counts += np.bincount(first_idx[rows] * n + cols, minlength=n * n)
+        active[np.arange(len(first_idx)), first_idx] = False
+        returned = active.any(axis=1)
+        first_return = active.argmax(axis=1)
+        first_return_counts += np.bincount(first_idx[returned] * n + first_return[returned], minlength=n * n)
+
+    cohort_values = cohort_counts.reshape(n, n)
+    accumulation_values = np.cumsum(first_return_counts.reshape(n, n), axis=1)
+    accumulation_values[np.arange(n), np.arange(n)] = np.diag(cohort_values)
+    return (
+        sorted_periods,
+        pd.DataFrame(cohort_values, index=sorted_periods, columns=sorted_periods),
+        pd.DataFrame(accumulation_values, index=sorted_periods, columns=sorted_periods),
+    )
+
+
+@timed_stage()
+def build_out_of_core_cohorts(source, year_month_col=None, client_col=None, chunk_rows=OUT_OF_CORE_CHUNK_ROWS,
+                              block_clients=OUT_OF_CORE_BLOCK_CLIENTS, state_dir=None, sep=',', encoding='utf-8'):
+    """Когортные матрицы и таблица оттока выгрузки, читаемой блоками.
+
+    В памяти одновременно находятся блок строк выгрузки и O(клиентов) — словарь кодов
+    клиентов; активность клиентов по периодам хранится в файле np.memmap (ClientStateStore),
+    который удаляется после расчёта.
+
+    Args:
+        source: путь к .csv/.xlsx/.xls или файл с атрибутом name
+        year_month_col: название столбца с периодом (None — определить по заголовку)
+        client_col: название столбца с кодом клиента (None — определить по заголовку)
+        chunk_rows: строк выгрузки в одном блоке
+        block_clients: клиентов в одном блоке при сборке матриц
+        state_dir: каталог для файла состояния (None — временный каталог)
+        sep: разделитель столбцов .csv
+        encoding: кодировка .csv
+
+    Returns:
+        dict: 'sorted_periods', 'cohort_matrix', 'accumulation_matrix', 'accumulation_percent_matrix',
+        'inflow_matrix', 'churn_table', 'rows', 'clients', 'state_bytes';
+        None, если столбцы периода и кода клиента не найдены
+    """
+    chunks = iter_upload_chunks(source, year_month_col, client_col, chunk_rows, sep, encoding)
+    year_month_col, client_col = next(chunks)
+    if year_month_col is None or client_col is None:
+        chunks.close()
+        return None
+
+    with tempfile.TemporaryDirectory(dir=state_dir, prefix='cohort_state_') as directory:
+        store = ClientStateStore(directory)
+        try:
+            periods, n_rows = accumulate_client_state(chunks, store)
+            sorted_periods, cohort_matrix, accumulation_matrix = matrices_from_client_state(
+                store, periods, block_clients
+            )
+            state_bytes = store.nbytes
+        finally:
+            store.close()
+
+    accumulation_percent_matrix = build_accumulation_percent_matrix(accumulation_matrix, cohort_matrix)
+    churn_table = build_churn_table(
+        None, year_month_col, client_col, sorted_periods, cohort_matrix,
+        accumulation_matrix, accumulation_percent_matrix
+    )
+    return {
+        'sorted_periods': sorted_periods,
+        'cohort_matrix': cohort_matrix,
+        'accumulation_matrix': accumulation_matrix,
+        'accumulation_percent_matrix': accumulation_percent_matrix,
+        'inflow_matrix': build_inflow_matrix(accumulation_percent_matrix),
+        'churn_table': churn_table,
+        'rows': n_rows,
+        'clients': int(np.trace(cohort_matrix.to_numpy())),
+        'state_bytes': state_bytes,
+    }
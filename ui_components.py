@@ -186,3 +186,43 @@ def apply_matrix_color_gradient(df, hide_zeros=False, horizontal_dynamics=False,
     
     return styled_df
 
+
+
+def format_summary_table(summary_table, percent_rows=()):
+    """Форматирует числовую сводную таблицу для отображения.
+
+    Счётчики — целые числа, строки из percent_rows — проценты с одним знаком (45.7%),
+    ненаблюдаемые значения (NA) — '-'.
+
+    Args:
+        summary_table: таблица метрики × когорты (build_summary_table)
+        percent_rows: названия строк со значениями в процентах
+
+    Returns:
+        pd.DataFrame: таблица строк для st.dataframe
+    """
+    formatted = {}
+    for row_name, values in summary_table.iterrows():
+        if row_name in percent_rows:
+            formatted[row_name] = ['-' if pd.isna(v) else f"{float(v):.1f}%" for v in values]
+        else:
+            formatted[row_name] = ['-' if pd.isna(v) else f"{int(round(float(v)))}" for v in values]
+    return pd.DataFrame.from_dict(formatted, orient='index', columns=summary_table.columns)
+
+
+def format_churn_table(churn_table):
+    """Форматирует таблицу оттока для отображения: проценты — 45.7%, NA (последняя когорта) — '-'.
+
+    Args:
+        churn_table: таблица оттока (build_churn_table)
+
+    Returns:
+        pd.DataFrame: таблица строк для отображения
+    """
+    formatted = churn_table[['Когорта']].copy()
+    for col in ['Кол-во клиентов когорты', 'Накопительное кол-во возврата', 'Отток кол-во']:
+        formatted[col] = churn_table[col].astype(object).map(lambda v: '-' if pd.isna(v) else str(int(v)))
+    for col in ['Накопительный % возврата', 'Отток %']:
+        formatted[col] = churn_table[col].astype(object).map(lambda v: '-' if pd.isna(v) else f"{float(v):.1f}%")
+    return formatted[['Когорта', 'Кол-во клиентов когорты', 'Накопительное кол-во возврата',
+                      'Накопительный % возврата', 'Отток кол-во', 'Отток %']]
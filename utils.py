@@ -1,11 +1,13 @@
 """
 Утилиты и вспомогательные функции
 """
+import hashlib
 import re
+import numpy as np
 import pandas as pd
-import streamlit.components.v1 as components
 import json
-from config import MONTHS_DICT
+from config import MONTHS_DICT, COPY_BUTTON_MAX_CODES, COPY_PREVIEW_CODES
+from instrumentation import timed_stage
 
 
 def parse_period(period_str):
@@ -104,6 +106,9 @@ def create_copy_button(text, button_label, key):
         button_label: Текст на кнопке
         key: Уникальный ключ для кнопки
     """
+    # Streamlit импортируется только при отрисовке: расчётные модули используют utils без него
+    import streamlit.components.v1 as components
+
     # Очищаем key от специальных символов для использования в JavaScript
     safe_key = re.sub(r'[^a-zA-Z0-9_]', '_', str(key))
     
@@ -226,6 +231,67 @@ def create_copy_button(text, button_label, key):
     components.html(html, height=70)
 
 
+def codes_digest(codes):
+    """Отпечаток списка кодов (хэш значений pandas, без сборки общего текста).
+
+    Returns:
+        str: шестнадцатеричный отпечаток
+    """
+    hashes = pd.util.hash_array(np.asarray(codes, dtype=object))
+    return hashlib.blake2b(hashes.tobytes(), digest_size=16).hexdigest()
+
+
+def _codes_blob(codes, key, blob_store=None):
+    """Содержимое файла со списком кодов.
+
+    В хранилище сессии (memory_governor.ArtifactStore) хранится одно содержимое на кнопку,
+    ключ — отпечаток codes_digest: при перезапуске с тем же списком текст не собирается
+    заново, а данные учитываются в бюджете памяти и вытесняются вместе с остальными.
+    """
+    if blob_store is None:
+        return "\n".join(codes).encode('utf-8')
+    store_key = f'codes_blob:{key}'
+    digest = codes_digest(codes)
+    cached = blob_store.get(store_key)
+    if cached is not None and cached[0] == digest:
+        return cached[1]
+    blob = "\n".join(codes).encode('utf-8')
+    blob_store.put(store_key, (digest, blob))
+    return blob
+
+
+def create_client_codes_output(codes, button_label, key, file_name='коды_клиентов.txt', blob_store=None):
+    """Выводит список кодов клиентов: кнопка копирования или, для больших списков, файл.
+
+    Списки длиннее COPY_BUTTON_MAX_CODES не встраиваются в HTML страницы (это замедляет
+    каждый перезапуск и браузер): показываются количество, первые коды и кнопка
+    скачивания текстового файла.
+
+    Args:
+        codes: список отформатированных кодов клиентов (строки)
+        button_label: текст на кнопке копирования
+        key: уникальный ключ кнопки
+        file_name: имя файла для скачивания большого списка
+        blob_store: хранилище сессии для содержимого файла (None — без кэширования)
+    """
+    import streamlit as st
+
+    if len(codes) <= COPY_BUTTON_MAX_CODES:
+        create_copy_button("\n".join(codes), button_label, key)
+        return
+    count = f"{len(codes):,}".replace(',', ' ')
+    preview = ", ".join(codes[:COPY_PREVIEW_CODES])
+    st.caption(f"Список слишком большой для копирования ({count} кодов), скачайте файл. Первые коды: {preview}, …")
+    st.download_button(
+        label=f"📥 Скачать коды ({count})",
+        data=_codes_blob(codes, key, blob_store),
+        file_name=file_name,
+        mime="text/plain",
+        use_container_width=True,
+        key=f"download_{key}"
+    )
+
+
 def detect_columns(df):
     """Автоматически определяет столбцы периода и клиента в DataFrame.
     
@@ -255,6 +321,19 @@ def detect_columns(df):
     return year_month_col, client_col
 
 
+def period_label(val):
+    """Период в общем виде загрузки: строка без пробелов по краям, пустые значения — ''.
+
+    Применяется один раз при загрузке — к категориям компактной таблицы
+    (ingestion.compact_upload) и к значениям блоков потокового расчёта (out_of_core),
+    поэтому ' 2024-янв' и '2024-янв' в обоих режимах — один период.
+    """
+    if val is None or (isinstance(val, float) and pd.isna(val)):
+        return ''
+    return str(val).strip()
+
+
+@timed_stage()
 def get_sorted_periods(df, year_month_col):
     """Возвращает список периодов в том же порядке, что и matrix_builder (для согласованной когорты).
     
@@ -265,12 +344,26 @@ def get_sorted_periods(df, year_month_col):
     Returns:
         list: отсортированный список периодов
     """
-    unique_periods = df[year_month_col].dropna().unique()
-    periods_with_sort = [(p, parse_period(str(p).strip())) for p in unique_periods]
+    return sort_periods(df[year_month_col].dropna().unique())
+
+
+def sort_periods(unique_periods):
+    """Сортирует уникальные периоды: сначала распознанные по (год, тип, номер), затем остальные.
+
+    Разные записи одного периода ('2023/02' и '2023-W02') упорядочиваются по тексту, а не
+    по первому появлению: порядок не зависит от порядка строк и сжатия выгрузки.
+
+    Args:
+        unique_periods: уникальные непустые значения периода
+
+    Returns:
+        list: отсортированный список периодов
+    """
+    periods_with_sort = [(p, parse_period(period_label(p))) for p in unique_periods]
     valid_periods = [(p, parsed) for p, parsed in periods_with_sort if parsed != (0, 0, 0)]
     invalid_periods = [p for p, parsed in periods_with_sort if parsed == (0, 0, 0)]
     if valid_periods:
-        valid_periods.sort(key=lambda x: (x[1][0], x[1][2], x[1][1]))
+        valid_periods.sort(key=lambda x: (x[1][0], x[1][2], x[1][1], str(x[0])))
         sorted_periods = [p[0] for p in valid_periods]
         if invalid_periods:
             sorted_periods.extend(sorted(invalid_periods))
@@ -298,10 +391,16 @@ def get_period_after_label(sorted_periods):
     return 'недели' if parsed[2] == 1 else 'месяца'
 
 
+# Целый код в текстовом виде: '196107', '+196107', '196107.0'
+_INTEGER_CODE = re.compile(r'([+-]?\d+)(?:\.0*)?')
+
+
 def normalize_client_code(val):
     """Приводит код клиента к единому строковому виду для сравнения между файлами.
     
     Убирает пробелы; числа приводит к целому и строке, чтобы '196107' и '196107.0' совпадали.
+    Целые числа и строки из цифр переводятся без float, поэтому коды длиннее 15 цифр
+    не теряют младшие разряды.
     
     Args:
         val: значение из столбца (число или строка)
@@ -311,15 +410,88 @@ def normalize_client_code(val):
     """
     if val is None or (isinstance(val, float) and pd.isna(val)):
         return ''
+    if isinstance(val, (int, np.integer)) and not isinstance(val, bool):
+        return str(int(val))
     s = str(val).strip().replace(' ', '')
     if not s:
         return ''
+    digits = _INTEGER_CODE.fullmatch(s)
+    if digits:
+        return str(int(digits.group(1)))
     try:
         return str(int(float(s)))
-    except (ValueError, TypeError):
+    except (ValueError, TypeError, OverflowError):
         return s
 
 
+# Целые коды до 2**53 точно представимы в float64 (pd.to_numeric строк)
+_MAX_EXACT_CODE = 2 ** 53
+
+
+def canonical_client_keys(values):
+    """Канонические ключи кодов клиентов: int для числовых кодов, строка для остальных.
+
+    '196107', '196107.0' и 196107 дают один ключ 196107, остальные коды приводятся
+    normalize_client_code (пустой код — ''). Ключи основного файла и файла категорий
+    совпадают, поэтому файлы сопоставляются по ключам без нормализации каждого значения.
+    Коды от 2**53 и больше переводятся в int поштучно, без float, и остаются различимыми.
+
+    Args:
+        values: уникальные значения столбца кода клиента
+
+    Returns:
+        np.ndarray: ключи в порядке values (dtype=object)
+    """
+    uniques = pd.Series(values, dtype=object)
+    numeric = pd.to_numeric(uniques, errors='coerce').to_numpy(dtype=float)
+    integral = np.isfinite(numeric) & (numeric == np.floor(numeric)) & (np.abs(numeric) < _MAX_EXACT_CODE)
+    keys = np.empty(len(uniques), dtype=object)
+    keys[integral] = numeric[integral].astype(np.int64).tolist()
+    for pos in np.flatnonzero(~integral):
+        value = normalize_client_code(uniques.iat[pos])
+        keys[pos] = int(value) if _INTEGER_CODE.fullmatch(value) else value
+    return keys
+
+
+def client_key_array(keys):
+    """Массив уникальных канонических ключей: int64, если все ключи числовые и помещаются в int64, иначе dtype=object."""
+    keys = np.asarray(keys, dtype=object)
+    if all(type(key) is int for key in keys.tolist()):
+        try:
+            return keys.astype(np.int64)
+        except OverflowError:
+            return keys
+    return keys
+
+
+def format_client_code_for_copy(val):
+    """Форматирует код клиента для копирования: без десятичной части (347520 вместо 347520.0)."""
+    if val is None or (isinstance(val, float) and pd.isna(val)):
+        return ""
+    if isinstance(val, (int, np.integer)) and not isinstance(val, bool):
+        return str(val)
+    if isinstance(val, str):
+        digits = _INTEGER_CODE.fullmatch(val.strip())
+        if digits:
+            return str(int(digits.group(1)))
+    try:
+        return str(int(float(val)))
+    except (ValueError, TypeError, OverflowError):
+        return str(val).strip()
+
+
+def format_client_codes(clients):
+    """format_client_code_for_copy для массива кодов; целочисленный массив форматируется одним преобразованием.
+
+    Returns:
+        np.ndarray: строковые коды (dtype=object)
+    """
+    clients = np.asarray(clients)
+    if clients.dtype.kind in 'iu':
+        return clients.astype(str).astype(object)
+    return np.array([format_client_code_for_copy(c) for c in clients.tolist()], dtype=object)
+
+
 def normalize_period_for_compare(val):
     """Приводит период к каноническому виду для сравнения между файлами.
     
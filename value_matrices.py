@@ -0,0 +1,76 @@
+"""
+Модуль матриц когорт, взвешенных по числовому показателю выгрузки (выручка, количество)
+"""
+import numpy as np
+import pandas as pd
+from instrumentation import timed_stage
+
+# Виды взвешенных матриц (ключи словаря build_value_matrices)
+VALUE_TOTAL = 'Сумма показателя когорты'
+VALUE_PER_CLIENT = 'Показатель на активного клиента'
+VALUE_LTV = 'Накопленный показатель на клиента (LTV)'
+
+
+@timed_stage()
+def cohort_value_totals(df, year_month_col, client_col, value_col, activity_matrix):
+    """Сумма показателя по когорте × периоду.
+
+    Строки выгрузки переводятся в целочисленные (когорта, период) по матрице активности
+    и суммируются одним groupby; клиенты и периоды, которых нет в матрице (например,
+    вне окна периодов), не учитываются.
+
+    Args:
+        df: DataFrame с данными (исходный или компактный, ingestion.compact_upload)
+        year_month_col: название столбца с периодом
+        client_col: название столбца с кодом клиента
+        value_col: название числового столбца
+        activity_matrix: матрица активности (ClientActivityMatrix), задающая периоды и когорты
+
+    Returns:
+        np.ndarray: массив P × P, строки — когорты, столбцы — периоды
+    """
+    n = activity_matrix.n_periods
+    totals = np.zeros((n, n), dtype=float)
+    rows = df[[year_month_col, client_col, value_col]].dropna(subset=[year_month_col, client_col])
+    client_ids = activity_matrix.client_ids(rows[client_col])
+    period_idx = activity_matrix.period_ids(rows[year_month_col])
+    known = (client_ids >= 0) & (period_idx >= 0)
+    if not known.any():
+        return totals
+    cohort_idx = activity_matrix.first_period_idx()[client_ids[known]]
+    values = pd.to_numeric(rows[value_col], errors='coerce').to_numpy()[known]
+    sums = pd.Series(values).groupby([cohort_idx, period_idx[known]]).sum()
+    totals[sums.index.get_level_values(0), sums.index.get_level_values(1)] = sums.to_numpy()
+    return totals
+
+
+@timed_stage()
+def build_value_matrices(df, year_month_col, client_col, value_col, activity_matrix):
+    """Строит взвешенные матрицы когорт по числовому показателю.
+
+    - сумма показателя когорты в периоде;
+    - показатель на активного клиента: сумма / клиенты когорты, активные в периоде;
+    - накопленный показатель на клиента (LTV): накопительная сумма по периодам / размер когорты.
+
+    Args:
+        df: DataFrame с данными
+        year_month_col: название столбца с периодом
+        client_col: название столбца с кодом клиента
+        value_col: название числового столбца
+        activity_matrix: матрица активности (ClientActivityMatrix)
+
+    Returns:
+        dict: вид матрицы -> DataFrame (когорты × периоды), в порядке VALUE_TOTAL, VALUE_PER_CLIENT, VALUE_LTV
+    """
+    periods = activity_matrix.periods
+    totals = cohort_value_totals(df, year_month_col, client_col, value_col, activity_matrix)
+    active_clients = activity_matrix.cohort_matrix_values()
+    cohort_sizes = np.diag(active_clients).astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        per_client = np.where(active_clients > 0, totals / active_clients, 0.0)
+        ltv = np.where(cohort_sizes[:, None] > 0, np.cumsum(totals, axis=1) / cohort_sizes[:, None], 0.0)
+    return {
+        VALUE_TOTAL: pd.DataFrame(totals, index=periods, columns=periods),
+        VALUE_PER_CLIENT: pd.DataFrame(per_client, index=periods, columns=periods),
+        VALUE_LTV: pd.DataFrame(ltv, index=periods, columns=periods),
+    }